@@ -2,7 +2,9 @@ from sparse_row import SparseRow
 from sparse_elim import ElimMatrix, lcm, EquationIndex
 from math import floor
 from fractions import Fraction
-from geo_object import eps_identical
+import numpy as np
+from geo_object import eps_identical, epsilon
+from undo_trail import DummyTrail
 
 """
 AngleChasing is a superstructure of ElimMatrix in sparse_elim specifically
@@ -25,19 +27,25 @@ the rest is encoded using a SparseRow.
 """
 
 class AngleChasing:
-    def __init__(self):
-        self.elim = ElimMatrix()
+    def __init__(self, trail = None, provenance = True):
+        if trail is None: trail = DummyTrail()
+        self.trail = trail
+        # without provenance, the moduli are multiples of the exact ones,
+        # which is still correct since the values are checked numerically
+        self.elim = ElimMatrix(trail, provenance = provenance)
         self.equal_to = dict() # var -> root, frac_dist
         self.root_to_vars = dict() # root -> size, dict( frac_diff -> var_list )
         self.value = dict() # var -> value
+        self.version = 0 # increased by every modification, used for caching queries
 
     # var is the variable (geometrical reference)
     # value is a numerical value (object of type Angle)
     def add_var(self, var, value):
         #print("    angles.add_var({}, {})".format(var, value))
-        self.value[var] = value
-        self.equal_to[var] = var, Fraction(0)
-        self.root_to_vars[var] = 1, { Fraction(0) : [var] }
+        self.version += 1
+        self.trail.set_item(self.value, var, value)
+        self.trail.set_item(self.equal_to, var, (var, Fraction(0)))
+        self.trail.set_item(self.root_to_vars, var, (1, { Fraction(0) : [var] }))
 
     def query(self, equation, frac_offset):
         #print("    print(angles.query(SparseRow({}), Fraction({})))".format(
@@ -48,6 +56,41 @@ class AngleChasing:
 
         return self.num_check(equation, frac_offset)
 
+    # the same as [self.query(eq, frac_offset) for ...] for lists
+    # of equations and frac_offsets, returns a list of booleans
+    def query_many(self, equations, frac_offsets):
+        denoms = self.elim.query_many(equations)
+        candidates = [
+            i for i,(denom, frac_offset) in enumerate(zip(denoms, frac_offsets))
+            if denom != 0 and denom % frac_offset.denominator == 0
+        ]
+        res = [False]*len(equations)
+        checked = self.num_check_many(
+            [equations[i] for i in candidates],
+            [frac_offsets[i] for i in candidates],
+        )
+        for i, ok in zip(candidates, checked): res[i] = bool(ok)
+        return res
+
+    # vectorized num_check, returns a numpy array of booleans
+    def num_check_many(self, equations, frac_offsets):
+        eq_indices = []
+        values = []
+        coefs = []
+        for i,equation in enumerate(equations):
+            for v,coef in equation.items():
+                if isinstance(v, EquationIndex): continue
+                assert(coef.denominator == 1)
+                eq_indices.append(i)
+                values.append(self.value[v])
+                coefs.append(coef.numerator)
+        num_vals = np.bincount(
+            eq_indices, weights = np.multiply(values, coefs), minlength = len(equations),
+        ) if eq_indices else np.zeros(len(equations))
+        num_vals += np.array(frac_offsets, dtype = float)
+        num_vals = (num_vals+0.5) % 1 - 0.5
+        return np.abs(num_vals) < epsilon
+
     def num_check(self, equation, frac_offset):
         num_val = 0
         for v,coef in equation.items():
@@ -75,6 +118,7 @@ class AngleChasing:
         #    equation, frac_offset
         #))
         assert(self.num_check(equation, frac_offset))
+        self.version += 1
         denom = frac_offset.denominator
         if denom > 1: equation *= denom
         changed, to_glue = self.elim.add(equation)
@@ -101,14 +145,16 @@ class AngleChasing:
 
             for fd2, y_var_list in y_dict.items():
                 fd_sum = (fd2 + frac_dist)%1
-                for y_var in y_var_list: self.equal_to[y_var] = x, fd_sum
-                x_var_list = x_dict.setdefault(fd_sum, y_var_list)
-                if x_var_list is not y_var_list:
+                for y_var in y_var_list:
+                    self.trail.set_item(self.equal_to, y_var, (x, fd_sum))
+                x_var_list = x_dict.get(fd_sum)
+                if x_var_list is None: self.trail.set_item(x_dict, fd_sum, y_var_list)
+                else:
                     to_glue_out.append((x_var_list[0], y_var_list[0]))
-                    x_var_list.extend(y_var_list)
+                    self.trail.list_extend(x_var_list, y_var_list)
 
-            del self.root_to_vars[y]
-            self.root_to_vars[x] = (x_size + y_size), x_dict
+            self.trail.del_item(self.root_to_vars, y)
+            self.trail.set_item(self.root_to_vars, x, ((x_size + y_size), x_dict))
 
         return to_glue_out
 
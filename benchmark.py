@@ -0,0 +1,379 @@
+#!/usr/bin/python3
+
+"""
+Benchmarks of the logical core on saved constructions, run as
+  python3 benchmark.py (ufd | triggers | trigger_stats | proof_check | proof_slices | plans) [files.gl ...]
+(by default, all the files in saved/levels are used)
+
+ufd: memory of the lookup table (bytes per stored fact),
+     and the latency of looking up all the stored facts
+triggers: time of loading the files with the handcoded triggers (TriggerEnv)
+          and with the triggers compiled from triggers.gl (RuleTriggerEnv)
+trigger_stats: the rules / search scripts of both triggers taking the most time
+               on every file (see trigger_profile.py)
+proof_check: time of loading the files with the proof checks run directly
+             (with and without the cache of the checked configurations),
+             in the thread of the proof checker, and in a pool of processes
+proof_slices: the minimal slices of the proofs of the lemmas used in the files,
+              and the time saved by checking only the slices
+plans: time of running the composite tools by ToolStepEnv
+       and by compiled execution plans
+
+Benchmarks of the algebraic engines on recorded streams of operations
+(see equation_stream.py), run as
+  python3 benchmark.py record output.stream.gz [files.gl ...]
+  python3 benchmark.py replay [files.stream.gz ...]
+(by default, the streams in saved/streams are replayed)
+
+record: records all the engines used while loading the given files,
+        including the proof checks
+replay: replays the streams on all the engines in stream_engines,
+        reports operations per second, peak memory and the fill
+        of the matrices, and checks that the engines of the same kind
+        give the same results
+"""
+
+import sys, os, glob, time, tracemalloc
+from basic_tools import load_tools
+from parse import Parser
+from logical_core import LogicalCore
+import tool_step
+from tool_step import ToolStepEnv, ProofChecker, CompositeTool
+from tools import ToolError
+from proof_cache import proof_cache
+from triggers import TriggerEnv, RuleTriggerEnv
+from trigger_profile import TriggerProfile
+from sparse_elim import ElimMatrix
+from angle_chasing import AngleChasing
+from equation_stream import StreamRecorder, read_streams, replay
+
+# builds a logical core with all the steps of a saved construction
+def load_logic(tools, fname, **logic_args):
+    parser = Parser(tools.tool_dict)
+    parser.parse_file(fname, axioms = True)
+    loaded_tool = parser.tool_dict['_', ()]
+    logic = LogicalCore(basic_tools = tools, **logic_args)
+    step_env = ToolStepEnv(logic)
+    step_env.run_steps(loaded_tool.assumptions, 1, catch_errors = True)
+    if loaded_tool.proof is not None:
+        step_env.run_steps(loaded_tool.proof, 1, catch_errors = True)
+    return logic
+
+# memory of a structure made of dicts, sets, lists, tuples, bytes and ints,
+# every object is counted once, labels (tools) are skipped
+def deep_size(x, seen):
+    if id(x) in seen: return 0
+    seen.add(id(x))
+    size = sys.getsizeof(x)
+    if isinstance(x, dict):
+        for key, value in x.items():
+            size += deep_size(key, seen) + deep_size(value, seen)
+    elif isinstance(x, (set, frozenset, list, tuple)):
+        for item in x: size += deep_size(item, seen)
+    return size
+
+def benchmark_ufd(tools, fnames, repeat = 20):
+    total_facts = total_bytes = total_lookups = 0
+    total_time = 0.
+    for fname in fnames:
+        ufd = load_logic(tools, fname).ufd
+        seen = set(id(label) for label in ufd.label_to_id.keys())
+        size = deep_size(ufd.data, seen) + deep_size(ufd.obj_to_keys, seen)
+        queries = [key for key,_ in ufd.items()]
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for label, args in queries: ufd.get(label, args)
+        lookup_time = time.perf_counter() - start
+        facts = len(ufd.data)
+        print("{:40} facts {:6}   bytes / fact {:6.1f}   lookup {:6.3f} us".format(
+            os.path.basename(fname), facts, size / facts,
+            lookup_time / (repeat * facts) * 1e6,
+        ))
+        total_facts += facts
+        total_bytes += size
+        total_lookups += repeat * facts
+        total_time += lookup_time
+    print("{:40} facts {:6}   bytes / fact {:6.1f}   lookup {:6.3f} us".format(
+        "TOTAL", total_facts, total_bytes / total_facts,
+        total_time / total_lookups * 1e6,
+    ))
+
+def benchmark_triggers(tools, fnames, repeat = 3):
+    triggers_classes = TriggerEnv, RuleTriggerEnv
+    default_class = LogicalCore.triggers_class
+    total_times = [0.]*len(triggers_classes)
+    for fname in fnames:
+        times = []
+        for triggers_class in triggers_classes:
+            # set for the class, so that also the cores inside proof checks use it
+            LogicalCore.triggers_class = triggers_class
+            start = time.perf_counter()
+            for _ in range(repeat): load_logic(tools, fname)
+            times.append((time.perf_counter() - start) / repeat)
+        LogicalCore.triggers_class = default_class
+        print("{:40} {}".format(os.path.basename(fname), "   ".join(
+            "{} {:7.3f} s".format(triggers_class.__name__, t)
+            for triggers_class, t in zip(triggers_classes, times)
+        )))
+        total_times = [t1+t2 for t1,t2 in zip(total_times, times)]
+    print("{:40} {}".format("TOTAL", "   ".join(
+        "{} {:7.3f} s".format(triggers_class.__name__, t)
+        for triggers_class, t in zip(triggers_classes, total_times)
+    )))
+
+def benchmark_trigger_stats(tools, fnames, limit = 5):
+    triggers_classes = TriggerEnv, RuleTriggerEnv
+    default_class = LogicalCore.triggers_class
+    totals = dict((triggers_class, TriggerProfile()) for triggers_class in triggers_classes)
+    for fname in fnames:
+        print(os.path.basename(fname))
+        for triggers_class in triggers_classes:
+            LogicalCore.triggers_class = triggers_class
+            profile = TriggerProfile()
+            profile.enable()
+            try: load_logic(tools, fname)
+            finally: profile.disable()
+            print(" ", triggers_class.__name__)
+            profile.print_stats(limit)
+            total_stats = totals[triggers_class].stats
+            for name, entry in profile.stats.items():
+                total = total_stats.setdefault(name, [0, 0, 0, 0.])
+                for i,x in enumerate(entry): total[i] += x
+        LogicalCore.triggers_class = default_class
+    print("TOTAL")
+    for triggers_class in triggers_classes:
+        print(" ", triggers_class.__name__)
+        totals[triggers_class].print_stats()
+
+# time of loading the files with the proof checks run directly
+# (with and without the cache of proof_cache.py),
+# in the checker thread, and in a pool of worker processes
+def benchmark_proof_check(tools, fnames, processes = None):
+    if processes is None: processes = max(2, os.cpu_count())
+    default_checker = tool_step.proof_checker
+    backends = (
+        ("direct, no cache", None, False),
+        ("direct", None, True),
+        ("thread", 1, True),
+        ("{} processes".format(processes), processes, True),
+    )
+    for name, backend_processes, cache_enabled in backends:
+        checker = ProofChecker()
+        if backend_processes is not None: checker.paralelize(processes = backend_processes)
+        tool_step.proof_checker = checker
+        proof_cache.clear()
+        proof_cache.enabled = cache_enabled
+        try:
+            # the first round starts the workers
+            for fname in fnames: load_logic(tools, fname)
+            checker.wait()
+            checked_num = checker.checked_num
+            start = time.perf_counter()
+            for fname in fnames: load_logic(tools, fname)
+            checker.wait()
+            total_time = time.perf_counter() - start
+        finally:
+            tool_step.proof_checker = default_checker
+            proof_cache.enabled = True
+        print("{:16} {:6} proof checks   {:.3f} s   cache hits {:6}   misses {:6}".format(
+            name, checker.checked_num - checked_num, total_time,
+            proof_cache.hits, proof_cache.misses,
+        ))
+
+# proof checker only collecting the requested checks
+class ProofCheckRecorder(ProofChecker):
+    def __init__(self):
+        ProofChecker.__init__(self)
+        self.checks = [] # list of (tool, num_args)
+    def check(self, tool, num_args):
+        if self.disabled: return
+        self.checks.append((tool, num_args))
+
+# minimal proof slices (see tool_step.py) of the lemmas used in the files,
+# and the time of their proof checks with the full and the sliced proof
+# (without the nested proof checks)
+def benchmark_proof_slices(tools, fnames):
+    default_checker = tool_step.proof_checker
+    recorder = ProofCheckRecorder()
+    tool_step.proof_checker = recorder
+    try:
+        for fname in fnames: load_logic(tools, fname)
+        # nested proof checks
+        for tool, num_args in recorder.checks:
+            try: tool.check_proof_steps(num_args)
+            except ToolError: pass
+        recorder.disable()
+        tool_to_checks = dict()
+        for tool, num_args in recorder.checks:
+            tool_to_checks.setdefault(tool, []).append(num_args)
+
+        total_full = total_sliced = total_analysis = 0
+        print("{:25} {:>5} {:>13} {:>7} {:>10} {:>10} {:>10} {:>9}".format(
+            "lemma", "steps", "slices", "checks", "full", "sliced", "analysis", "fallbacks",
+        ))
+        for tool, checks in tool_to_checks.items():
+            if not tool.proof: continue
+            try: tool.check_proof_steps(checks[0])
+            except ToolError: continue
+            start = time.perf_counter()
+            proof_slices = tool.find_proof_slices(checks[0])
+            analysis_time = time.perf_counter() - start
+            proof_slice = set().union(*proof_slices)
+
+            start = time.perf_counter()
+            for num_args in checks:
+                try: tool.check_proof_steps(num_args)
+                except ToolError: pass
+            full_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            fallbacks = 0
+            for num_args in checks:
+                try: tool.check_proof_steps(num_args, proof_slice)
+                except ToolError:
+                    fallbacks += 1
+                    try: tool.check_proof_steps(num_args)
+                    except ToolError: pass
+            sliced_time = time.perf_counter() - start
+
+            print("{:25} {:5} {:>13} {:7} {:9.4f}s {:9.4f}s {:9.4f}s {:9}".format(
+                tool.name, len(tool.proof),
+                "{} ({})".format(len(proof_slice), ",".join(str(len(x)) for x in proof_slices)),
+                len(checks), full_time, sliced_time, analysis_time, fallbacks,
+            ))
+            total_full += full_time
+            total_sliced += sliced_time
+            total_analysis += analysis_time
+        print("TOTAL full {:.3f} s, sliced {:.3f} s, saved {:.3f} s, analysis {:.3f} s".format(
+            total_full, total_sliced, total_full - total_sliced, total_analysis,
+        ))
+    finally: tool_step.proof_checker = default_checker
+
+# time of loading the files with CompositeTool run by ToolStepEnv and by ExecutionPlan
+# (see tool_step.py), the proof checks are run directly, without proof_cache
+def benchmark_plans(tools, fnames, repeat = 5):
+    default_use_plans = CompositeTool.use_plans
+    # number of the composite tool runs (the inlined ones are not called by the plans)
+    calls = [0]
+    run_no_mem = CompositeTool.run_no_mem
+    def counted_run_no_mem(tool, *args):
+        calls[0] += 1
+        return run_no_mem(tool, *args)
+    CompositeTool.run_no_mem = counted_run_no_mem
+    CompositeTool.use_plans = False
+    try:
+        for fname in fnames: load_logic(tools, fname)
+    finally:
+        CompositeTool.run_no_mem = run_no_mem
+        CompositeTool.use_plans = default_use_plans
+
+    cache_enabled = proof_cache.enabled
+    proof_cache.enabled = False
+    times = dict()
+    try:
+        for use_plans in (False, True):
+            CompositeTool.use_plans = use_plans
+            best_time = None
+            for _ in range(repeat):
+                start = time.perf_counter()
+                for fname in fnames: load_logic(tools, fname)
+                total_time = time.perf_counter() - start
+                if best_time is None or total_time < best_time: best_time = total_time
+            times[use_plans] = best_time
+    finally:
+        CompositeTool.use_plans = default_use_plans
+        proof_cache.enabled = cache_enabled
+    print("{} composite tool runs".format(calls[0]))
+    print("ToolStepEnv    {:.3f} s".format(times[False]))
+    print("ExecutionPlan  {:.3f} s".format(times[True]))
+    print("saved {:.2f} us per run".format((times[False] - times[True]) / calls[0] * 1e6))
+
+def record_streams(tools, fnames, out_fname):
+    with StreamRecorder(out_fname) as recorder:
+        for fname in fnames: load_logic(tools, fname)
+    print("{} streams recorded to {}".format(recorder.stream_num, out_fname))
+
+# engines for replaying the streams, name -> (kind, constructor),
+# the first engine of every kind is the reference for the results
+stream_engines = {
+    "elim column" : ("elim", lambda: ElimMatrix(pivot_strategy = "column")),
+    "elim markowitz" : ("elim", lambda: ElimMatrix(pivot_strategy = "markowitz")),
+    "elim resparsify" : ("elim", lambda: ElimMatrix(resparsify_period = 20)),
+    "elim no provenance" : ("elim", lambda: ElimMatrix(provenance = False)),
+    "angles" : ("angles", lambda: AngleChasing()),
+    "angles no provenance" : ("angles", lambda: AngleChasing(provenance = False)),
+}
+
+def replay_streams(fnames, engines = stream_engines):
+    streams = []
+    for fname in fnames: streams.extend(read_streams(fname))
+    reference = dict() # kind -> list of results
+    for name, (kind, constructor) in engines.items():
+        kind_streams = [ops for (k, ops) in streams if k == kind]
+        num_ops = sum(len(ops) for ops in kind_streams)
+
+        # speed
+        start = time.perf_counter()
+        results = []
+        engine_stats = []
+        for ops in kind_streams:
+            engine = constructor()
+            results.append(replay(kind, ops, engine))
+            if kind == "angles": engine = engine.elim
+            engine_stats.append(engine.stats())
+        total_time = time.perf_counter() - start
+
+        # memory, measured separately since tracemalloc slows down the replay
+        peak_memory = 0
+        for ops in kind_streams:
+            tracemalloc.start()
+            replay(kind, ops, constructor())
+            peak_memory = max(peak_memory, tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+
+        if kind not in reference:
+            reference[kind] = results
+            check = "reference"
+        else:
+            different = sum(
+                1 for res, ref_res in zip(results, reference[kind])
+                if res != ref_res
+            )
+            check = "OK" if different == 0 else "{} streams DIFFERENT".format(different)
+
+        print("{:22} {:6} ops {:9.0f} ops/s   peak {:7.1f} KB   nnz {:6}   longest row {:4}   fill {:6}   {}".format(
+            name, num_ops, num_ops / total_time, peak_memory / 1024,
+            sum(stats["nnz"] for stats in engine_stats),
+            max((stats["longest_row"] for stats in engine_stats), default = 0),
+            sum(stats["fill_total"] for stats in engine_stats),
+            check,
+        ))
+
+if __name__ == "__main__":
+    usage = """Usage:
+  {0} (ufd | triggers | trigger_stats | proof_check | proof_slices | plans) [files.gl ...]
+  {0} record output.stream.gz [files.gl ...]
+  {0} replay [files.stream.gz ...]""".format(sys.argv[0])
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+    fnames = sys.argv[2:]
+    if command in ("ufd", "triggers", "trigger_stats", "proof_check", "proof_slices", "plans"):
+        if not fnames: fnames = sorted(glob.glob("saved/levels/*.gl"))
+        benchmarks = {
+            "ufd" : benchmark_ufd,
+            "triggers" : benchmark_triggers,
+            "trigger_stats" : benchmark_trigger_stats,
+            "proof_check" : benchmark_proof_check,
+            "proof_slices" : benchmark_proof_slices,
+            "plans" : benchmark_plans,
+        }
+        benchmarks[command](load_tools("macros.gl"), fnames)
+    elif command == "record" and fnames:
+        out_fname, *fnames = fnames
+        if not fnames: fnames = sorted(glob.glob("saved/levels/*.gl"))
+        record_streams(load_tools("macros.gl"), fnames, out_fname)
+    elif command == "replay":
+        if not fnames: fnames = sorted(glob.glob("saved/streams/*.stream.gz"))
+        replay_streams(fnames)
+    else:
+        print(usage)
+        sys.exit(1)
@@ -0,0 +1,149 @@
+import gzip
+from fractions import Fraction
+from sparse_row import SparseRow
+from sparse_elim import ElimMatrix
+from angle_chasing import AngleChasing
+
+"""
+Recording and replaying of the streams of operations done on the
+algebraic engines (ElimMatrix, AngleChasing), used for benchmarking
+and comparing their implementations (see benchmark.py).
+
+The recorder
+  with StreamRecorder(fname):
+      ... (a session with logical cores)
+temporarily wraps the methods of ElimMatrix and AngleChasing, and
+writes all the engines created in the session into a text file
+(gzipped if the name ends with .gz). Every engine obtains a stream
+number, and every line of the file is one of the following:
+  <n> elim                  new ElimMatrix (also the ones inside AngleChasing)
+  <n> angles                new AngleChasing
+  <n> add <row>             ElimMatrix.add
+  <n> query <row>           ElimMatrix.query
+  <n> var <x> <value>       AngleChasing.add_var
+  <n> postulate <c> <row>   AngleChasing.postulate with frac_offset c
+  <n> check <c> <row>       AngleChasing.query with frac_offset c
+where <row> is a sequence of "variable:coefficient".
+
+read_streams(fname) returns the list of streams (kind, list of operations),
+and replay(kind, operations, engine) runs them on a given engine.
+The results of replay are comparable between different implementations:
+booleans instead of denominators and glued pairs, and the final partition
+of the variables given by the glued pairs.
+"""
+
+def _open(fname, mode):
+    if fname.endswith(".gz"): return gzip.open(fname, mode+"t")
+    else: return open(fname, mode)
+
+def _row_to_str(row):
+    return ' '.join("{}:{}".format(x, coef) for x,coef in row.items())
+def _row_from_strs(strs):
+    res = SparseRow(())
+    for s in strs:
+        x, coef = s.split(':')
+        res[int(x)] = Fraction(coef)
+    return res
+
+class StreamRecorder:
+    def __init__(self, fname):
+        self.fname = fname
+
+    def __enter__(self):
+        self.f = _open(self.fname, "w")
+        self.stream_num = 0
+        self.originals = []
+        self._wrap(ElimMatrix, "__init__", self._record_init("elim"))
+        self._wrap(ElimMatrix, "add", self._record_row("add"))
+        self._wrap(ElimMatrix, "query", self._record_row("query"))
+        self._wrap(AngleChasing, "__init__", self._record_init("angles"))
+        self._wrap(AngleChasing, "add_var", self._record_var)
+        self._wrap(AngleChasing, "postulate", self._record_frac_row("postulate"))
+        self._wrap(AngleChasing, "query", self._record_frac_row("check"))
+        return self
+
+    def __exit__(self, *exc):
+        for cls, name, method in self.originals: setattr(cls, name, method)
+        self.f.close()
+
+    def _wrap(self, cls, name, record):
+        method = getattr(cls, name)
+        self.originals.append((cls, name, method))
+        def wrapped(engine, *args, **kwargs):
+            record(engine, *args, **kwargs)
+            return method(engine, *args, **kwargs)
+        setattr(cls, name, wrapped)
+
+    def _write(self, engine, *data):
+        n = getattr(engine, "_stream_num", None)
+        if n is None: return # created before recording
+        self.f.write(' '.join(map(str, (n,)+data))+'\n')
+
+    def _record_init(self, kind):
+        def record(engine, *args, **kwargs):
+            engine._stream_num = self.stream_num
+            self.stream_num += 1
+            self._write(engine, kind)
+        return record
+    def _record_row(self, op):
+        def record(engine, row):
+            self._write(engine, op, _row_to_str(row))
+        return record
+    def _record_frac_row(self, op):
+        def record(engine, row, frac_offset):
+            self._write(engine, op, Fraction(frac_offset), _row_to_str(row))
+        return record
+    def _record_var(self, engine, var, value):
+        self._write(engine, "var", var, repr(float(value)))
+
+def read_streams(fname):
+    streams = []
+    with _open(fname, "r") as f:
+        for line in f:
+            n, op, *data = line.split()
+            n = int(n)
+            if op in ("elim", "angles"):
+                assert(n == len(streams))
+                streams.append((op, []))
+                continue
+            ops = streams[n][1]
+            if op in ("add", "query"): ops.append((op, _row_from_strs(data)))
+            elif op == "var": ops.append((op, int(data[0]), float(data[1])))
+            else: ops.append((op, _row_from_strs(data[1:]), Fraction(data[0])))
+    return streams
+
+# returns a list of results, and the final partition of the glued variables
+def replay(kind, operations, engine):
+    results = []
+    glued = dict() # union-find
+    def root(x):
+        while x in glued: x = glued[x]
+        return x
+    def glue(pairs):
+        for x,y in pairs:
+            x,y = root(x), root(y)
+            if x != y: glued[x] = y
+
+    if kind == "elim":
+        for op, row in operations:
+            if op == "add":
+                changed, to_glue = engine.add(row)
+                glue((x,y) for x,y,_ in to_glue)
+                results.append(changed)
+            else: results.append(engine.query(row) != 0)
+    else:
+        for op, *args in operations:
+            if op == "var": engine.add_var(*args)
+            elif op == "postulate":
+                row, frac_offset = args
+                glue(engine.postulate(SparseRow(row), frac_offset)) # postulate can modify the row
+            else:
+                row, frac_offset = args
+                results.append(engine.query(row, frac_offset))
+
+    classes = dict()
+    for x in glued.keys():
+        r = root(x)
+        classes.setdefault(r, {r}).add(x)
+    partition = set(frozenset(c) for c in classes.values())
+    return results, partition
@@ -3,12 +3,14 @@
 import gi as gtk_import
 gtk_import.require_version("Gtk", "3.0")
 from gi.repository import Gtk, Gdk, GLib
+import os
 import numpy as np
 from geo_object import *
 from parse import Parser, type_to_c
 import primitive_pred
 from collections import defaultdict
 from tool_step import ToolStep, proof_checker
+from proof_cache import proof_cache, ProofStore
 from file_chooser import select_file_open, select_file_save, add_svg_filters
 from stop_watch import print_times, StopWatch
 from itertools import islice
@@ -31,6 +33,10 @@ class GeoLogic(Gtk.Window):
         super(GeoLogic, self).__init__()
 
         self.imported_tools = load_tools("macros.gl")
+        # configurations with checked proofs, kept across sessions
+        self.proof_store = ProofStore("macros_proofs.json")
+        self.proof_store.prune(self.imported_tools.tool_dict.values())
+        proof_cache.store = self.proof_store
         self.env = GraphicalEnv(self.imported_tools)
         self.vis = self.env.vis
         self.general_tools = GToolDict(self.imported_tools.tool_dict)
@@ -86,7 +92,10 @@ class GeoLogic(Gtk.Window):
             return False
         def update_progress_bar_idle(done, size):
             GLib.idle_add(update_progress_bar, done, size)
-        proof_checker.paralelize(progress_hook = update_progress_bar_idle)
+        proof_checker.paralelize(
+            progress_hook = update_progress_bar_idle,
+            processes = os.cpu_count(),
+        )
         
         self.progress_bar = Gtk.ProgressBar(show_text=False)
         vbox.pack_end(self.progress_bar, False, False, 0)
@@ -149,6 +158,7 @@ class GeoLogic(Gtk.Window):
         if fname is not None: self.viewport.export_svg(fname)
     def on_exit(self, *args):
         print_times()
+        self.proof_store.save()
         Gtk.main_quit()
 
     def load_file(self, fname):
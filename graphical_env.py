@@ -15,6 +15,21 @@ KnowledgeVisualisation contained in the GraphicalEnv to extract
 the data to be drawn.
 
 The logical core self.logic is contained in a StepEnv: self.step_env.
+The logical core is undoable, before running every step, a checkpoint
+of the logical core is stored to self.checkpoints. Undo, or a failed
+step are then handled by a rollback instead of running all the steps again.
+
+Dragging a movable object (GToolMove) uses the dependencies between steps
+(given by local_args and local_outputs). On the first motion of dragging,
+the steps after the dragged one that do not depend on it are run first,
+then a checkpoint is made, and on every motion only the dragged step and
+the steps depending on it are run again. After the dragging is finished,
+the steps are run again in the original order.
+If num_preview is set, the logical core is not touched during dragging at all,
+only the numerical values of the dependent steps are recomputed
+(Tool.run_num), and KnowledgeVisualisation draws them as a preview.
+The logic is updated after the dragging is finished. A click without
+any motion does not touch the logic at all.
 
 The objects here are primarily viewed as "GUI indices" (gi)
 which correspond to local indices in a StepEnv. There are also
@@ -73,6 +88,8 @@ class GraphicalEnv:
         self.goals = None
         self.gi_to_step_i = []
         self.gi_to_name = []
+        self.drag_data = None
+        self.num_preview = True # dragging mode, see above
 
         # build logic and step_env
         self.refresh_steps()
@@ -133,7 +150,7 @@ class GraphicalEnv:
         # update = False if we will immediatelly add another steps
         try:
             ori_len = len(self.step_env.local_to_global)
-            self.step_env.run_steps((step,), 1)
+            self.run_step(step)
             new_len = len(self.step_env.local_to_global)
             self.gi_to_step_i += [len(self.steps)]*len(step.tool.out_types)
             self.vis.add_gis(len(step.tool.out_types))
@@ -151,9 +168,10 @@ class GraphicalEnv:
             print("Applied: {}".format(step.tool.name))
             return tuple(range(ori_len, new_len))
         except ToolError as e:
+            self.rollback_step()
             if isinstance(e, ToolErrorException): raise e.e
             print("Tool '{}' failed: {}".format(step.tool.name, e))
-            self.refresh_steps()
+            self.vis.refresh()
             return None
 
     def pop_step(self): # undo
@@ -171,7 +189,9 @@ class GraphicalEnv:
             del self.gi_to_step_i[i:]
             self.vis.truncate_gis(i)
         self.redo_stack.append((step, names))
-        self.refresh_steps()
+        self.rollback_step()
+        self.check_goals()
+        self.vis.refresh()
     def redo(self):
         if not self.redo_stack:
             print("Redo stack is empty")
@@ -183,7 +203,7 @@ class GraphicalEnv:
         self.vis.add_gis(len(step.tool.out_types))
         self.gi_to_name.extend(names)
         self.steps.append(step)
-        self.step_env.run_steps((step,), 1, catch_errors = True)
+        self.run_step(step, catch_errors = True)
         self.check_goals()
 
         self.vis.refresh()
@@ -192,15 +212,128 @@ class GraphicalEnv:
     # reset the logical core and run all steps (with all proof checks)
     def refresh_steps(self, catch_errors = True):
         proof_checker.reset()
-        self.logic = LogicalCore(basic_tools = self.tools)
+        self.logic = LogicalCore(basic_tools = self.tools, undoable = True)
         self.step_env = ToolStepEnv(self.logic)
+        self.checkpoints = []
         self.vis.set_logic(self.logic, self.step_env.local_to_global)
-        self.step_env.run_steps(self.steps, 1, catch_errors = catch_errors)
+        for step in self.steps: self.run_step(step, catch_errors = catch_errors)
         self.check_goals()
         self.vis.refresh()
+
+    # run a single step, storing a checkpoint before it
+    def run_step(self, step, catch_errors = False):
+        self.checkpoints.append((
+            self.logic.checkpoint(),
+            len(self.step_env.local_to_global),
+        ))
+        self.step_env.run_steps((step,), 1, catch_errors = catch_errors)
+    # return the logical core to the state before the last run step
+    def rollback_step(self):
+        self.rollback_to(len(self.checkpoints)-1)
+    # return the logical core to the state before running the step of a given index
+    def rollback_to(self, step_i):
+        checkpoint, l2g_len = self.checkpoints[step_i]
+        del self.checkpoints[step_i:]
+        self.logic.rollback(checkpoint)
+        del self.step_env.local_to_global[l2g_len:]
+
+    # indices of steps depending on the step step_i (including step_i), in the original order
+    def dependent_steps(self, step_i):
+        dependent_gis = set(self.steps[step_i].local_outputs)
+        res = [step_i]
+        for i in range(step_i+1, len(self.steps)):
+            step = self.steps[i]
+            if any(gi in dependent_gis for gi in step.local_args):
+                dependent_gis.update(step.local_outputs)
+                res.append(i)
+        return res
+
+    # run a step of a given index and place its output to the preallocated local_to_global
+    def run_step_in_place(self, step_i):
+        step = self.steps[step_i]
+        l2g = self.step_env.local_to_global
+        subresult = self.step_env.run_step(step, 1, catch_errors = True)
+        for gi, li in zip(step.local_outputs, subresult): l2g[gi] = li
+
+    ### dragging
+
+    def start_drag(self, step):
+        if self.drag_data is not None: self.finish_drag()
+        step_i = self.steps.index(step)
+        dependent = self.dependent_steps(step_i)
+        proof_checker.disable()
+
+        base = self.checkpoints[step_i]
+        # the logic is touched only on the first motion (update_drag),
+        # so a click without dragging leaves it as it is
+        self.drag_data = step_i, base, dependent, False, None
+        if self.num_preview:
+            self.preview_nums = [
+                self.vis.gi_to_num(gi)
+                for gi in range(len(self.gi_to_step_i))
+            ]
+
+    # run the steps independent of the dragged one, and make a checkpoint
+    def prepare_drag(self, step_i, dependent):
+        dependent_s = set(dependent)
+        self.rollback_to(step_i)
+        l2g = self.step_env.local_to_global
+        l2g.extend([None]*(len(self.gi_to_step_i) - len(l2g)))
+        for i in range(step_i+1, len(self.steps)):
+            if i not in dependent_s: self.run_step_in_place(i)
+        return self.logic.checkpoint()
+
+    # recompute the dragged object and objects depending on it
+    def update_drag(self):
+        step_i, base, dependent, moved, checkpoint = self.drag_data
+        if self.num_preview:
+            self.drag_data = step_i, base, dependent, True, None
+            self.update_preview(dependent)
+            return
+        if not moved:
+            checkpoint = self.prepare_drag(step_i, dependent)
+            self.drag_data = step_i, base, dependent, True, checkpoint
+        self.logic.rollback(checkpoint)
+        for i in dependent: self.run_step_in_place(i)
+        self.check_goals()
+        self.vis.refresh()
+
+    def update_preview(self, dependent):
+        nums = self.preview_nums
+        for i in dependent:
+            step = self.steps[i]
+            num_args = tuple(nums[gi] for gi in step.local_args)
+            num_outs = [None]*len(step.local_outputs)
+            if None not in num_args:
+                try:
+                    num_outs = step.tool.run_num(step.hyper_params, num_args)
+                except ToolError: # degenerate construction
+                    pass
+            for gi, num in zip(step.local_outputs, num_outs): nums[gi] = num
+        self.vis.preview_refresh(nums)
+
+    def finish_drag(self):
+        if self.drag_data is None: return
+        step_i, (checkpoint, l2g_len), _, moved, _ = self.drag_data
+        self.drag_data = None
+        self.preview_nums = None
+        proof_checker.enable()
+        if not moved: return # just a click, nothing changed
+
+        # run the steps in the original order again
+        self.logic.rollback(checkpoint)
+        del self.checkpoints[step_i:]
+        del self.step_env.local_to_global[l2g_len:]
+        for step in self.steps[step_i:]: self.run_step(step, catch_errors = True)
+        self.check_goals()
+        self.vis.refresh()
+
     def check_goals(self):
         if self.goals is None: return
-        self.step_env.run_steps(self.goals, 1, catch_errors = True)
+        # goals are run in a separate environment so that their outputs
+        # do not mix with the GUI indices of the main steps
+        goal_env = ToolStepEnv(self.logic, self.step_env.local_to_global)
+        goal_env.run_steps(self.goals, 1, catch_errors = True)
         if all(goal.success for goal in self.goals):
             print("Goals accomplished")
         else: print("Goals are not accomplished yet...")
@@ -361,11 +361,15 @@ class GToolMove(GTool):
         num_res = self.vis.gi_to_num(obj),
         grasp = step.tool.get_grasp(coor, *num_args+num_res)
         self.drag = self.move_obj, step, grasp, num_args
-        self.drag_start = self.move_start
+        self.drag_start = self.move_start, step
 
-    def move_start(self):
+    def move_start(self, step):
+        self.env.start_drag(step)
+        self.viewport.set_cursor_by_tool()
+        self.on_reset = self.move_finish
+    def move_finish(self):
+        self.env.finish_drag()
         self.viewport.set_cursor_by_tool()
-        self.on_reset = self.viewport.set_cursor_by_tool
 
     def move_obj(self, coor, step, grasp, num_args):
         tool = step.tool
@@ -374,7 +378,7 @@ class GToolMove(GTool):
             intersections = tool.ordered_candidates(num_args)
             i, = step.hyper_params
             self.hl_propose(Point(intersections[1-i]))
-        self.env.refresh_steps(catch_errors = True)
+        self.env.update_drag()
         self.env.update_hyperpar_hook(step)
 
     def enter(self, viewport):
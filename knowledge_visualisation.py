@@ -1,4 +1,6 @@
 from movable_tools import MovableTool
+from primitive_pred import not_collinear
+from primitive_constr import circumcircle
 from collections import defaultdict
 import itertools
 from geo_object import *
@@ -545,6 +547,10 @@ class KnowledgeVisualisation:
         # when selection changes, StepList wants to recognize it too
         self.update_selected_hook = lambda: None
 
+        # numerical preview during dragging: li -> numerical object
+        # overriding the numerical model of the logical core, see preview_refresh
+        self.preview = None
+
         # static dictionary
         self.angle_label_to_larg = {
             self.tools.angle_ll : (True, True),
@@ -633,6 +639,9 @@ class KnowledgeVisualisation:
         return self.li_root(li)
 
     def li_to_num(self, li): # logic index to numerical object
+        if self.preview is not None:
+            num = self.preview.get(li, None)
+            if num is not None: return num
         return self.logic.num_model[li]
 
     def li_to_type(self, li): # logic index to type
@@ -784,7 +793,7 @@ class KnowledgeVisualisation:
         angle_to_data = defaultdict(list)
 
         # points on lines and circles
-        for (label, args), out in self.logic.ufd.data.items():
+        for (label, args), out in self.logic.ufd.items():
             if label is self.tools.lies_on_l:
                 p,l = args
                 if p in self.li_to_gi_first: self.line_to_points[l].append(p)
@@ -793,7 +802,7 @@ class KnowledgeVisualisation:
                 if p in self.li_to_gi_first: self.circle_to_points[c].append(p)
 
         zero_angle = Angle(0)
-        for (label, args), out in self.logic.ufd.data.items():
+        for (label, args), out in self.logic.ufd.items():
             if label is self.tools.arc_length:   #### arc length
                 p1,p2,c = args
                 if p1 not in self.li_to_gi_first or p2 not in self.li_to_gi_first:
@@ -803,8 +812,8 @@ class KnowledgeVisualisation:
                     continue
                 angle_to_data[a].append(ArcData(self, p1,p2,c))
             elif label is self.tools.dist:         #### distance
-                p1,p2 = args
-                if p1 >= p2: continue
+                p1,p2 = args # stored only in one order
+                if p1 == p2: continue
                 if p1 not in self.li_to_gi_first or p2 not in self.li_to_gi_first:
                     continue
                 d, = out
@@ -1046,7 +1055,8 @@ class KnowledgeVisualisation:
                     self.obj_color(obj),
                     points,
                 )
-                exported = num_data.num_obj, extras
+                if self.preview is None: exported = num_data.num_obj, extras
+                else: exported = self.li_to_num(obj), extras
                 if num_data.is_active:
                     add_label(obj)
                     active.append(exported)
@@ -1068,6 +1078,7 @@ class KnowledgeVisualisation:
 
     def refresh(self):
 
+        self.preview = None
         self.update_rev_links()
         self.select_visible_points()
 
@@ -1087,6 +1098,37 @@ class KnowledgeVisualisation:
 
         self.visible_export()
 
+    # Quick update of the exported data during dragging.
+    # The visible objects are kept from the last refresh,
+    # only their numerical values are taken from gi_to_num
+    # (the logical core is not updated at this moment).
+    # Clines which are not GUI objects are recomputed from their points,
+    # and the decorations (angles, distances, ...) are not shown.
+    def preview_refresh(self, gi_to_num):
+        self.preview = dict()
+        for gi, num in enumerate(gi_to_num):
+            if num is None: continue
+            li = self.gi_to_li(gi)
+            if li is not None: self.preview.setdefault(li, num)
+
+        for line, points in self.line_to_points.items():
+            if line in self.preview or len(points) < 2: continue
+            p1, p2 = (self.li_to_num(p) for p in points[:2])
+            if not p1.identical_to(p2):
+                self.preview[line] = line_passing_points(p1, p2)
+        for circle, points in self.circle_to_points.items():
+            if circle in self.preview or len(points) < 3: continue
+            p1, p2, p3 = (self.li_to_num(p) for p in points[:3])
+            if not_collinear(p1, p2, p3):
+                self.preview[circle] = circumcircle(p1, p2, p3)
+
+        self.visible_angles = []
+        self.visible_arcs = []
+        self.visible_dists = []
+        self.visible_exact_angles = []
+        self.visible_parallels = []
+        self.visible_export()
+
     ## Highlights / selection / noticing change in the view
 
     def update_hl_selected(self, selected):
@@ -1174,8 +1216,9 @@ class KnowledgeVisualisation:
         gi_first = self.li_to_gi_first[li]
         gi_last = self.li_to_gi_last[li]
         print("hide li {} in range {} -- {}".format(li, gi_first, gi_last))
+        members = set(self.logic.ufd.class_members(li))
         for gi in range(gi_first, gi_last+1):
-            if self.gi_to_li(gi) == li:
+            if self.gi_to_li_l[gi] in members:
                 print("  hide gi {}".format(gi))
                 self.gi_to_hidden[gi] = True
         self.refresh()
@@ -3,10 +3,13 @@ from geo_object import Angle, Ratio
 from sparse_row import SparseRow, equality_sr
 from sparse_elim import EquationIndex, ElimMatrix
 from angle_chasing import AngleChasing
-from uf_dict import UnionFindDict
+from uf_dict import UnionFindDict, UnionFindArrayDict
 from fractions import Fraction
-from triggers import TriggerEnv, RelStrEnv
+from triggers import TriggerEnv, RuleTriggerEnv, RelStrEnv
 from stop_watch import StopWatch
+from lru_cache import LRUCache
+from num_index import NumIndex
+from undo_trail import UndoTrail, DummyTrail
 
 # Returns list of pairs (prime, exponent), used for ratio equations
 def prime_decomposition(n):
@@ -39,19 +42,76 @@ and a fractional constant.
   Angles: the general equation is of the form x_1*c_1 + x_2*c_2 + ...  + const = 0
 """
 
+"""
+If the logical core is created with undoable = True, all the modifications
+are recorded to an UndoTrail, and it is possible to return to an earlier state by
+  cp = logic.checkpoint()
+  ... (adding objects, postulating facts)
+  logic.rollback(cp)
+without rebuilding the logical core from scratch.
+
+The lookup table can be given a different union-find backend by ufd_class,
+e.g. UnionFindArrayDict storing the classes in compact integer arrays.
+
+The denominators of the derived ratio equations are never used,
+so the ratios are eliminated without provenance (see ElimMatrix),
+the same can be set for angles by angle_provenance = False
+(the angle moduli are then multiples of the exact ones).
+"""
+
+"""
+The results of check_angle_equation and check_ratio_equation are cached
+in query_cache under the equation mapped to the representative objects.
+Every cached result remembers the version of AngleChasing / ElimMatrix
+it was computed with, and it is valid only until the next modification.
+"""
+
+"""
+num_index is a spatial hash of num_model (see NumIndex), for fast
+numerical equality tests and lookups of numerically equal objects.
+"""
+
+"""
+The triggers are by default the handcoded ones (TriggerEnv), the triggers
+compiled from the rules in triggers.gl can be used by setting
+  LogicalCore.triggers_class = RuleTriggerEnv
+"""
+
+"""
+The triggers are normally applied after every added relation and every glue.
+Inside
+  with logic.batch():
+      ... (adding relations, gluing)
+the relations and glued objects are only collected, and passed to the triggers
+at the end of the (outermost) batch, followed by one run of the triggers.
+Meanwhile, the facts derived by the triggers are not available, so the batch
+is meant for postulating (strictness 0), not for checking.
+"""
+
 class LogicalCore():
-    def __init__(self, basic_tools = None):
+    triggers_class = TriggerEnv # RuleTriggerEnv for the triggers compiled from triggers.gl
+
+    def __init__(self, basic_tools = None, undoable = False, ufd_class = UnionFindDict,
+                 angle_provenance = True):
+        if undoable: self.trail = UndoTrail()
+        else: self.trail = DummyTrail()
         self.obj_types = [] # array : geometrical reference -> type (Point, Line, ...)
         self.num_model = [] # array : geometrical reference -> numerical representation (object of the type)
-        self.ratios = ElimMatrix() # known equation about distances / ratios
+        self.num_index = NumIndex(self.num_model, self.trail) # spatial hash of num_model
+        self.ratios = ElimMatrix(self.trail, provenance = False) # known equation about distances / ratios
         self.ratio_consts = dict() # prime number -> reference to a ratio object representing it
-        self.angles = AngleChasing() # known equation about angles
-        self.ufd = UnionFindDict() # lookup table for memoized tools
+        self.angles = AngleChasing(self.trail, angle_provenance) # known equation about angles
+        self.ufd = ufd_class(self.trail) # lookup table for memoized tools
+        self.query_cache = LRUCache(4096, "query cache")
+        self._batch = LogicalBatch(self)
+        self.batch_depth = 0
+        self.batch_relations = [] # (label, data) added during the batch
+        self.batch_moved = [] # objects glued to other objects during the batch
 
         # for using triggers, we need to have access to the basic tools
         # if we don't have it, triggers are not applied (RelStrEnv is a dummy structure)
         if basic_tools is None: self.triggers = RelStrEnv(self)
-        self.triggers = TriggerEnv(basic_tools, self)
+        self.triggers = self.triggers_class(basic_tools, self)
 
         # zero angle
         self.exact_angle = self.add_obj(Angle(0))
@@ -60,9 +120,9 @@ class LogicalCore():
     # given a numerical representation, create a new geometrical reference
     def add_obj(self, num_obj):
         index = len(self.num_model)
-        self.num_model.append(num_obj)
+        self.trail.list_append(self.num_model, num_obj)
         t = type(num_obj)
-        self.obj_types.append(t)
+        self.trail.list_append(self.obj_types, t)
         if t == Angle: self.angles.add_var(index, num_obj.data)
         #print("add {} : {}".format(index, t.__name__))
         return index
@@ -70,6 +130,41 @@ class LogicalCore():
     def add_objs(self, num_objs):
         return tuple(self.add_obj(obj) for obj in num_objs)
 
+    ### undo functions, available only if the logical core is undoable
+
+    def checkpoint(self):
+        return self.trail.checkpoint()
+    def rollback(self, checkpoint):
+        self.trail.rollback(checkpoint)
+        self.triggers.clear_queue()
+        self.query_cache.clear()
+        self.batch_relations = []
+        self.batch_moved = []
+
+    ### batch of modifications, the triggers are applied at its end
+
+    def batch(self):
+        return self._batch
+
+    def _commit_batch(self):
+        relations, moved = self.batch_relations, self.batch_moved
+        if not (relations or moved): return
+        self.batch_relations = []
+        self.batch_moved = []
+        if moved:
+            obj_to_root = self.ufd.obj_to_root
+            tup_to_root = self.ufd.tup_to_root
+            self.triggers.glue_nodes(dict(
+                (x, obj_to_root(x))
+                for x in moved
+            ))
+            relations = [
+                (identifier, tup_to_root(data))
+                for identifier, data in relations
+            ]
+        for identifier, data in relations: self.triggers.add(identifier, data)
+        self.triggers.run()
+
     ### checking functions, they do not modify the logical core
 
     def check_equal(self, obj1, obj2): # equality
@@ -77,11 +172,21 @@ class LogicalCore():
     def get_constr(self, identifier, args): # lookup table
         return self.ufd.get(identifier, args)
     def check_angle_equation(self, equation : SparseRow, frac_const : Fraction):
-        return self.angles.query(equation, frac_const)
+        key = self._query_key("angle", equation, frac_const)
+        version, res = self.query_cache.get(key) or (None, None)
+        if version == self.angles.version: return res
+        res = self.angles.query(equation, frac_const)
+        self.query_cache.set(key, (self.angles.version, res))
+        return res
     def check_ratio_equation(self, equation : SparseRow, frac_const : Fraction):
-        equation = self._make_ratio_equation(equation, frac_const, new_const = False)
-        if equation is None: return False
-        return bool(self.ratios.query(equation))
+        key = self._query_key("ratio", equation, frac_const)
+        version, res = self.query_cache.get(key) or (None, None)
+        if version == self.ratios.version: return res
+        ratio_equation = self._make_ratio_equation(equation, frac_const, new_const = False)
+        if ratio_equation is None: res = False
+        else: res = bool(self.ratios.query(ratio_equation))
+        self.query_cache.set(key, (self.ratios.version, res))
+        return res
 
     ### postulating functions
 
@@ -90,6 +195,9 @@ class LogicalCore():
         self._glue_reaction([(obj1, obj2)])
     def add_constr(self, identifier, args, vals): # lookup table
         args, vals = self.ufd.add(identifier, args, vals)
+        if self.batch_depth:
+            self.batch_relations.append((identifier, args+vals))
+            return
         self.triggers.add(identifier, args+vals)
         self.triggers.run()
     def add_angle_equation(self, equation : SparseRow, frac_const : Fraction):
@@ -105,6 +213,12 @@ class LogicalCore():
 
     ### helper functions
 
+    # key of an equation in the query_cache
+    def _query_key(self, label, equation, frac_const):
+        obj_to_root = self.ufd.obj_to_root
+        equation = SparseRow((obj_to_root(x), coef) for x,coef in equation.items())
+        return label, frozenset(equation.items()), frac_const
+
     """
     _glue_reaction expects a list of the form of pairs (a,b)
     where a,b are geometrical references proven to be equal.
@@ -139,6 +253,9 @@ class LogicalCore():
                     )
             else: break
 
+        if self.batch_depth:
+            self.batch_moved.extend(dnodes_moved)
+            return
         self.triggers.glue_nodes(dict(
             (x, self.ufd.obj_to_root(x))
             for x in dnodes_moved
@@ -156,10 +273,21 @@ class LogicalCore():
         for d,_ in primes:
             if d not in self.ratio_consts:
                 if new_const:
-                    self.ratio_consts[d] = self.add_obj(Ratio((np.log(d), 0)))
+                    self.trail.set_item(self.ratio_consts, d, self.add_obj(Ratio((np.log(d), 0))))
                 else: return None
         equation = equation + SparseRow(
             (self.ratio_consts[d], Fraction(p))
             for d,p in primes
         )
         return equation
+
+# context manager returned by LogicalCore.batch(), can be nested
+class LogicalBatch:
+    def __init__(self, logic):
+        self.logic = logic
+    def __enter__(self):
+        self.logic.batch_depth += 1
+    def __exit__(self, *exception_data):
+        logic = self.logic
+        logic.batch_depth -= 1
+        if not logic.batch_depth: logic._commit_batch()
@@ -0,0 +1,43 @@
+from collections import OrderedDict
+from stop_watch import count
+
+"""
+LRUCache is a dictionary of a bounded size, if it is full,
+the least recently used item is forgotten. Values are stored by
+  cache.set(key, value)
+and retrieved by
+  cache.get(key)
+which returns None if the key is not in the cache.
+If the cache has a name, the hits and misses are counted
+by the StopWatch counters ("<name> hit", "<name> miss").
+"""
+
+class LRUCache:
+    def __init__(self, size, name = None):
+        self.size = size
+        self.name = name
+        self.data = OrderedDict()
+        if name is None: self.hit_label = self.miss_label = None
+        else:
+            self.hit_label = name+" hit"
+            self.miss_label = name+" miss"
+
+    def get(self, key):
+        value = self.data.get(key)
+        if value is None:
+            if self.miss_label is not None: count(self.miss_label)
+            return None
+        self.data.move_to_end(key)
+        if self.hit_label is not None: count(self.hit_label)
+        return value
+
+    def set(self, key, value):
+        self.data[key] = value
+        self.data.move_to_end(key)
+        if len(self.data) > self.size: self.data.popitem(last = False)
+
+    def clear(self):
+        self.data.clear()
+
+    def __len__(self):
+        return len(self.data)
@@ -48,15 +48,19 @@ class MovableTool(Tool):
 
     def run(self, hyper_params, obj_args, logic, strictness):
         num_args = tuple(logic.num_model[arg] for arg in obj_args)
-        num_outs = self.num_eval(*(hyper_params+num_args))
-        if len(self.out_types) == 1 and not isinstance(num_outs, (list, tuple)):
-            num_outs = num_outs,
+        num_outs = self.run_num(hyper_params, num_args)
         assert(len(num_outs) == len(self.out_types))
         outs = logic.add_objs(num_outs)
         self.add_corollaries(logic, *(obj_args+outs))
         
         return outs
 
+    def run_num(self, hyper_params, num_args):
+        num_outs = self.num_eval(*(tuple(hyper_params)+tuple(num_args)))
+        if len(self.out_types) == 1 and not isinstance(num_outs, (list, tuple)):
+            num_outs = num_outs,
+        return tuple(num_outs)
+
 class FreePoint(MovableTool):
 
     def __init__(self, basic_tools):
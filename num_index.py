@@ -0,0 +1,88 @@
+import math
+from itertools import product
+from geo_object import epsilon, Angle, Line
+from undo_trail import DummyTrail
+
+"""
+NumIndex is a spatial hash of the numerical objects of a logical core
+(num_model), using the same epsilon grid as find_duplicities
+(num_duplicities.py) or KnowledgeVisualisation.get_num_point.
+Every object has its cell = tuple of floor(coordinate / epsilon).
+Two numerically identical objects (identical_to) have cells differing
+by at most one in every coordinate, so
+  index.equal(obj1, obj2)
+calls identical_to only if the cells are close, and
+  index.find_equal(num_obj)
+returns the objects numerically identical to num_obj by looking only
+into the neighbouring cells.
+A line is identical also to the line with the opposite data, and an angle
+is taken modulo 1, so they have also alternative cells for the comparison.
+
+Most of the objects are never compared, so the cells are computed
+only when needed, and the objects added to num_model since the last
+find_equal are put into the hash at the next find_equal.
+"""
+
+_angle_cells = int(round(1 / epsilon))
+
+# returns the list of cells of a numerical object, the first one is the main one
+def num_cells(num_obj):
+    if type(num_obj) == Angle:
+        cell = int(math.floor((float(num_obj.data) % 1) / epsilon)) % _angle_cells
+        if cell == 0: return [(cell,), (_angle_cells,)]
+        elif cell == _angle_cells-1: return [(cell,), (-1,)]
+        else: return [(cell,)]
+    data = num_obj.data.tolist()
+    cells = [tuple(math.floor(x / epsilon) for x in data)]
+    if type(num_obj) == Line:
+        cells.append(tuple(math.floor(-x / epsilon) for x in data))
+    return cells
+
+class NumIndex:
+    def __init__(self, num_model, trail = None):
+        if trail is None: trail = DummyTrail()
+        self.trail = trail
+        self.num_model = num_model
+        self.cells = dict() # obj -> list of cells
+        self.buckets = dict() # (type, main cell) -> list of objects
+        self.hashed_num = 0 # the objects below are in the buckets
+
+    def obj_cells(self, obj):
+        cells = self.cells.get(obj)
+        if cells is None:
+            cells = num_cells(self.num_model[obj])
+            self.trail.set_item(self.cells, obj, cells)
+        return cells
+
+    def _update_buckets(self):
+        num_model = self.num_model
+        if self.hashed_num == len(num_model): return
+        for obj in range(self.hashed_num, len(num_model)):
+            key = type(num_model[obj]), self.obj_cells(obj)[0]
+            self.trail.list_append(self.buckets.setdefault(key, []), obj)
+        self.trail.save_attr(self, "hashed_num")
+        self.hashed_num = len(num_model)
+
+    def equal(self, obj1, obj2):
+        cell1 = self.obj_cells(obj1)[0]
+        for cell2 in self.obj_cells(obj2):
+            for x1,x2 in zip(cell1, cell2):
+                if not -1 <= x1-x2 <= 1: break
+            else:
+                return self.num_model[obj1].identical_to(self.num_model[obj2])
+        return False
+
+    # objects numerically identical to num_obj
+    def find_equal(self, num_obj):
+        self._update_buckets()
+        t = type(num_obj)
+        res = []
+        for cell in num_cells(num_obj):
+            for offset in product((-1,0,1), repeat = len(cell)):
+                bucket = self.buckets.get((t, tuple(x+d for x,d in zip(cell, offset))))
+                if bucket is None: continue
+                res.extend(
+                    obj for obj in bucket
+                    if obj not in res and self.num_model[obj].identical_to(num_obj)
+                )
+        return res
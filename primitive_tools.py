@@ -38,12 +38,17 @@ class CustomRatio(Tool):
         Tool.__init__(self, (float, float), (), (Ratio,), "custom_ratio")
     def run(self, hyper_params, obj_args, logic, strictness):
         return logic.add_obj(Ratio(hyper_params)),
+    def run_num(self, hyper_params, num_args):
+        return Ratio(hyper_params),
 class CustomAngle(Tool):
     def __init__(self):
         Tool.__init__(self, (float,), (), (Angle,), "custom_angle")
     def run(self, hyper_params, obj_args, logic, strictness):
         float_angle, = hyper_params
         return logic.add_obj(Angle(float_angle)),
+    def run_num(self, hyper_params, num_args):
+        float_angle, = hyper_params
+        return Angle(float_angle),
 
 """
 The following function is used for analyzing functions in
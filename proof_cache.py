@@ -0,0 +1,244 @@
+import math, json, os
+import threading, hashlib
+import numpy as np
+from geo_object import epsilon, Point, Line, Circle, Angle, Ratio
+from lru_cache import LRUCache
+
+"""
+ProofCache remembers the configurations on which the proof of a composite
+tool was already checked successfully (see CompositeTool.proof_check).
+A configuration is given by the numerical values of the tool arguments,
+it is first normalized by a similarity transform
+  x -> scale * rot * (x - origin)
+where origin is the first point (or circle center), and the next point
+different from the origin (a point, circle center, or the foot of
+the perpendicular from the origin to a line) is moved to distance 1
+and rotated to the direction (1,0).
+Then the numbers are rounded to multiples of epsilon, so the key of
+a configuration is invariant under translation, rotation and scaling.
+Lengths (Ratio with dim > 0) are scaled as well.
+Angle objects can be both directions of lines (changed by rotation),
+and differences of directions (invariant), so if there is an angle
+among the arguments, the configuration is not rotated.
+Failed checks are not cached, they are always run again to get the error.
+
+The checked configurations can be also kept across sessions in a ProofStore
+(a json file), set as proof_cache.store. The store is keyed by the content
+hash of a tool (Tool.content_hash), which depends on the steps of the tool
+and on the hashes of the tools used there. So after editing a tool,
+neither the tool, nor any tool depending on it is found in the store.
+The entries of such tools are removed by store.prune(tools) with the tools
+currently loaded, and the store is written by store.save().
+The content hash does not see the python code of the primitive tools,
+the triggers or the logical core, so the store also remembers a digest
+of the files of the proof checker (checker_files), and the whole store
+is discarded on loading if any of them changed.
+
+The cache is used by
+  key = proof_cache.key(tool, num_args)
+  if not proof_cache.lookup(key):
+      ... (checking the proof)
+      proof_cache.add(key)
+and counts the hits and misses, see stats().
+"""
+
+_angle_cells = int(round(1 / epsilon))
+
+def _quantize(values):
+    return tuple(int(round(x / epsilon)) for x in values)
+
+# point of an object defining the normalizing transform
+def _anchor(obj, origin):
+    t = type(obj)
+    if t == Point: return obj.a
+    elif t == Circle: return obj.c
+    elif t == Line and origin is not None: return obj.closest_on(origin)
+    else: return None
+
+# returns (origin, scale, rot) of the normalizing similarity transform
+def similarity_transform(num_objs):
+    identity = np.eye(2)
+    origin = None
+    for obj in num_objs:
+        origin = _anchor(obj, None)
+        if origin is not None: break
+    else: return np.zeros(2), 1., identity
+    for obj in num_objs:
+        anchor = _anchor(obj, origin)
+        if anchor is None: continue
+        vec = anchor - origin
+        size = np.linalg.norm(vec)
+        if size > epsilon: break
+    else: return origin, 1., identity
+    if any(type(obj) == Angle for obj in num_objs): rot = identity
+    else:
+        cos, sin = vec / size
+        rot = np.array(((cos, sin), (-sin, cos)))
+    return origin, 1 / size, rot
+
+# canonical signature of a configuration, a tuple of (type name, rounded numbers),
+# or None if there is an object of an unknown type
+def similarity_key(num_objs):
+    origin, scale, rot = similarity_transform(num_objs)
+    log_scale = math.log(scale)
+    key = []
+    for obj in num_objs:
+        t = type(obj)
+        if t == Point:
+            values = _quantize(scale * rot.dot(obj.a - origin))
+        elif t == Line:
+            n = rot.dot(obj.n)
+            c = scale * (obj.c - np.dot(obj.n, origin))
+            if n[0] < -epsilon or (n[0] <= epsilon and n[1] < 0): n, c = -n, -c
+            values = _quantize((n[0], n[1], c))
+        elif t == Circle:
+            center = scale * rot.dot(obj.c - origin)
+            values = _quantize((center[0], center[1], scale * obj.r))
+        elif t == Ratio:
+            dim = float(obj.dim)
+            values = (dim,) + _quantize((obj.x + dim * log_scale,))
+        elif t == Angle:
+            values = (int(round((float(obj.data) % 1) / epsilon)) % _angle_cells,)
+        else: return None
+        key.append((t.__name__, values))
+    return tuple(key)
+
+class ProofCache:
+    def __init__(self, size = 4096):
+        self.configurations = LRUCache(size, "proof cache")
+        self.enabled = True
+        self.store = None # ProofStore, or None
+        self.hits = 0
+        self.store_hits = 0 # hits found only in the store
+        self.misses = 0
+
+    # returns the key of the configuration, None if it cannot be cached
+    def key(self, tool, num_args):
+        if not self.enabled: return None
+        signature = similarity_key(num_args)
+        if signature is None: return None
+        return tool, signature
+
+    # is the configuration already checked, the keys None are not counted
+    def lookup(self, key):
+        if key is None: return False
+        if self.configurations.get(key) is not None:
+            self.hits += 1
+            return True
+        if self.store is not None and self.store.contains(*key):
+            self.configurations.set(key, True)
+            self.hits += 1
+            self.store_hits += 1
+            return True
+        self.misses += 1
+        return False
+
+    def add(self, key):
+        if key is None: return
+        self.configurations.set(key, True)
+        if self.store is not None: self.store.add(*key)
+
+    def clear(self):
+        self.configurations.clear()
+        self.hits = 0
+        self.store_hits = 0
+        self.misses = 0
+
+    def stats(self):
+        return {
+            "hits" : self.hits,
+            "store hits" : self.store_hits,
+            "misses" : self.misses,
+            "size" : len(self.configurations),
+        }
+
+# files the result of a proof check depends on (besides the definitions of the tools)
+checker_files = (
+    "triggers.gl",
+    "geo_object.py", "tools.py", "primitive_tools.py", "primitive_pred.py",
+    "primitive_constr.py", "movable_tools.py", "parse.py", "tool_step.py",
+    "logical_core.py", "uf_dict.py", "triggers.py", "relstr.py", "work_queue.py",
+    "sparse_elim.py", "sparse_row.py", "angle_chasing.py", "num_index.py",
+    "undo_trail.py", "proof_cache.py",
+)
+
+_checker_digest = None
+def checker_digest():
+    global _checker_digest
+    if _checker_digest is None:
+        directory = os.path.dirname(os.path.abspath(__file__))
+        digest = hashlib.sha1()
+        for fname in checker_files:
+            digest.update(fname.encode())
+            with open(os.path.join(directory, fname), "rb") as f:
+                digest.update(hashlib.sha1(f.read()).digest())
+        _checker_digest = digest.hexdigest()
+    return _checker_digest
+
+class ProofStore:
+    file_format = 2 # to be increased if the meaning of the stored data changes
+
+    def __init__(self, fname, max_configurations = 256):
+        self.fname = fname
+        self.max_configurations = max_configurations # per tool
+        self.entries = dict() # content hash -> (tool name, dict : signature -> True)
+        self.modified = False
+        self.lock = threading.Lock() # the proof checker adds, GUI saves
+        if os.path.exists(fname): self.load()
+
+    def load(self):
+        with open(self.fname) as f:
+            data = json.load(f)
+        if data.get("format") != self.file_format or data.get("checker") != checker_digest():
+            self.modified = True # outdated, rewritten by save()
+            return
+        for content_hash, (name, signatures) in data["tools"].items():
+            self.entries[content_hash] = name, dict(
+                (tuple((t, tuple(values)) for t, values in signature), True)
+                for signature in signatures
+            )
+
+    def save(self):
+        if not self.modified: return
+        with self.lock:
+            data = {
+                "format" : self.file_format,
+                "checker" : checker_digest(),
+                "tools" : dict(
+                    (content_hash, (name, list(signatures)))
+                    for content_hash, (name, signatures) in self.entries.items()
+                ),
+            }
+            self.modified = False
+        with open(self.fname, "w") as f:
+            json.dump(data, f)
+
+    # removes the entries of the tools which are not among the given ones
+    # (in particular the tools edited since the entry was stored, and their dependents)
+    def prune(self, tools):
+        content_hashes = set(tool.content_hash() for tool in tools)
+        with self.lock:
+            for content_hash in list(self.entries.keys()):
+                if content_hash not in content_hashes:
+                    del self.entries[content_hash]
+                    self.modified = True
+
+    def contains(self, tool, signature):
+        entry = self.entries.get(tool.content_hash())
+        return entry is not None and signature in entry[1]
+
+    def add(self, tool, signature):
+        content_hash = tool.content_hash()
+        with self.lock:
+            entry = self.entries.get(content_hash)
+            if entry is None:
+                entry = tool.name, dict()
+                self.entries[content_hash] = entry
+            signatures = entry[1]
+            if signature in signatures: return
+            signatures[signature] = True
+            if len(signatures) > self.max_configurations:
+                del signatures[next(iter(signatures))]
+            self.modified = True
+
+proof_cache = ProofCache()
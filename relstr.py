@@ -1,42 +1,51 @@
 from collections import defaultdict
 from stop_watch import StopWatch
+from undo_trail import DummyTrail
 
 """
 Alternative view to the lookup table, used by triggers.
 It sees every value: (label, input) -> output
 as a relation (label, data = input+output), and it allows to access
 all such relations given label and a single element of data.
+The binary relations with labels in incidence.labels are moreover
+kept in an IncidenceIndex.
 """
 
 class RelStr:
-    def __init__(self):
+    def __init__(self, trail = None):
+        if trail is None: trail = DummyTrail()
+        self.trail = trail
         self.t_to_data = defaultdict(set)  # t -> set of tuples(x1,x2,...,xn)
         self.tobj_to_nb = defaultdict(set) # t,xi,i -> set of tuples(x1,x2,...,xn)
         self.obj_to_ti = defaultdict(set)   # xi -> set of pairs t,i
+        self.incidence = IncidenceIndex(self.trail)
 
     def add_rel(self, t, data):
         if data in self.t_to_data[t]: return False
-        self.t_to_data[t].add(data)
+        self.trail.set_add(self.t_to_data[t], data)
         for i,x in enumerate(data):
-            self.tobj_to_nb[t,x,i].add(data)
-            self.obj_to_ti[x].add((t,i))
+            self.trail.set_add(self.tobj_to_nb[t,x,i], data)
+            self.trail.set_add(self.obj_to_ti[x], (t,i))
+        if t in self.incidence.labels: self.incidence.add(t, data)
         return True
 
     # removing a node (called upon gluing)
     def discard_node(self, obj, store_disc_edges = None):
         for t,i in self.obj_to_ti[obj]:
-            edges = self.tobj_to_nb.pop((t,obj,i))
-            self.t_to_data[t].difference_update(edges)
+            edges = self.trail.pop_item(self.tobj_to_nb, (t,obj,i))
+            t_data = self.t_to_data[t]
             for edge in edges:
+                self.trail.set_discard(t_data, edge)
                 for i2,obj2 in enumerate(edge):
                     if obj2 != obj:
-                        self.tobj_to_nb[t,obj2,i2].discard(edge)
+                        self.trail.set_discard(self.tobj_to_nb[t,obj2,i2], edge)
+            if t in self.incidence.labels: self.incidence.discard(t, obj, i, edges)
             if store_disc_edges is not None:
                 store_disc_edges.extend(
                     (t, data)
                     for data in edges
                 )
-        del self.obj_to_ti[obj]
+        self.trail.del_item(self.obj_to_ti, obj)
 
     # debug function
     def check_consistency(self):
@@ -59,6 +68,7 @@ class RelStr:
             if s
         )
         assert(test_tobj_to_nb == test_tobj_to_nb2)
+        self.incidence.check_consistency(self.t_to_data)
         objs = set(test_obj_to_ti.keys()) | set(test_obj_to_ti2.keys())
         for obj in objs:
             s = test_obj_to_ti[obj]
@@ -72,3 +82,92 @@ class RelStr:
         res.tobj_to_nb = self.tobj_to_nb.copy()
         res.obj_to_ti = self.obj_to_ti.copy()
         return res
+
+"""
+IncidenceIndex stores the binary relations (x0, x1) with labels in self.labels
+(such as lies_on of a point and a line) as bitsets (python integers):
+  row(t, x, i)
+has the bit of y set if the relation t holds with x at the position i
+and y at the other one. The objects get their bits densely
+in the order they enter the index (obj_to_bit), so the bitsets are
+as wide as the number of indexed objects, not as the largest object.
+Then the common lines of two points are
+  row(lies_on_l, p, 0) & row(lies_on_l, p2, 0)
+and whether two circles have three common points is a popcount.
+Every change flips a single bit, and it is recorded to the trail
+as a flip of the same bit, so the trail does not store whole bitsets.
+"""
+
+def popcount(bits):
+    return bin(bits).count("1")
+
+class IncidenceIndex:
+    def __init__(self, trail = None):
+        if trail is None: trail = DummyTrail()
+        self.trail = trail
+        self.labels = set()   # labels of the indexed binary relations
+        self.rows = dict()    # t,x,i -> bitset of the other objects, no empty bitsets
+        # the bits are assigned forever, also after a rollback, it does not harm
+        self.obj_to_bit = dict() # obj -> position of its bit
+        self.bit_to_obj = []     # inverse of obj_to_bit
+
+    def row(self, t, x, i):
+        return self.rows.get((t,x,i), 0)
+
+    # the bitset containing only obj (0 if obj is not indexed)
+    def bit(self, obj):
+        b = self.obj_to_bit.get(obj)
+        if b is None: return 0
+        return 1 << b
+
+    # iterates over the objects of a bitset
+    def objs(self, bits):
+        bit_to_obj = self.bit_to_obj
+        while bits:
+            low = bits & -bits
+            yield bit_to_obj[low.bit_length()-1]
+            bits ^= low
+
+    def _obj_bit(self, obj):
+        b = self.obj_to_bit.get(obj)
+        if b is None:
+            b = len(self.bit_to_obj)
+            self.obj_to_bit[obj] = b
+            self.bit_to_obj.append(obj)
+        return b
+
+    def _flip(self, key, b):
+        bits = self.rows.get(key, 0) ^ (1 << b)
+        if bits: self.rows[key] = bits
+        else: del self.rows[key]
+
+    def _flip_obj(self, key, obj):
+        b = self._obj_bit(obj)
+        self.trail.push(self._flip, key, b)
+        self._flip(key, b)
+
+    # called by RelStr.add_rel with a new relation
+    def add(self, t, data):
+        x0, x1 = data
+        self._flip_obj((t,x0,0), x1)
+        self._flip_obj((t,x1,1), x0)
+
+    # called by RelStr.discard_node with the relations of obj at the position i
+    def discard(self, t, obj, i, edges):
+        for edge in edges:
+            obj2 = edge[1-i]
+            self._flip_obj((t,obj,i), obj2)
+            self._flip_obj((t,obj2,1-i), obj)
+
+    # debug function, compares the bitsets to the relations
+    def check_consistency(self, t_to_data):
+        test_rows = defaultdict(set)
+        for t in self.labels:
+            for x0,x1 in t_to_data.get(t, ()):
+                test_rows[t,x0,0].add(x1)
+                test_rows[t,x1,1].add(x0)
+        rows = dict(
+            (key, set(self.objs(bits)))
+            for key, bits in self.rows.items()
+        )
+        assert(rows == test_rows)
@@ -1,8 +1,10 @@
 from math import gcd
 from fractions import Fraction
 from collections import defaultdict
-from sparse_row import SparseRow
+from random import Random
+from sparse_row import SparseRow, IntSparseRow, BoundedIntSparseRow
 from stop_watch import StopWatch
+from undo_trail import DummyTrail
 
 def lcm(a, *args):
     for b in args:
@@ -20,6 +22,21 @@ class EquationIndex:
     def __init__(self, equation):
         self.equation = equation
 
+# prime modulus used for row hashes and the mod-p copy of the matrix
+_prime = (1 << 61) - 1
+# random weights of variables for hashing rows modulo the prime,
+# shared by all the matrices (variable id -> pair of weights)
+_hash_rng = Random(0)
+_hash_weights = []
+def _extend_hash_weights(size):
+    while len(_hash_weights) < size:
+        _hash_weights.append((
+            _hash_rng.randrange(1, _prime),
+            _hash_rng.randrange(1, _prime),
+        ))
+def _inverse_mod(n):
+    return pow(n % _prime or 1, -1, _prime)
+
 """
 ElimMatrix keeps a set of non-redundant linear equations (SparseRows).
 User can add a new linear equation using function
@@ -38,74 +55,182 @@ Variables which are non-zero, and not substituted by a proportion of other varia
 are kept in a "matrix", rows of which are equations derived from the input equations.
 Every row in the matrix must have a "pivot" variable such that there is no other
 equation in the matrix containing this variable.
+
+All the modifications are recorded to an UndoTrail (if given),
+so the matrix can be rolled back together with the logical core.
+
+Internally, the equations are stored as IntSparseRow (integer numerators
+with a common denominator) and the elimination is fraction-free,
+the input and output of the public functions are unchanged.
+If the matrix is created with provenance = False, the rows do not contain
+equation indices, only an upper bound on their common denominator
+(BoundedIntSparseRow). The rows are then shorter, and the returned
+denominators are multiples of the exact ones, it is suitable
+if the denominators are not needed (ratios), or it is enough that
+they are correct up to a multiple.
+The variables are interned to non-negative integers, and equation indices
+are represented by negative integers (-1-i for self.equations[i]).
+To find proportional rows, every row in the matrix has a hash (a pair of
+random linear combinations of its coefficients modulo a prime) updated
+together with the row, the ratio of the two hashes does not depend
+on the scale of the row.
+
+Most queries are negative, so query first runs the elimination on a copy
+of the matrix modulo the prime (rows_mod, prop_mod) without equation
+indices. It is a homomorphic image of the exact elimination, so if
+the query is not derivable modulo the prime, it is not derivable at all,
+and the exact elimination runs only otherwise.
+
+The pivot of a new row is selected by pivot_strategy ("markowitz" by default,
+or "column" = the shortest column), and the matrix can be made sparser
+by resparsify(), optionally called every resparsify_period additions.
+The strategies can be compared on the statistics given by stats()
+(number of nonzero entries, the longest row, fill caused by additions).
 """
 class ElimMatrix:
-    def __init__(self):
+    def __init__(self, trail = None, pivot_strategy = "markowitz", resparsify_period = None,
+                 provenance = True):
+        if trail is None: trail = DummyTrail()
+        self.trail = trail
+        # False = the equation indices are replaced by denominator bounds, see _least_denom
+        self.provenance = provenance
+        if provenance: self.row_class = IntSparseRow
+        else: self.row_class = BoundedIntSparseRow
+        self.pivot_strategy = pivot_strategy # "column" or "markowitz", see _pivot_cost
+        self.resparsify_period = resparsify_period # call resparsify every n additions
+        self.var_to_id = dict() # variable -> non-negative integer
+        self.id_to_var = [] # inverse of var_to_id
+        self.equations = [] # list of EquationIndex
         self.rows = dict() # pivot -> row
+        self.row_hash = dict() # pivot -> pair of hashes of the row
+        self.row_valkey = dict() # pivot -> key of the row in value_to_var
+        self.rows_mod = dict() # pivot -> row modulo the prime solved for pivot (var -> coef)
+        self.prop_mod = dict() # mirror of proportional_to: var -> (var, ratio modulo the prime)
+        self.mod_p_valid = True # False if a denominator was divisible by the prime
+        self.version = 0 # increased by every addition, used for caching queries
         self.cols = defaultdict(set) # varname -> pivot set
         self.value_to_var = dict() # value_key -> pivot variable proportional to that
         self.zeroes = dict() # varname -> equation(size=1)
         self.proportional_to = dict() # varname -> (varname, equation(size=2) )
         self.root_to_proportions = dict() # varname -> size, dict(proportion -> varnames)
+        # statistics (not rolled back), see stats()
+        self.stats_adds = 0
+        self.stats_fill_total = 0 # entries added to the rows by the elimination
+        self.stats_fill_max = 0
+        self.stats_swaps = 0
 
     def query(self, query_r):
-        query_r = SparseRow(query_r)
+        if self.mod_p_valid and not self._query_mod_p(query_r): return 0
+        query_r = self._to_ids(query_r)
         self._eliminate(query_r)
-        if not all(isinstance(key, EquationIndex) for key in query_r.keys()):
+        if any(key >= 0 for key in query_r.keys()):
             return 0
         return self._least_denom(query_r)
 
+    # the same as [self.query(query_r) for query_r in queries]
+    # the rows of the matrix are applied in one pass over the pivots,
+    # every pivot row is used by all the queries containing the pivot
+    def query_many(self, queries):
+        res = [0]*len(queries)
+        pending = []
+        for i, query_r in enumerate(queries):
+            if self.mod_p_valid and not self._query_mod_p(query_r): continue
+            query_r = self._to_ids(query_r)
+            self._elim_by_proportions(query_r)
+            pending.append((i, query_r))
+
+        rows = self.rows
+        pivot_to_updates = defaultdict(list) # pivot -> list of (query, coef, denom)
+        for _, query_r in pending:
+            denom = query_r.denom
+            for var, coef in query_r.items():
+                if var in rows: pivot_to_updates[var].append((query_r, coef, denom))
+        for pivot, updates in pivot_to_updates.items():
+            update = rows[pivot]
+            for query_r, coef, denom in updates:
+                query_r.iadd_ratio(coef, denom, update)
+
+        for i, query_r in pending:
+            if not any(key >= 0 for key in query_r.keys()):
+                res[i] = self._least_denom(query_r)
+        return res
+
     def add(self, added):
         #assert(self.check_consistency())
         #print("elim.add({})".format(added))
-        new_r = SparseRow(added)
+        self.version += 1
+        self.stats_adds += 1
+        new_r = self._to_ids(added)
         self._elim_by_proportions(new_r)
         eq_pure = [
             (x,coef) for (x,coef) in new_r.items()
-            if not isinstance(x, EquationIndex)
+            if x >= 0
         ]
         if len(eq_pure) <= 2 and any(x not in self.cols for x,coef in eq_pure):
             if not eq_pure: return False, () # Already known equation
-            eqi = EquationIndex(added)
-            new_r[eqi] = Fraction(1)
+            self._label_equation(new_r, added)
             to_glue_out = []
             if len(eq_pure) == 1:
                 (x,coef), = eq_pure
-                new_r *= -1/coef
+                new_r.make_pivot(x)
                 self._add_zero(x,new_r, to_glue_out)
             else:
                 (x,cx),(y,cy) = eq_pure
                 if x in self.cols or (y not in self.cols and
                                       self._get_root_to_prop(x)[0] > self._get_root_to_prop(y)[0]):
                     x,cx,y,cy = y,cy,x,cx
-                new_r *= -1/cx
+                new_r.make_pivot(x)
                 self._add_proportion(x,y, new_r, to_glue_out)
-            return True, to_glue_out
+            return True, self._glued_to_vars(to_glue_out)
 
         self._elim_by_matrix(new_r)
 
-        pivot_candidates = list(filter(
-            lambda x: not isinstance(x, EquationIndex), new_r.keys(),
-        ))
+        pivot_candidates = [x for x in new_r.keys() if x >= 0]
         if not pivot_candidates: return False, () # Already known equation
 
-        # label equation
-        eqi = EquationIndex(added)
-        new_r[eqi] = Fraction(1)
+        self._label_equation(new_r, added)
 
         # select pivot
-        if len(pivot_candidates) == 2:
+        pivot = min(pivot_candidates, key = self._pivot_cost(new_r, pivot_candidates))
+        new_r.make_pivot(pivot)
+
+        to_glue_out = []
+        self._pivot_row(pivot, new_r, pivot_candidates, to_glue_out)
+        if self.resparsify_period and self.stats_adds % self.resparsify_period == 0:
+            self.resparsify(to_glue_out)
+
+        return True, self._glued_to_vars(to_glue_out)
+
+    def _pivot_cost(self, new_r, pivot_candidates):
+        if self.pivot_strategy == "markowitz":
+            # The matrix is kept fully reduced, so the new row is the only one
+            # to be pivoted, and the Markowitz product (row length) x (column size)
+            # is refined to the number of entries the new row brings
+            # to the rows of the column. It is evaluated only for
+            # a few candidates with the shortest columns.
+            keys = new_r.keys()
+            rows = self.rows
+            cols = sorted(len(self._get_col(x)) for x in pivot_candidates)
+            max_col = cols[min(len(cols), 4)-1]
+            def cand_cost(cand):
+                col = self._get_col(cand)
+                if len(col) > max_col: return float("inf"), len(col)
+                fill = sum(len(keys - rows[ri].keys()) for ri in col)
+                if len(pivot_candidates) == 2: fill += self._get_root_to_prop(cand)[0]
+                return fill, len(col)
+        elif len(pivot_candidates) == 2:
             def cand_cost(cand):
-                return 3*len(self.cols[cand]) + self._get_root_to_prop(cand)[0]
+                return 3*len(self._get_col(cand)) + self._get_root_to_prop(cand)[0]
         else:
             def cand_cost(cand):
-                return len(self.cols[cand])
-        pivot = min(pivot_candidates, key = cand_cost)
-        new_r *= -1 / new_r[pivot]
+                return len(self._get_col(cand))
+        return cand_cost
 
-        to_glue_out = []
+    # adds a row with a selected pivot (coefficient -1) to the matrix,
+    # and eliminates the pivot from the other rows
+    def _pivot_row(self, pivot, new_r, pivot_candidates, to_glue_out):
         cols_to_update = [
-            (self.cols[x], x)
+            (self._get_col(x), x)
             for x in pivot_candidates
             if x != pivot
         ]
@@ -113,34 +238,111 @@ class ElimMatrix:
         #print("C", cols_to_update_proj2)
 
         # update matrix, compute glued
-        main_col = set(self.cols[pivot])
+        fill = 0
+        new_hash = self._row_hash(new_r)
+        main_col = set(self._get_col(pivot))
         for ri in main_col:
             row = self.rows.get(ri)
-            coef = row[pivot]
             self._deactivate_row(ri, row)
 
-            row.iadd_coef(coef, new_r) # the essential command
+            coef, denom = row.get(pivot), row.denom
+            fill -= len(row)
+            self._save_row(row)
+            row.iadd_ratio(coef, denom, new_r) # the essential command
+            self._update_row_hash(ri, coef, denom, new_hash)
+            self._set_row_mod(ri, row)
 
             if self._activate_row(ri, row, to_glue_out):
                 # kept in matrix
+                fill += len(row)
                 for col, ci in cols_to_update:
-                    if ci in row: col.add(ri)
-                    else: col.discard(ri)
+                    if ci in row: self.trail.set_add(col, ri)
+                    else: self.trail.set_discard(col, ri)
             else:
                 # removed from matrix
                 for col, ci in cols_to_update:
-                    col.discard(ri)
+                    self.trail.set_discard(col, ri)
 
         # add new row
-        self.rows[pivot] = new_r
+        self.trail.set_item(self.rows, pivot, new_r)
+        self.trail.set_item(self.row_hash, pivot, new_hash)
+        self._set_row_mod(pivot, new_r)
         if self._activate_row(pivot, new_r, to_glue_out):
             # add new row to columns
-            self.cols[pivot] = { pivot }
-            for col, ci in cols_to_update: col.add(pivot)
-
-        return True, to_glue_out
+            fill += len(new_r)
+            self.trail.set_item(self.cols, pivot, { pivot })
+            for col, ci in cols_to_update: self.trail.set_add(col, pivot)
+
+        self.stats_fill_total += fill
+        self.stats_fill_max = max(self.stats_fill_max, fill)
+
+    # Changes the pivots of the rows if it decreases the number of nonzero entries.
+    # The matrix in the reduced form is determined by the set of pivots,
+    # so the only way of making it sparser is moving the pivot of a row r
+    # to another variable q of the row (if q is in few other rows, and
+    # the elimination of q from them cancels more entries than it adds).
+    # Returns the number of changed pivots.
+    def resparsify(self, to_glue_out = None, max_col = 4):
+        if to_glue_out is None: to_glue_out = []
+        swaps = 0
+        for r in sorted(self.rows.keys()):
+            row = self.rows.get(r)
+            if row is None: continue
+            best_gain, best_q = 0, None
+            for q in row.keys():
+                if q < 0 or q == r: continue
+                col = self.cols[q]
+                if len(col) > max_col: continue
+                gain = self._swap_gain(r, row, q, col)
+                if gain > best_gain: best_gain, best_q = gain, q
+            if best_q is not None:
+                self._swap_pivot(r, row, best_q, to_glue_out)
+                swaps += 1
+        self.stats_swaps += swaps
+        return swaps
+
+    # how many entries are removed from the matrix by moving
+    # the pivot of row r to a variable q
+    def _swap_gain(self, r, row, q, col):
+        new_r = type(row)(row)
+        new_r.make_pivot(q)
+        gain = 0
+        for ri in col:
+            if ri == r: continue
+            row_i = self.rows[ri]
+            gain += len(row_i)
+            row_i = type(row_i)(row_i)
+            row_i.iadd_ratio(row_i.get(q), row_i.denom, new_r)
+            gain -= len(row_i)
+        return gain
+
+    def _swap_pivot(self, r, row, q, to_glue_out):
+        self._deactivate_row(r, row)
+        self._remove_row(r, row)
+        new_r = type(row)(row)
+        new_r.make_pivot(q)
+        pivot_candidates = [x for x in new_r.keys() if x >= 0]
+        self._pivot_row(q, new_r, pivot_candidates, to_glue_out)
+
+    # statistics of the matrix and of the elimination so far
+    def stats(self):
+        row_sizes = [len(row) for row in self.rows.values()]
+        return {
+            "adds" : self.stats_adds,
+            "rows" : len(row_sizes),
+            "nnz" : sum(row_sizes),
+            "nnz_vars" : sum(
+                1 for row in self.rows.values()
+                for x in row.keys() if x >= 0
+            ),
+            "longest_row" : max(row_sizes, default = 0),
+            "fill_total" : self.stats_fill_total,
+            "fill_max" : self.stats_fill_max,
+            "swaps" : self.stats_swaps,
+        }
 
     def get_inverse(self, x):
+        x = self._var_id(x)
         r, eq_rx = self.proportional_to.get(x, (x, None))
         if eq_rx is None:
             ratio = Fraction(-1)
@@ -159,9 +361,9 @@ class ElimMatrix:
         if eq_ry is None: denom_y = 1
         else: denom_y = self._least_denom(eq_ry)
 
-        return y, lcm(denom_x, denom_y)
+        return self.id_to_var[y], lcm(denom_x, denom_y)
 
-    # debug functions
+    # debug functions, variables are printed as their internal ids
     def print_self(self):
         keys = set(self.cols.keys())
         pivots = set(self.rows.keys())
@@ -187,8 +389,15 @@ class ElimMatrix:
             if r[ri] != -1:
                 print("pivot {} has wrong coefficient in its row: {}".format(ri, r[ri]))
                 ok = False
+            if self.row_hash[ri] != self._row_hash(r):
+                print("row {} has wrong hash".format(ri))
+                ok = False
+            inv = _inverse_mod(r.denom)
+            if self.rows_mod[ri] != { x : c*inv % _prime for x,c in r.items() if x >= 0 and x != ri }:
+                print("row {} has wrong copy modulo prime".format(ri))
+                ok = False
             for ci in r.keys():
-                if isinstance(ci, EquationIndex): continue
+                if ci < 0: continue
                 if ri not in self.cols[ci]:
                     print("[{}, {}] not in column".format(ri, ci))
                     ok = False
@@ -201,20 +410,59 @@ class ElimMatrix:
             if eq[x] != -1:
                 print("zero {} has wrong coefficient: {}".format(ri, r[ri]))
                 ok = False
-            if any(y != x and not isinstance(y, EquationIndex) for y in eq.keys()):
+            if any(y != x and y >= 0 for y in eq.keys()):
                 print("other variables in zero equation {}: {}".format(x, eq))
                 ok = False
         for x,(y,eq) in self.proportional_to.items():
             if eq[x] != -1 or eq[y] == 0:
                 print("proportion {} -> {} has wrong coefficients: {}".format(x,y, r))
                 ok = False
-            if any(z != x and z != y and not isinstance(z, EquationIndex) for z in eq.keys()):
+            if any(z != x and z != y and z >= 0 for z in eq.keys()):
                 print("other variables in proportion equation {} -> {}: {}".format(x, y, eq))
                 ok = False
 
         return ok
 
     # helper functions
+    def _var_id(self, x):
+        i = self.var_to_id.get(x)
+        if i is None:
+            i = len(self.id_to_var)
+            self.var_to_id[x] = i
+            self.id_to_var.append(x)
+            _extend_hash_weights(i+1)
+        return i
+    def _to_ids(self, row):
+        return self.row_class({
+            self._var_id(x) : coef
+            for x,coef in row.items()
+        })
+    def _glued_to_vars(self, to_glue_out):
+        id_to_var = self.id_to_var
+        return [
+            (id_to_var[x], id_to_var[y], denom)
+            for x,y,denom in to_glue_out
+        ]
+    def _new_equation(self, equation): # returns a (negative) id of the new equation index
+        self.equations.append(EquationIndex(equation))
+        return -len(self.equations)
+    def _label_equation(self, row, equation):
+        if not self.provenance: return # bound of the added equation is already included
+        eqi = self._new_equation(equation)
+        row.set_coef(eqi, 1)
+
+    def _save_row(self, row): # called before an in-place modification of a row
+        self.trail.save_dict(row)
+        self.trail.save_attr(row, "denom")
+        if not self.provenance: self.trail.save_attr(row, "bound")
+
+    def _get_col(self, x): # self.cols[x], but the creation is recorded to the trail
+        col = self.cols.get(x)
+        if col is None:
+            col = set()
+            self.trail.set_item(self.cols, x, col)
+        return col
+
     def _eliminate(self, row): # in place elimination of a single row
         self._elim_by_proportions(row)
         self._elim_by_matrix(row)
@@ -225,53 +473,61 @@ class ElimMatrix:
             _,update = self.proportional_to.get(var, (None, None))
             if update is None: update = self.zeroes.get(var)
             if update is not None: updates.append((coef, update))
+        denom = row.denom
         for coef, update in updates:
-            row += coef*update
+            row.iadd_ratio(coef, denom, update)
     def _elim_by_matrix(self, row):
         updates = []
         for var, coef in row.items():
             update = self.rows.get(var)
             if update is not None: updates.append((coef, update))
+        denom = row.denom
         for coef, update in updates:
-            row += coef*update        
-            
-    def _least_denom(self, row): # common denominator of the equation indices
+            row.iadd_ratio(coef, denom, update)
+
+    # common denominator of the equation indices, that is, the denominator
+    # of the combination of the added equations giving the row,
+    # without provenance, it is estimated from above by the row bound
+    def _least_denom(self, row):
+        if not self.provenance: return row.bound
         res = 1
+        row_denom = row.denom
         for key, coef in row.items():
-            if not isinstance(key, EquationIndex): continue
-            denom = coef.denominator
+            if key >= 0: continue
+            denom = row_denom // gcd(coef, row_denom)
             res *= denom // gcd(res, denom)
         return res
 
     def _add_zero(self, x, eq, to_glue_out):
-        if x in self.cols: del self.cols[x]
+        if x in self.cols: self.trail.del_item(self.cols, x)
         if self.zeroes:
             y,eq2 = next(iter(self.zeroes.items()))
             denom = lcm(self._least_denom(eq),self._least_denom(eq2))
             to_glue_out.append((x,y, denom))
-        self.zeroes[x] = eq
+        self.trail.set_item(self.zeroes, x, eq)
         if x in self.root_to_proportions:
             _, d = self.root_to_proportions[x]
             for q,l in d.items():
                 for y in l:
                     if y != x:
                         eq2 = self.proportional_to[y][1] + q*eq
-                        self.zeroes[y] = eq2
-                        del self.proportional_to[y]
+                        self.trail.set_item(self.zeroes, y, eq2)
+                        self.trail.del_item(self.proportional_to, y)
+                        self.trail.del_item(self.prop_mod, y)
                         if q != 1:
                             denom = lcm(self._least_denom(eq),self._least_denom(eq2))
                             to_glue_out.append((x,y, denom))
-            del self.root_to_proportions[x]
+            self.trail.del_item(self.root_to_proportions, x)
 
     def _get_root_to_prop(self, x):
         res = self.root_to_proportions.get(x, None)
         if res is None:
             res = 1, {Fraction(1) : [x]}
-            self.root_to_proportions[x] = res
+            self.trail.set_item(self.root_to_proportions, x, res)
         return res
 
     def _add_proportion(self, x, y, eq_yx, to_glue_out):
-        if x in self.cols: del self.cols[x]
+        if x in self.cols: self.trail.del_item(self.cols, x)
         if 22 in eq_yx and 13 in eq_yx and 26 in eq_yx:
             raise Exception()
         # get data
@@ -290,16 +546,19 @@ class ElimMatrix:
                     # x,eq2 ==
                     _,eq_xz = self.proportional_to[z]
                     # eq_yz = eq_xz + ratio_xz * eq_yx
+                    self._save_row(eq_xz)
                     eq_xz.iadd_coef(ratio_xz, eq_yx)
                     eq_yz = eq_xz
-                self.proportional_to[z] = y, eq_yz
+                self.trail.set_item(self.proportional_to, z, (y, eq_yz))
+                self.trail.set_item(self.prop_mod, z, (y, self._coef_mod(eq_yz, y)))
 
             # update y_dict
-            zz_list = y_dict.setdefault(ratio_yz, z_list)
-            if zz_list is not z_list:
+            zz_list = y_dict.get(ratio_yz)
+            if zz_list is None: self.trail.set_item(y_dict, ratio_yz, z_list)
+            else:
                 z = z_list[0]
                 zz = zz_list[0]
-                zz_list.extend(z_list)
+                self.trail.list_extend(zz_list, z_list)
 
                 # get the denominator of the equation stating z == zz
                 if z == x: denom_xz = 1
@@ -315,43 +574,153 @@ class ElimMatrix:
                 # update to_glue
                 to_glue_out.append((z, zz, denom))
 
-        self.root_to_proportions[y] = x_size+y_size, y_dict
-        del self.root_to_proportions[x]
+        self.trail.set_item(self.root_to_proportions, y, (x_size+y_size, y_dict))
+        self.trail.del_item(self.root_to_proportions, x)
+
+    ## the copy of the matrix modulo the prime
+
+    def _denom_inverse_mod(self, denom):
+        if denom % _prime == 0:
+            self.trail.save_attr(self, "mod_p_valid")
+            self.mod_p_valid = False
+        return _inverse_mod(denom)
+
+    def _coef_mod(self, row, x): # coefficient of x in a row modulo the prime
+        return row.get(x, 0) * self._denom_inverse_mod(row.denom) % _prime
+
+    def _set_row_mod(self, pivot, row): # pivot = sum(coef*var)
+        inv = self._denom_inverse_mod(row.denom)
+        self.trail.set_item(self.rows_mod, pivot, {
+            x : coef*inv % _prime
+            for x,coef in row.items()
+            if x >= 0 and x != pivot
+        })
+
+    # returns False if the query (a dictionary var -> Fraction)
+    # is certainly not derivable, the same as _eliminate on the copy
+    def _query_mod_p(self, query_r):
+        var_to_id = self.var_to_id
+        zeroes = self.zeroes
+        prop_mod = self.prop_mod
+        row = dict()
+        for x,coef in query_r.items():
+            if coef == 0: continue
+            x = var_to_id.get(x)
+            if x is None: return False
+            denom = coef.denominator
+            if denom == 1: coef = coef.numerator
+            elif denom % _prime == 0: return True
+            else: coef = coef.numerator * _inverse_mod(denom)
+            prop = prop_mod.get(x)
+            if prop is not None:
+                x, ratio = prop
+                coef *= ratio
+            elif x in zeroes: continue
+            row[x] = (row.get(x, 0) + coef) % _prime
+        rows_mod = self.rows_mod
+        res = dict()
+        for x,coef in row.items():
+            if coef == 0: continue
+            update = rows_mod.get(x)
+            if update is None: res[x] = (res.get(x, 0) + coef) % _prime
+            else:
+                for y,coef_y in update.items():
+                    res[y] = (res.get(y, 0) + coef*coef_y) % _prime
+        return not any(res.values())
+
+    ## hashes of rows
+
+    # pair of hashes of a row, equation indices are ignored
+    def _row_hash(self, row):
+        h1 = h2 = 0
+        for x,coef in row.items():
+            if x < 0: continue
+            w1, w2 = _hash_weights[x]
+            h1 += w1*coef
+            h2 += w2*coef
+        inv = _inverse_mod(row.denom)
+        return h1*inv % _prime, h2*inv % _prime
+
+    # the row "pivot" was increased by (coef / denom) * (row with the hash added_hash)
+    def _update_row_hash(self, pivot, coef, denom, added_hash):
+        h1, h2 = self.row_hash[pivot]
+        a1, a2 = added_hash
+        coef = coef * _inverse_mod(denom)
+        self.trail.set_item(self.row_hash, pivot, (
+            (h1 + coef*a1) % _prime,
+            (h2 + coef*a2) % _prime,
+        ))
 
+    # the row without pivot and equation indices, up to a multiplicative constant
+    # (divided by the content, with positive coefficient of the least variable),
+    # used only if the hashes fail
     def _row_valkey(self, pivot, row):
         relevant_items = tuple(
             (x,coef) for (x,coef) in row.items()
-            if not isinstance(x, EquationIndex) and x != pivot
+            if x >= 0 and x != pivot
         )
         if not relevant_items: return ()
         _,coef0 = min(relevant_items)
-        return frozenset((x, coef/coef0) for (x,coef) in relevant_items)
+        content = gcd(*(coef for _,coef in relevant_items))
+        if coef0 < 0: content = -content
+        return frozenset((x, coef // content) for (x,coef) in relevant_items)
+
+    # checks that the rows without pivots and equation indices are proportional
+    def _rows_proportional(self, x, row_x, y, row_y):
+        items_x = [(v,coef) for (v,coef) in row_x.items() if v >= 0 and v != x]
+        size_y = 0
+        for v in row_y.keys():
+            if v >= 0 and v != y: size_y += 1
+        if len(items_x) != size_y: return False
+        v0, cx0 = items_x[0]
+        cy0 = row_y.get(v0)
+        if cy0 is None: return False
+        return all(cx*cy0 == row_y.get(v, 0)*cx0 for (v,cx) in items_x)
 
     # remove from self.rows and self.cols
     def _remove_row(self, pivot, row):
-        del self.rows[pivot]
+        self.trail.del_item(self.rows, pivot)
+        self.trail.del_item(self.row_hash, pivot)
+        self.trail.del_item(self.rows_mod, pivot)
+        if pivot in self.row_valkey: self.trail.del_item(self.row_valkey, pivot)
         for x,coef in row.items():
-            if not isinstance(x, EquationIndex) and x in self.cols:
-                self.cols[x].discard(pivot)
+            if x >= 0 and x in self.cols:
+                self.trail.set_discard(self.cols[x], pivot)
 
     # updates only self.value_to_var, not self.rows nor self.cols
     def _deactivate_row(self, pivot, row):
-        valkey = self._row_valkey(pivot, row)
-        del self.value_to_var[valkey]
+        valkey = self.trail.pop_item(self.row_valkey, pivot)
+        self.trail.del_item(self.value_to_var, valkey)
 
     def _activate_row(self, x, row, to_glue_out):
-        valkey = self._row_valkey(x, row)
-        if len(valkey) <= 1:
-            if len(valkey) == 0:
+        size = 0
+        for v in row.keys():
+            if v >= 0 and v != x:
+                size += 1
+                y = v
+        if size <= 1:
+            if size == 0:
                 self._add_zero(x, row, to_glue_out)
             else:
-                (y,_), = valkey
                 self._add_proportion(x, y, row, to_glue_out)
             self._remove_row(x, row)
             return False
         else:
-            y = self.value_to_var.setdefault(valkey, x)
-            if y is x: return True
+            # key of the row up to a multiplicative constant
+            w1, w2 = _hash_weights[x]
+            h1, h2 = self.row_hash[x]
+            h1, h2 = (h1 + w1) % _prime, (h2 + w2) % _prime # remove the pivot (coef -1)
+            if h2 == 0: valkey = self._row_valkey(x, row)
+            else: valkey = h1 * pow(h2, -1, _prime) % _prime
+            y = self.value_to_var.get(valkey)
+            if y is not None and not self._rows_proportional(x, row, y, self.rows[y]):
+                # hash collision, fall back to the exact key
+                valkey = self._row_valkey(x, row)
+                y = self.value_to_var.get(valkey)
+            if y is None:
+                self.trail.set_item(self.value_to_var, valkey, x)
+                self.trail.set_item(self.row_valkey, x, valkey)
+                return True
 
             # x and y are proportional
 
@@ -362,7 +731,8 @@ class ElimMatrix:
                 x,y = y,x
                 eq_x = self.rows[x]
                 eq_y = row
-                self.value_to_var[valkey] = y
+                self.trail.set_item(self.value_to_var, valkey, y)
+                self.trail.set_item(self.row_valkey, y, valkey)
                 preserve_x = True
             else:
                 eq_x = row
@@ -370,7 +740,7 @@ class ElimMatrix:
                 preserve_x = False
 
             # get equation stating x = coef*y
-            z,_ = next(iter(valkey))
+            z = next(v for v in eq_x.keys() if v >= 0 and v != x)
             eq = eq_x + eq_y * (-eq_x[z] / eq_y[z])
 
             # add as a proportion, remove from matrix
@@ -381,87 +751,95 @@ class ElimMatrix:
 
 if __name__ == "__main__":
 
-    elim = ElimMatrix()
-
     #elim.add(SparseRow({'A': Fraction(3, 2), 'B': Fraction(-1, 1)}))
     #elim.add(SparseRow({'C': Fraction(3, 2), 'D': Fraction(-1, 1)}))
     #elim.add(SparseRow({'A': Fraction(1, 1), 'C': Fraction(1, 1)}))
     #print(elim.get_inverse('D'))
     #print(elim.proportional_to)
 
-    elim.add({0: Fraction(1, 1)})
-    elim.add({0: Fraction(1, 1)})
-    elim.add({3: Fraction(2, 1), 4: Fraction(-2, 1)})
-    elim.add({6: Fraction(-1, 1), 4: Fraction(1, 1)})
-    elim.add({6: Fraction(2, 1), 8: Fraction(-2, 1)})
-    elim.add({3: Fraction(-1, 1), 8: Fraction(1, 1)})
-    elim.add({3: Fraction(-1, 1), 10: Fraction(1, 1)})
-    elim.add({13: Fraction(2, 1), 3: Fraction(-1, 1)})
-    elim.add({13: Fraction(2, 1), 17: Fraction(-1, 1)})
-    elim.add({3: Fraction(-1, 1), 17: Fraction(1, 1)})
-    elim.add({12: Fraction(-1, 1), 18: Fraction(1, 1)})
-    elim.add({13: Fraction(2, 1), 21: Fraction(-1, 1)})
-    elim.add({3: Fraction(-1, 1), 21: Fraction(1, 1)})
-    elim.add({12: Fraction(-1, 1), 22: Fraction(1, 1)})
-    elim.add({25: Fraction(-1, 1), 26: Fraction(1, 1)})
-    elim.add({27: Fraction(1, 1), 25: Fraction(-1, 1), 28: Fraction(-1, 1)})
-    elim.add({28: Fraction(1, 1), 29: Fraction(-1, 1)})
-    elim.add({28: Fraction(-1, 1), 29: Fraction(1, 1)})
-    elim.add({30: Fraction(2, 1), 3: Fraction(-1, 1)})
-    elim.add({30: Fraction(2, 1), 33: Fraction(-1, 1)})
-    elim.add({3: Fraction(-1, 1), 33: Fraction(1, 1)})
-    elim.add({12: Fraction(-1, 1), 34: Fraction(1, 1)})
-    elim.add({12: Fraction(-1, 1), 25: Fraction(1, 1)})
-    elim.add({3: Fraction(2, 1), 35: Fraction(-2, 1)})
-    elim.add({6: Fraction(-1, 1), 35: Fraction(1, 1)})
-    elim.add({6: Fraction(-1, 1), 37: Fraction(1, 1)})
-    elim.add({43: Fraction(2, 1), 44: Fraction(-1, 1)})
-    elim.add({45: Fraction(2, 1), 3: Fraction(-1, 1)})
-    elim.add({30: Fraction(-1, 1), 45: Fraction(1, 1)})
-    elim.add({43: Fraction(1, 1), 45: Fraction(1, 1), 46: Fraction(-1, 1)})
-    elim.add({48: Fraction(-1, 1), 46: Fraction(1, 1)})
-    elim.add({50: Fraction(2, 1), 51: Fraction(-1, 1)})
-    elim.add({52: Fraction(2, 1), 3: Fraction(-1, 1)})
-    elim.add({13: Fraction(-1, 1), 52: Fraction(1, 1)})
-    elim.add({50: Fraction(1, 1), 52: Fraction(1, 1), 53: Fraction(-1, 1)})
-    elim.add({55: Fraction(-1, 1), 53: Fraction(1, 1)})
-    elim.add({44: Fraction(2, 1), 58: Fraction(-2, 1)})
-    elim.add({60: Fraction(-1, 1), 58: Fraction(1, 1)})
-    elim.add({51: Fraction(2, 1), 62: Fraction(-2, 1)})
-    elim.add({64: Fraction(-1, 1), 62: Fraction(1, 1)})
-    elim.add({66: Fraction(-1, 1), 68: Fraction(1, 1)})
-    elim.add({70: Fraction(-1, 1), 72: Fraction(1, 1)})
-    elim.add({6: Fraction(-1, 1), 80: Fraction(1, 1)})
-    elim.add({6: Fraction(-1, 1), 83: Fraction(1, 1)})
-    elim.add({44: Fraction(-1, 1), 48: Fraction(1, 1), 87: Fraction(-1, 1)})
-    elim.add({48: Fraction(-1, 1), 3: Fraction(1, 1), 88: Fraction(-1, 1)})
-    elim.add({87: Fraction(-1, 1), 88: Fraction(1, 1)})
-    elim.add({70: Fraction(-1, 1), 89: Fraction(1, 1)})
-    elim.add({51: Fraction(-1, 1), 55: Fraction(1, 1), 92: Fraction(-1, 1)})
-    elim.add({55: Fraction(-1, 1), 3: Fraction(1, 1), 93: Fraction(-1, 1)})
-    elim.add({92: Fraction(-1, 1), 93: Fraction(1, 1)})
-    elim.add({66: Fraction(-1, 1), 94: Fraction(1, 1)})
-    elim.add({100: Fraction(-1, 1), 101: Fraction(1, 1), 102: Fraction(-1, 1)})
-    elim.add({103: Fraction(2, 1), 64: Fraction(-1, 1)})
-    elim.add({105: Fraction(2, 1), 107: Fraction(-1, 1)})
-    elim.add({103: Fraction(-1, 1), 105: Fraction(1, 1), 108: Fraction(-1, 1)})
-    elim.add({102: Fraction(-1, 1), 108: Fraction(1, 1)})
-    elim.add({110: Fraction(-1, 1), 111: Fraction(1, 1), 112: Fraction(-1, 1)})
-    elim.add({113: Fraction(2, 1), 115: Fraction(-1, 1)})
-    elim.add({116: Fraction(2, 1), 60: Fraction(-1, 1)})
-    elim.add({113: Fraction(-1, 1), 116: Fraction(1, 1), 118: Fraction(-1, 1)})
-    elim.add({112: Fraction(-1, 1), 118: Fraction(1, 1)})
-    elim.add({70: Fraction(-1, 1), 119: Fraction(1, 1)})
-    elim.add({66: Fraction(-1, 1), 120: Fraction(1, 1)})
-    elim.add({115: Fraction(-1, 1), 77: Fraction(1, 1), 122: Fraction(-1, 1)})
-    elim.add({77: Fraction(-1, 1), 60: Fraction(1, 1), 123: Fraction(-1, 1)})
-    elim.add({122: Fraction(-1, 1), 123: Fraction(1, 1)})
-    elim.add({0: Fraction(1, 1)})
-    elim.add({64: Fraction(-1, 1), 77: Fraction(1, 1), 125: Fraction(-1, 1)})
-    elim.add({77: Fraction(-1, 1), 107: Fraction(1, 1), 126: Fraction(-1, 1)})
-    print('A')
-    elim.check_consistency()
-    print('B')
-    elim.add({125: Fraction(-1, 1), 126: Fraction(1, 1)})
-    print('C')
-    elim.check_consistency()
+    # recorded stream of equations, the pivot strategies can be compared on it
+    equations = [
+        {0: Fraction(1, 1)},
+        {0: Fraction(1, 1)},
+        {3: Fraction(2, 1), 4: Fraction(-2, 1)},
+        {6: Fraction(-1, 1), 4: Fraction(1, 1)},
+        {6: Fraction(2, 1), 8: Fraction(-2, 1)},
+        {3: Fraction(-1, 1), 8: Fraction(1, 1)},
+        {3: Fraction(-1, 1), 10: Fraction(1, 1)},
+        {13: Fraction(2, 1), 3: Fraction(-1, 1)},
+        {13: Fraction(2, 1), 17: Fraction(-1, 1)},
+        {3: Fraction(-1, 1), 17: Fraction(1, 1)},
+        {12: Fraction(-1, 1), 18: Fraction(1, 1)},
+        {13: Fraction(2, 1), 21: Fraction(-1, 1)},
+        {3: Fraction(-1, 1), 21: Fraction(1, 1)},
+        {12: Fraction(-1, 1), 22: Fraction(1, 1)},
+        {25: Fraction(-1, 1), 26: Fraction(1, 1)},
+        {27: Fraction(1, 1), 25: Fraction(-1, 1), 28: Fraction(-1, 1)},
+        {28: Fraction(1, 1), 29: Fraction(-1, 1)},
+        {28: Fraction(-1, 1), 29: Fraction(1, 1)},
+        {30: Fraction(2, 1), 3: Fraction(-1, 1)},
+        {30: Fraction(2, 1), 33: Fraction(-1, 1)},
+        {3: Fraction(-1, 1), 33: Fraction(1, 1)},
+        {12: Fraction(-1, 1), 34: Fraction(1, 1)},
+        {12: Fraction(-1, 1), 25: Fraction(1, 1)},
+        {3: Fraction(2, 1), 35: Fraction(-2, 1)},
+        {6: Fraction(-1, 1), 35: Fraction(1, 1)},
+        {6: Fraction(-1, 1), 37: Fraction(1, 1)},
+        {43: Fraction(2, 1), 44: Fraction(-1, 1)},
+        {45: Fraction(2, 1), 3: Fraction(-1, 1)},
+        {30: Fraction(-1, 1), 45: Fraction(1, 1)},
+        {43: Fraction(1, 1), 45: Fraction(1, 1), 46: Fraction(-1, 1)},
+        {48: Fraction(-1, 1), 46: Fraction(1, 1)},
+        {50: Fraction(2, 1), 51: Fraction(-1, 1)},
+        {52: Fraction(2, 1), 3: Fraction(-1, 1)},
+        {13: Fraction(-1, 1), 52: Fraction(1, 1)},
+        {50: Fraction(1, 1), 52: Fraction(1, 1), 53: Fraction(-1, 1)},
+        {55: Fraction(-1, 1), 53: Fraction(1, 1)},
+        {44: Fraction(2, 1), 58: Fraction(-2, 1)},
+        {60: Fraction(-1, 1), 58: Fraction(1, 1)},
+        {51: Fraction(2, 1), 62: Fraction(-2, 1)},
+        {64: Fraction(-1, 1), 62: Fraction(1, 1)},
+        {66: Fraction(-1, 1), 68: Fraction(1, 1)},
+        {70: Fraction(-1, 1), 72: Fraction(1, 1)},
+        {6: Fraction(-1, 1), 80: Fraction(1, 1)},
+        {6: Fraction(-1, 1), 83: Fraction(1, 1)},
+        {44: Fraction(-1, 1), 48: Fraction(1, 1), 87: Fraction(-1, 1)},
+        {48: Fraction(-1, 1), 3: Fraction(1, 1), 88: Fraction(-1, 1)},
+        {87: Fraction(-1, 1), 88: Fraction(1, 1)},
+        {70: Fraction(-1, 1), 89: Fraction(1, 1)},
+        {51: Fraction(-1, 1), 55: Fraction(1, 1), 92: Fraction(-1, 1)},
+        {55: Fraction(-1, 1), 3: Fraction(1, 1), 93: Fraction(-1, 1)},
+        {92: Fraction(-1, 1), 93: Fraction(1, 1)},
+        {66: Fraction(-1, 1), 94: Fraction(1, 1)},
+        {100: Fraction(-1, 1), 101: Fraction(1, 1), 102: Fraction(-1, 1)},
+        {103: Fraction(2, 1), 64: Fraction(-1, 1)},
+        {105: Fraction(2, 1), 107: Fraction(-1, 1)},
+        {103: Fraction(-1, 1), 105: Fraction(1, 1), 108: Fraction(-1, 1)},
+        {102: Fraction(-1, 1), 108: Fraction(1, 1)},
+        {110: Fraction(-1, 1), 111: Fraction(1, 1), 112: Fraction(-1, 1)},
+        {113: Fraction(2, 1), 115: Fraction(-1, 1)},
+        {116: Fraction(2, 1), 60: Fraction(-1, 1)},
+        {113: Fraction(-1, 1), 116: Fraction(1, 1), 118: Fraction(-1, 1)},
+        {112: Fraction(-1, 1), 118: Fraction(1, 1)},
+        {70: Fraction(-1, 1), 119: Fraction(1, 1)},
+        {66: Fraction(-1, 1), 120: Fraction(1, 1)},
+        {115: Fraction(-1, 1), 77: Fraction(1, 1), 122: Fraction(-1, 1)},
+        {77: Fraction(-1, 1), 60: Fraction(1, 1), 123: Fraction(-1, 1)},
+        {122: Fraction(-1, 1), 123: Fraction(1, 1)},
+        {0: Fraction(1, 1)},
+        {64: Fraction(-1, 1), 77: Fraction(1, 1), 125: Fraction(-1, 1)},
+        {77: Fraction(-1, 1), 107: Fraction(1, 1), 126: Fraction(-1, 1)},
+        {125: Fraction(-1, 1), 126: Fraction(1, 1)},
+    ]
+
+    for args in (
+        dict(pivot_strategy = "column"),
+        dict(pivot_strategy = "markowitz"),
+        dict(pivot_strategy = "markowitz", resparsify_period = 10),
+        dict(pivot_strategy = "markowitz", provenance = False),
+    ):
+        elim = ElimMatrix(**args)
+        for equation in equations: elim.add(equation)
+        assert(elim.check_consistency())
+        print(args)
+        print("  ", elim.stats())
@@ -1,4 +1,5 @@
 from fractions import Fraction
+from math import gcd, lcm
 
 """
 SparseRow is a dictionary of the form obj -> Fraction
@@ -71,3 +72,139 @@ class SparseRow(dict):
 zero_sr = SparseRow(())
 def equality_sr(a, b):
     return SparseRow(((a, Fraction(-1)), (b, Fraction(1))))
+
+"""
+IntSparseRow represents the same vectors as SparseRow, but it stores
+only integers. It is a dictionary obj -> int (numerator) together with
+a common positive denominator "denom", so the coefficient of obj is
+  numerator / denom.
+The arithmetic is fraction-free, only the common content of the numerators
+and the denominator is divided out (normalize) after an in-place update.
+It is used internally by ElimMatrix where Fraction arithmetic was
+the bottleneck.
+
+Reading a single coefficient by row[obj] returns a Fraction,
+row.items() returns the numerators.
+"""
+
+class IntSparseRow(dict):
+    __slots__ = ("denom",)
+    def __init__(self, data = ()):
+        super(IntSparseRow, self).__init__()
+        if isinstance(data, IntSparseRow):
+            dict.update(self, data)
+            self.denom = data.denom
+            return
+        # dictionaries of Fractions / ints are converted directly
+        if not isinstance(data, dict): data = SparseRow(data)
+        denom = lcm(*(x.denominator for x in data.values()))
+        self.denom = denom
+        dict.update(self, (
+            (k, x.numerator * (denom // x.denominator))
+            for k,x in data.items() if x != 0
+        ))
+
+    def __getitem__(self, key):
+        return Fraction(self.get(key, 0), self.denom)
+    def to_sparse_row(self):
+        denom = self.denom
+        return SparseRow((k, Fraction(x, denom)) for k,x in self.items())
+
+    def normalize(self):
+        g = gcd(self.denom, *self.values())
+        if g > 1:
+            dict.update(self, { k : x // g for k,x in self.items() })
+            self.denom //= g
+
+    def set_coef(self, key, coef): # self[key] = coef
+        coef = Fraction(coef)
+        if coef.denominator > 1: self._expand(coef.denominator // gcd(self.denom, coef.denominator))
+        if coef == 0: self.pop(key, None)
+        else: dict.__setitem__(self, key, coef.numerator * (self.denom // coef.denominator))
+        self.normalize()
+
+    # scales the row so that the coefficient of x is -1
+    def make_pivot(self, x):
+        c = self.get(x)
+        if c > 0: dict.update(self, { k : -y for k,y in self.items() })
+        self.denom = abs(c)
+        self.normalize()
+
+    # multiplies both the numerators and the denominator by a positive integer
+    def _expand(self, a):
+        if a == 1: return
+        dict.update(self, { k : x*a for k,x in self.items() })
+        self.denom *= a
+
+    def iadd_ratio(self, p, q, other): # self += (p/q)*other, q > 0
+        if p == 0 or not other: return self
+        # c/d + p*o/(q*e) = (c*a + o*b) / (d*a), a = qe/g, b = p*d/g, g = gcd(d,qe)
+        d = self.denom
+        qe = q*other.denom
+        g = gcd(d, qe)
+        self._expand(qe // g)
+        b = p * (d // g)
+        get = self.get
+        for k,x in other.items():
+            x2 = get(k, 0)+b*x
+            if x2 == 0: del self[k]
+            else: dict.__setitem__(self, k, x2)
+        self.normalize()
+        return self
+    def iadd_coef(self, coef, other): # self += coef*other
+        if coef == 0: return self
+        return self.iadd_ratio(coef.numerator, coef.denominator, other)
+
+    def __imul__(self, n):
+        n = Fraction(n)
+        if n == 0:
+            self.clear()
+            self.denom = 1
+        else:
+            dict.update(self, { k : x*n.numerator for k,x in self.items() })
+            self.denom *= n.denominator
+            self.normalize()
+        return self
+    def __mul__(self, n):
+        res = type(self)(self)
+        res *= n
+        return res
+    def __rmul__(self, n):
+        return self.__mul__(n)
+    def __iadd__(self, other):
+        return self.iadd_ratio(1, 1, other)
+    def __add__(self, other):
+        res = type(self)(self)
+        res += other
+        return res
+
+"""
+BoundedIntSparseRow is an IntSparseRow which represents a linear combination
+of some equations (the equation it was created from has the coefficient 1),
+and keeps only an integer "bound" instead of the coefficients of the combination.
+All the coefficients of the combination are guaranteed to be
+fractions with denominators dividing the bound. It is an upper estimate,
+the denominators are not cancelled out as in the exact combination.
+"""
+
+class BoundedIntSparseRow(IntSparseRow):
+    __slots__ = ("bound",)
+    def __init__(self, data = ()):
+        super(BoundedIntSparseRow, self).__init__(data)
+        self.bound = getattr(data, "bound", 1)
+
+    def make_pivot(self, x):
+        c = self.get(x)
+        self.bound *= abs(c) // gcd(c, self.denom)
+        super(BoundedIntSparseRow, self).make_pivot(x)
+
+    def iadd_ratio(self, p, q, other): # self += (p/q)*other, q > 0
+        if p == 0 or not other: return self
+        bound = other.bound * (q // gcd(p, q))
+        self.bound = lcm(self.bound, bound)
+        return super(BoundedIntSparseRow, self).iadd_ratio(p, q, other)
+
+    def __imul__(self, n):
+        n = Fraction(n)
+        if n != 0: self.bound *= n.denominator
+        return super(BoundedIntSparseRow, self).__imul__(n)
@@ -9,13 +9,19 @@ For usage, wrap any piece of code into:
         some
         code
 It summarizes the parts of the code which were under a given label.
+Besides that, events (such as cache hits) can be counted by
+    count("Any label")
 In the end, call print_times() for printing how much time
-the operations have taken.
+the operations have taken, and the counters.
 """
 
 _d = dict()
 _l = list()
 _stack = ()
+_counts = dict()
+
+def count(name, n = 1):
+    _counts[name] = _counts.get(name, 0) + n
 
 class StopWatch:
     def __init__(self, name):
@@ -75,6 +81,7 @@ def seconds_to_readable(secs):
     return ", ".join(result)
 
 def print_times():
+    print_counts()
     if not _l: return
 
     scopes = {() : []}
@@ -99,3 +106,10 @@ def print_times():
             enters, secs / enters,
         ))
     sys.stdout.flush()
+
+def print_counts():
+    if not _counts: return
+    print("Counters")
+    for name, n in sorted(_counts.items()):
+        print("  {}: {}".format(name, n))
+    sys.stdout.flush()
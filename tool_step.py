@@ -1,10 +1,14 @@
+import hashlib
 from fractions import Fraction
 from tools import MemoizedTool, ToolError, DimCompute, DimPred, ToolErrorException
 from logical_core import LogicalCore
+from proof_cache import proof_cache
 
 import threading
+import multiprocessing
 from queue import Queue, Empty
 from collections import deque
+from operator import itemgetter
 import time
 
 
@@ -48,24 +52,78 @@ class ToolStepEnv:
 
     def run_steps(self, steps, strictness, catch_errors = False):
         # strictness: 0 = postulate, 1 = check
+        # the checks need the triggers applied after every step,
+        # so only postulating is run in a batch
+        if strictness == 0 and not self.logic.batch_depth:
+            with self.logic.batch():
+                self.run_steps(steps, strictness, catch_errors)
+            return
         for step in steps:
-            global_args = tuple(self.local_to_global[v] for v in step.local_args)
-            subresult = [None]*len(step.tool.out_types)
-            step.success = False # a value read by GUI
-            if None not in global_args:
-                try:
-                    subresult = step.tool.run(step.hyper_params, global_args, self.logic, strictness)
-                    step.success = True
-                except Exception as e:
-                    if not isinstance(e, ToolError): e = ToolErrorException(e)
-                    if step.debug_msg is not None: e.tool_traceback.append(step.debug_msg)
-                    if catch_errors:
-                        #print("Construction error: {}".format(e))
-                        pass
-                    else: raise e
-            self.local_to_global.extend(subresult)
+            self.local_to_global.extend(self.run_step(step, strictness, catch_errors))
+
+    # runs only the steps of the given indices, the outputs of the other steps are None
+    def run_steps_subset(self, steps, indices, strictness):
+        for i, step in enumerate(steps):
+            if i in indices: self.local_to_global.extend(self.run_step(step, strictness))
+            else: self.local_to_global.extend([None]*len(step.local_outputs))
+
+    # runs a single step without storing its output, returns the global indices of the output
+    def run_step(self, step, strictness, catch_errors = False):
+        global_args = tuple(self.local_to_global[v] for v in step.local_args)
+        subresult = [None]*len(step.tool.out_types)
+        step.success = False # a value read by GUI
+        if None not in global_args:
+            try:
+                subresult = step.tool.run(step.hyper_params, global_args, self.logic, strictness)
+                step.success = True
+            except Exception as e:
+                if not isinstance(e, ToolError): e = ToolErrorException(e)
+                if step.debug_msg is not None: e.tool_traceback.append(step.debug_msg)
+                if catch_errors:
+                    #print("Construction error: {}".format(e))
+                    pass
+                else: raise e
+        return subresult
+
+# for every step, the set of indices of the previous steps
+# whose outputs it uses (directly or indirectly)
+def step_dependencies(steps):
+    producers = dict() # local index -> step index
+    dependencies = []
+    for i, step in enumerate(steps):
+        step_deps = set()
+        for v in step.local_args:
+            j = producers.get(v)
+            if j is not None:
+                step_deps.add(j)
+                step_deps.update(dependencies[j])
+        dependencies.append(step_deps)
+        for v in step.local_outputs: producers[v] = i
+    return dependencies
+
+"""
+Proof slicing: the implications are checked after the proof with the
+local indices reset to the assumptions, so they do not use the proof steps
+directly, but only the facts the proof steps add to the logical core.
+So which proof steps are needed for an implication cannot be decided
+from local_args alone. Slicing is an experimental opt-in, it is off
+by default. If CompositeTool.slice_proofs is set, the first passing proof check of a tool finds for every implication a minimal
+slice of the proof -- removing a proof step removes also all the steps
+using its outputs (step_dependencies), and the step stays removed
+if the implication (with the implication steps it depends on)
+still passes. The next proof checks run only the union of the slices,
+and nested proof checks of the removed steps are not requested.
+A sliced proof is still a valid proof (all its steps are checked).
+If it fails on another configuration, the full proof is checked.
+The slices are searched with nested proof checks disabled,
+it takes about (number of implications) x (number of proof steps)
+proof runs, see benchmark.py proof_slices. A failing check only runs
+the full proof, the search waits for a configuration where it passes.
+"""
 
 class CompositeTool(MemoizedTool):
+    slice_proofs = False # experimental opt-in, see "Proof slicing" above
+    use_plans = False # opt-in: run_no_mem by an ExecutionPlan instead of ToolStepEnv
     def __init__(self, assumptions, implications, result, proof, arg_types, out_types, name,
                  basic_tools = None):
         MemoizedTool.__init__(self, arg_types, out_types, name)
@@ -74,6 +132,9 @@ class CompositeTool(MemoizedTool):
         self.result = result
         self.proof = proof
         self.proof_tools = basic_tools # access to basic tools for running triggers in the proof check
+        self._content_hash = None
+        self.proof_slices = None # minimal slice of the proof for every implication
+        self.plans = dict() # strictness, or (None, proof slice) -> ExecutionPlan
 
         # estimating the total number of nested proof checks that will be required
         self.deep_len_all = sum(
@@ -91,45 +152,345 @@ class CompositeTool(MemoizedTool):
             )
             self.deep_len_all += self.deep_len_proof
 
+    # depends on the steps and on the hashes of the used tools,
+    # so it changes also by a modification of a tool used in the steps
+    def content_hash(self):
+        if self._content_hash is None:
+            data = [MemoizedTool.content_hash(self), self.result]
+            for steps in (self.assumptions, self.implications, self.proof):
+                if steps is None: data.append(None)
+                else: data.append(tuple(
+                    (step.tool.content_hash(), step.hyper_params, step.local_args)
+                    for step in steps
+                ))
+            self._content_hash = hashlib.sha1(repr(data).encode()).hexdigest()
+        return self._content_hash
+
     def run_no_mem(self, args, logic, strictness):
+        if self.use_plans: return self.execution_plan(strictness).run(args, logic)
         env = ToolStepEnv(logic, args)
-        env.run_steps(self.assumptions, strictness)
-        if strictness == 1 and self.proof is not None:
-            num_args = [
-                logic.num_model[gi]
-                for gi in env.local_to_global
-            ]
-            proof_checker.check(self, num_args)
-        env.run_steps(self.implications, 0)
+        if strictness == 0: # nothing is checked, all the steps are run in one batch
+            env.run_steps(self.assumptions + self.implications, 0)
+        else:
+            env.run_steps(self.assumptions, strictness)
+            if self.proof is not None:
+                num_args = [
+                    logic.num_model[gi]
+                    for gi in env.local_to_global
+                ]
+                proof_checker.check(self, num_args)
+            env.run_steps(self.implications, 0)
 
         result = tuple(env.local_to_global[v] for v in self.result)
         return result
 
+    # the plan running the tool with the given strictness (0 or higher), see ExecutionPlan
+    def execution_plan(self, strictness):
+        plan = self.plans.get(strictness)
+        if plan is None:
+            plan = ExecutionPlan(self, strictness)
+            self.plans[strictness] = plan
+        return plan
+
+    # the plan of the proof check running the given proof steps and implications,
+    # only the plans checking all the implications are kept
+    # (the other ones are used once by find_proof_slices)
+    def proof_plan(self, proof_slice, implication_slice):
+        if implication_slice is not None:
+            return ExecutionPlan(self, None, proof_slice, implication_slice)
+        if proof_slice is not None: proof_slice = frozenset(proof_slice)
+        key = None, proof_slice
+        plan = self.plans.get(key)
+        if plan is None:
+            plan = ExecutionPlan(self, None, proof_slice)
+            self.plans[key] = plan
+        return plan
+
+    def run_num(self, hyper_params, num_args):
+        num_vars = list(num_args)
+        for steps in (self.assumptions, self.implications):
+            for step in steps:
+                step_args = tuple(num_vars[v] for v in step.local_args)
+                num_vars.extend(step.tool.run_num(step.hyper_params, step_args))
+        return tuple(num_vars[v] for v in self.result)
+
+    # the configurations already checked are skipped, see proof_cache.py
     def proof_check(self, num_args):
         assert(self.proof is not None)
-        logic = LogicalCore(basic_tools = self.proof_tools)
+        cache_key = proof_cache.key(self, num_args[:len(self.arg_types)])
+        if proof_cache.lookup(cache_key): return
+        if self.slice_proofs and self.proof_slices is None:
+            # the slices are searched only after the full proof passed
+            self.check_proof_steps(num_args)
+            self.proof_slices = self.find_proof_slices(num_args)
+            proof_cache.add(cache_key)
+            return
+        proof_slice = self.proof_slice()
+        if len(proof_slice) < len(self.proof):
+            try:
+                self.check_proof_steps(num_args, proof_slice)
+                proof_cache.add(cache_key)
+                return
+            except ToolError: pass # check the full proof
+        self.check_proof_steps(num_args)
+        proof_cache.add(cache_key)
+
+    # indices of the proof steps run by proof_check
+    def proof_slice(self):
+        if self.proof_slices is None: return set(range(len(self.proof)))
+        return set().union(*self.proof_slices)
+
+    # runs the given proof steps (by default all) and checks the implications (by default all)
+    def check_proof_steps(self, num_args, proof_slice = None, implication_slice = None):
+        logic = LogicalCore(basic_tools = self.proof_tools, angle_provenance = False)
         args = logic.add_objs(num_args[:len(self.arg_types)])
-        env = ToolStepEnv(logic, args)
         try:
+            if self.use_plans:
+                self.proof_plan(proof_slice, implication_slice).run(args, logic)
+                return
+            if proof_slice is None: proof_slice = range(len(self.proof))
+            if implication_slice is None: implication_slice = range(len(self.implications))
+            env = ToolStepEnv(logic, args)
             env.run_steps(self.assumptions, 0)
             #for num_arg, gi in zip(num_args, env.local_to_global):
             #    if not num_arg.identical_to(logic.num_model[gi]):
             #        raise ToolError("Extracted problem leads to different numerical values")
 
             local_to_global_bak = list(env.local_to_global)
-            env.run_steps(self.proof, 1)
+            env.run_steps_subset(self.proof, proof_slice, 1)
             env.local_to_global = local_to_global_bak
-            env.run_steps(self.implications, 1)
+            env.run_steps_subset(self.implications, implication_slice, 1)
         except ToolError as e:
             e.tool_traceback.append(
                 "Failed proof: {} {}".format(self.name, num_args[:len(self.arg_types)])
             )
             raise
 
+    # returns the list of minimal proof slices (sets of proof step indices),
+    # one for every implication, the full proof is expected to pass on num_args
+    def find_proof_slices(self, num_args):
+        proof_deps = step_dependencies(self.proof)
+        proof_dependents = [
+            set(j for j in range(i+1, len(self.proof)) if i in proof_deps[j])
+            for i in range(len(self.proof))
+        ]
+        implication_deps = step_dependencies(self.implications)
+        disabled = proof_checker.disabled
+        proof_checker.disable()
+        try:
+            def passes(proof_slice, implication_slice):
+                try: self.check_proof_steps(num_args, proof_slice, implication_slice)
+                except ToolError: return False
+                return True
+            proof_slices = []
+            for i in range(len(self.implications)):
+                implication_slice = implication_deps[i] | {i}
+                proof_slice = set(range(len(self.proof)))
+                for j in reversed(range(len(self.proof))):
+                    if j not in proof_slice: continue
+                    candidate = proof_slice - proof_dependents[j] - {j}
+                    if passes(candidate, implication_slice): proof_slice = candidate
+                proof_slices.append(proof_slice)
+            return proof_slices
+        finally:
+            proof_checker.disabled = disabled
+
 ####################  Composite Tool  ####################
 ##########################################################
+####################  Execution Plan  ####################
+
+"""
+ExecutionPlan is a CompositeTool compiled for running without ToolStepEnv.
+It is an opt-in alternative executor (CompositeTool.use_plans, off by default),
+compared with ToolStepEnv by benchmark.py plans.
+All the local objects have a slot in an array (list) allocated at once,
+and the steps are replaced by operations
+  (STEP, tool.run, hyper_params, argument getter, output slots, strictness, traceback)
+the arguments are taken from the slots by operator.itemgetter, and the outputs
+are written to a continuous range of slots. A plan with strictness
+  0: runs the assumptions and implications in one batch of the logical core
+  1 (or higher): runs the assumptions with the strictness, requests the proof check,
+     then runs the implications with strictness 0 in a batch
+  None: the proof check (CompositeTool.check_proof_steps), runs the assumptions
+        in a batch, then the proof steps with strictness 1, and the implications
+        with strictness 1 on the slots of the assumptions (the local objects
+        of the proof are not visible to them). Only the steps of the given
+        proof / implication slice are compiled, the other steps keep
+        their slots, so the local indices do not change. Returns ().
+The composite tools used by the steps with strictness 0 are inlined
+(their steps are added to the plan, with slots for their local objects).
+Such a step is replaced by
+  (MEMO_LOOKUP, tool, ...)  = logic.get_constr, if found, jumps after MEMO_STORE
+  ... (steps of the tool)
+  (MEMO_STORE, tool, ...)   = tool.memoize with the result of the steps
+so the lookup table is used the same way as by MemoizedTool.run.
+With strictness > 0, the composite tools are not inlined -- the proof check
+of every used tool has to be requested with its own local objects.
+The errors get the same tool_traceback as in ToolStepEnv.run_step.
+"""
+
+STEP = 0
+MEMO_LOOKUP = 1
+MEMO_STORE = 2
+PROOF_CHECK = 3
+
+# function returning the tuple of the given slots
+def slot_getter(slots):
+    if len(slots) == 0: return lambda values: ()
+    if len(slots) == 1:
+        i, = slots
+        return lambda values: (values[i],)
+    return itemgetter(*slots)
+
+class ExecutionPlan:
+    max_ops = 512 # no more tools are inlined in a bigger plan
+
+    def __init__(self, tool, strictness, proof_slice = None, implication_slice = None):
+        self.tool = tool
+        self.ops = []
+        self.size = len(tool.arg_types)
+        local_slots = list(range(self.size))
+        if strictness is None:
+            self.compile_steps(tool.assumptions, 0, local_slots, ())
+            self.batch = 0, len(self.ops) # the ops run in a batch
+            assumption_slots = list(local_slots)
+            self.compile_steps(tool.proof, 1, local_slots, (), proof_slice)
+            self.compile_steps(tool.implications, 1, assumption_slots, (), implication_slice)
+            self.result = slot_getter(())
+            return
+        if strictness == 0:
+            self.compile_steps(tool.assumptions + tool.implications, 0, local_slots, ())
+            self.batch = 0, len(self.ops)
+        else:
+            self.compile_steps(tool.assumptions, strictness, local_slots, ())
+            if tool.proof is not None:
+                self.ops.append((PROOF_CHECK, tool, slot_getter(local_slots), None))
+            batch_start = len(self.ops)
+            self.compile_steps(tool.implications, 0, local_slots, ())
+            self.batch = batch_start, len(self.ops)
+        self.result = slot_getter([local_slots[v] for v in tool.result])
+
+    def allocate(self, n):
+        start = self.size
+        self.size += n
+        return start, self.size
+
+    # local_slots: local index of the (inlined) tool -> slot, extended by the step outputs
+    # traceback: debug messages of the inlined steps containing the steps
+    # indices: the indices of the steps to be run, by default all
+    def compile_steps(self, steps, strictness, local_slots, traceback, indices = None):
+        for i, step in enumerate(steps):
+            if indices is not None and i not in indices:
+                local_slots.extend(range(*self.allocate(len(step.tool.out_types))))
+                continue
+            arg_slots = tuple(local_slots[v] for v in step.local_args)
+            step_traceback = (step.debug_msg,) + traceback
+            if strictness == 0 and self.can_inline(step.tool):
+                out_slots = self.inline(step, arg_slots, step_traceback)
+            else: out_slots = None
+            if out_slots is None:
+                out_slots = self.allocate(len(step.tool.out_types))
+                self.ops.append((
+                    STEP, step.tool.run, step.hyper_params, slot_getter(arg_slots),
+                    out_slots[0], out_slots[1], strictness, step_traceback,
+                ))
+            local_slots.extend(range(*out_slots))
+
+    def can_inline(self, tool):
+        t = type(tool)
+        return (
+            isinstance(tool, CompositeTool) and t.run is MemoizedTool.run
+            and t.run_no_mem is CompositeTool.run_no_mem
+            and len(self.ops) < self.max_ops
+        )
+
+    # returns the output slots, or None if the plan would be too big
+    def inline(self, step, arg_slots, traceback):
+        tool = step.tool
+        ops_num, size = len(self.ops), self.size
+        lookup_index = len(self.ops)
+        self.ops.append(None) # MEMO_LOOKUP, filled in later
+        tool_slots = list(arg_slots)
+        self.compile_steps(tool.assumptions + tool.implications, 0, tool_slots, traceback)
+        if len(self.ops) > self.max_ops: # revert
+            del self.ops[ops_num:]
+            self.size = size
+            return None
+        out_start, out_end = self.allocate(len(tool.out_types))
+        args = slot_getter(arg_slots)
+        self.ops.append((
+            MEMO_STORE, tool, args, slot_getter([tool_slots[v] for v in tool.result]),
+            out_start, out_end, traceback,
+        ))
+        self.ops[lookup_index] = (
+            MEMO_LOOKUP, tool, args, out_start, out_end, len(self.ops), traceback,
+        )
+        return out_start, out_end
+
+    def run(self, args, logic):
+        slots = [None]*self.size
+        slots[:len(args)] = args
+        batch_start, batch_end = self.batch
+        if batch_start > 0: self.run_ops(slots, logic, 0, batch_start)
+        if logic.batch_depth: self.run_ops(slots, logic, batch_start, batch_end)
+        else:
+            with logic.batch():
+                self.run_ops(slots, logic, batch_start, batch_end)
+        if batch_end < len(self.ops): self.run_ops(slots, logic, batch_end, len(self.ops))
+        return self.result(slots)
+
+    def run_ops(self, slots, logic, i, end):
+        ops = self.ops
+        try:
+            while i < end:
+                op = ops[i]
+                kind = op[0]
+                if kind == STEP:
+                    _, run, hyper_params, args, out_start, out_end, strictness, _ = op
+                    slots[out_start:out_end] = run(hyper_params, args(slots), logic, strictness)
+                elif kind == MEMO_LOOKUP:
+                    _, tool, args, out_start, out_end, jump, _ = op
+                    memoized = logic.get_constr(tool, args(slots))
+                    if memoized is not None:
+                        slots[out_start:out_end] = memoized
+                        i = jump
+                        continue
+                elif kind == MEMO_STORE:
+                    _, tool, args, result, out_start, out_end, _ = op
+                    result = result(slots)
+                    tool.memoize(args(slots), logic, result)
+                    slots[out_start:out_end] = result
+                else: # PROOF_CHECK
+                    _, tool, local_objs, _ = op
+                    proof_checker.check(tool, [logic.num_model[gi] for gi in local_objs(slots)])
+                i += 1
+        except Exception as e:
+            traceback = ops[i][-1]
+            if traceback is None: raise
+            if not isinstance(e, ToolError): e = ToolErrorException(e)
+            for debug_msg in traceback:
+                if debug_msg is not None: e.tool_traceback.append(debug_msg)
+            raise e
+
+####################  Execution Plan  ####################
+##########################################################
 ####################   Proof Checker  ####################
 
+"""
+By default, the proof checks run one after another in a thread.
+If paralelize gets a number of processes > 1, the thread only dispatches
+the checks to a pool of worker processes. Every worker loads the tool
+library (macros.gl) once, and gets the tasks as
+  ((tool name, arg_types), numerical arguments)
+It returns the error message of the failed check (or None),
+and the nested checks (of the tools used in the proof), which
+are not run in the worker but sent back to be dispatched again.
+The configurations found in proof_cache (see proof_cache.py)
+are not dispatched, and the successful checks are added there.
+The tools not available in the library (defined in a loaded file)
+are checked in the thread.
+"""
+
 class ProofChecker: # parallel running of proof checks
     def __init__(self):
         self.t = threading.Thread(target=self.process, daemon = True)
@@ -139,12 +500,28 @@ class ProofChecker: # parallel running of proof checks
         self.task_index = 0
         self.tasks = []
         self.disabled = False
+        self.waiting = [] # events set once all the checks are done
+        self.nested = None # list of collected checks in a worker process
+        self.time = time.time()
+
+        # process pool backend
+        self.pool = None
+        self.max_running = 0
+        self.running = dict() # task id -> (tool, num_args)
+        self.next_id = 0
+        self.generation = 0 # increased by reset, older results are ignored
+        self.known_tools = dict() # (name, arg_types) -> tool, for the nested checks
 
     def disable(self): self.disabled = True
     def enable(self): self.disabled = False
 
-    def paralelize(self, progress_hook = None):
+    def paralelize(self, progress_hook = None, processes = None, library = "macros.gl"):
         self.progress_hook = progress_hook
+        if processes is not None and processes > 1:
+            # spawn, not fork, the main process can be running GTK
+            context = multiprocessing.get_context("spawn")
+            self.pool = context.Pool(processes, initializer = _worker_init, initargs = (library,))
+            self.max_running = 2*processes
         self.t.start()
     #def start(self):
     #    self.t.start()
@@ -154,7 +531,11 @@ class ProofChecker: # parallel running of proof checks
 
     def check(self, tool, num_args):
         if self.disabled: return
+        if self.nested is not None: # in a worker, the check is sent back
+            self.nested.append((tool, num_args))
+            return
         if not self.t.is_alive():
+            self.checked_num += 1
             tool.proof_check(num_args)
             return
         if threading.current_thread() != self.t:
@@ -169,6 +550,13 @@ class ProofChecker: # parallel running of proof checks
     def reset(self):
         self.q.put((None, "reset"))
 
+    # blocks until all the checks requested so far are done
+    def wait(self):
+        if not self.t.is_alive(): return
+        event = threading.Event()
+        self.q.put((None, ("wait", event)))
+        event.wait()
+
     def read_queue(self, block):
         tool, args = self.q.get(block)
         if tool is not None:
@@ -181,14 +569,36 @@ class ProofChecker: # parallel running of proof checks
             self.task_index = 0
             self.time = time.time()
             self.checked_num = 0
+            self.running = dict()
+            self.generation += 1
+        elif args[0] == "wait":
+            self.waiting.append(args[1])
+        elif args[0] == "done":
+            self.finish_task(*args[1:])
+
+    def notify_done(self):
+        for event in self.waiting: event.set()
+        self.waiting = []
 
     def update_progress(self):
         if self.progress_hook is None: return
-        remains = sum(tool.deep_len_proof for (tool,_) in self.stack + self.tasks[self.task_index:])
+        remains = sum(
+            tool.deep_len_proof
+            for (tool,_) in self.stack + self.tasks[self.task_index:] + list(self.running.values())
+        )
         size = sum(tool.deep_len_proof for (tool,_) in self.tasks)
         self.progress_hook(size - remains, size)
 
+    def print_done(self):
+        print("DONE [{}:{}] {}".format(
+            self.checked_num, sum(tool.deep_len_proof for (tool, _) in self.tasks),
+            time.time() - self.time,
+        ))
+
     def process(self):
+        if self.pool is not None:
+            self.process_pool()
+            return
         sleepiness = 0
         while True:
             while not self.q.empty():
@@ -197,6 +607,7 @@ class ProofChecker: # parallel running of proof checks
                 self.task_index = 0
                 self.tasks = []
                 self.update_progress()
+                self.notify_done()
                 self.read_queue(True)
             if not self.stack and self.task_index < len(self.tasks):
                 self.stack.append(self.tasks[self.task_index])
@@ -215,10 +626,105 @@ class ProofChecker: # parallel running of proof checks
             except ToolError as e:
                 print("Proof check failed: {}".format(e))
             if not self.stack and self.task_index == len(self.tasks):
-                print("DONE [{}:{}] {}".format(
-                    self.checked_num, sum(tool.deep_len_proof for (tool, _) in self.tasks),
-                    time.time() - self.time,
-                ))
+                self.print_done()
+
+    ### process pool backend
+
+    def process_pool(self):
+        while True:
+            while not self.q.empty():
+                self.read_queue(False)
+            while len(self.running) < self.max_running:
+                if self.stack: tool, num_args = self.stack.pop()
+                elif self.task_index < len(self.tasks):
+                    tool, num_args = self.tasks[self.task_index]
+                    self.task_index += 1
+                else: break
+                self.submit_task(tool, num_args)
+            if not self.running:
+                self.task_index = 0
+                self.tasks = []
+                self.notify_done()
+            self.update_progress()
+            self.read_queue(True)
+
+    def submit_task(self, tool, num_args):
+        cache_key = proof_cache.key(tool, num_args[:len(tool.arg_types)])
+        if proof_cache.lookup(cache_key): # the worker would skip it too
+            self.checked_num += 1
+            return
+        self.register_tool(tool)
+        task_id = self.next_id
+        self.next_id += 1
+        self.running[task_id] = tool, num_args
+        generation = self.generation
+        # called from the result thread of the pool
+        def callback(result):
+            self.q.put((None, ("done", generation, task_id, result)))
+        def error_callback(e):
+            callback(("Python exception occured in a worker: {}".format(e), []))
+        self.pool.apply_async(
+            _worker_check, ((tool.name, tool.arg_types), num_args),
+            callback = callback, error_callback = error_callback,
+        )
+
+    def finish_task(self, generation, task_id, result):
+        if generation != self.generation: return
+        tool, num_args = self.running.pop(task_id)
+        self.checked_num += 1
+        if result is None: # not in the library of the workers
+            try:
+                tool.proof_check(num_args) # nested checks are added to the stack
+            except ToolError as e:
+                print("Proof check failed: {}".format(e))
+        else:
+            error, nested = result
+            if error is not None:
+                print("Proof check failed: {}".format(error))
+            else: # the workers have their own caches
+                proof_cache.add(proof_cache.key(tool, num_args[:len(tool.arg_types)]))
+            self.stack.extend(
+                (self.known_tools[key], nested_args)
+                for key, nested_args in nested
+            )
+        if not self.stack and self.task_index == len(self.tasks) and not self.running:
+            self.print_done()
+
+    # remembers the tool and all the composite tools it uses,
+    # so that the nested checks returned by the workers can be translated back
+    def register_tool(self, tool):
+        key = tool.name, tool.arg_types
+        if self.known_tools.get(key) is tool: return
+        self.known_tools[key] = tool
+        for steps in (tool.assumptions, tool.implications, tool.proof or ()):
+            for step in steps:
+                if isinstance(step.tool, CompositeTool):
+                    self.register_tool(step.tool)
+
+# the library of tools in a worker process
+_worker_tools = None
+
+def _worker_init(library):
+    global _worker_tools
+    from basic_tools import load_tools
+    _worker_tools = load_tools(library)
+    proof_checker.nested = []
+
+def _worker_check(key, num_args):
+    tool = _worker_tools.tool_dict.get(key)
+    if not isinstance(tool, CompositeTool) or tool.proof is None: return None
+    proof_checker.nested = []
+    try:
+        tool.proof_check(num_args)
+        error = None
+    except ToolError as e:
+        error = "{}".format(e)
+    nested = [
+        ((nested_tool.name, nested_tool.arg_types), nested_args)
+        for nested_tool, nested_args in proof_checker.nested
+    ]
+    proof_checker.nested = []
+    return error, nested
 
 proof_checker = ProofChecker()
 
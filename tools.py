@@ -1,3 +1,4 @@
+import hashlib
 from fractions import Fraction
 from sparse_row import SparseRow
 from stop_watch import StopWatch
@@ -52,6 +53,22 @@ class Tool:
         # strictness: 0 = postulate, 1 = check
         raise Exception("Not implemented")
 
+    # only numerical evaluation without a logical core (used for preview during dragging)
+    # num_args are numerical objects, returns the tuple of numerical outputs
+    def run_num(self, hyper_params, num_args):
+        raise Exception("Not implemented")
+
+    # hash of the definition of the tool, used by the persistent cache of proof checks
+    def content_hash(self):
+        def type_names(types):
+            if types is None: return None
+            return tuple(t.__name__ for t in types)
+        data = (
+            type(self).__name__, self.name, type_names(self.hyper_types),
+            type_names(self.arg_types), type_names(self.out_types),
+        )
+        return hashlib.sha1(repr(data).encode()).hexdigest()
+
 class EqualObjects(Tool):
     def __init__(self, willingness = 0, name = "=="):
         self.willingness = willingness
@@ -71,11 +88,17 @@ class EqualObjects(Tool):
                 #print('not provably equal', a, b)
                 raise ToolErrorLog()
 
+    def run_num(self, hyper_params, num_args):
+        a,b = num_args
+        if not a.identical_to(b): raise ToolErrorNum()
+        return ()
+
 class MemoizedTool(Tool):
     def __init__(self, arg_types, out_types, name):
         Tool.__init__(self, (), arg_types, out_types, name)
         self.symmetries = []
-    def add_symmetry(self, perm): # for storing symmetrical inputs to the lookup table
+    # the lookup table (UnionFindDict) stores only one of the symmetrical inputs
+    def add_symmetry(self, perm):
         perm = tuple(perm)
         assert(set(perm) == set(range(len(perm)))) # check permutation
         assert(len(perm) == len(self.arg_types)) # check size
@@ -87,9 +110,6 @@ class MemoizedTool(Tool):
         
     def memoize(self, args, logic, vals):
         logic.add_constr(self, args, vals)
-        for perm in self.symmetries:
-            perm_args = tuple(args[i] for i in perm)
-            logic.add_constr(self, perm_args, vals)
 
     def run(self, hyper_params, obj_args, logic, strictness):
 
@@ -116,6 +136,10 @@ class PrimitivePred(MemoizedTool):
         elif strictness > self.willingness: raise ToolErrorLog()
         else: return ()
 
+    def run_num(self, hyper_params, num_args):
+        if not self.num_check(*num_args): raise ToolErrorNum()
+        return ()
+
 class PrimitiveConstr(MemoizedTool):
     def __init__(self, num_eval, arg_types, out_types, name):
         MemoizedTool.__init__(self, arg_types, out_types, name)
@@ -125,12 +149,18 @@ class PrimitiveConstr(MemoizedTool):
         if strictness > 0:
             raise ToolError("Primitive construction cannot be run in check-mode")
         num_args = (logic.num_model[arg] for arg in args)
-        num_outs = self.num_eval(*num_args)
-        if len(self.out_types) == 1 and not isinstance(num_outs, (list, tuple)):
-            num_outs = num_outs,
+        num_outs = self.run_num((), num_args)
         assert(len(num_outs) == len(self.out_types))
         return logic.add_objs(num_outs)
 
+    def run_num(self, hyper_params, num_args):
+        # the primitive constructions fail on degenerate inputs by assertions
+        try: num_outs = self.num_eval(*num_args)
+        except (AssertionError, ArithmeticError) as e: raise ToolErrorException(e)
+        if len(self.out_types) == 1 and not isinstance(num_outs, (list, tuple)):
+            num_outs = num_outs,
+        return tuple(num_outs)
+
 # class for construction tools angle_compute and ratio_compute
 class DimCompute(Tool):
     def __init__(self, obj_type, num_comp, postulate, name):
@@ -155,6 +185,13 @@ class DimCompute(Tool):
 
         return (new_obj,)
 
+    def run_num(self, hyper_params, num_args):
+        coefs = hyper_params[1:]
+        frac_const = hyper_params[0]
+        obj_sum = sum(num_arg.data*float(coef)
+                      for coef, num_arg in zip(coefs, num_args))
+        return (self.obj_type(self.num_comp(obj_sum, frac_const)),)
+
 # class for predicate tools angle_pred and ratio_pred
 class DimPred(Tool):
     def __init__(self, obj_type, num_check, postulate, check, name,
@@ -182,3 +219,12 @@ class DimPred(Tool):
         elif self.check(logic, equation, frac_const):
             return ()
         else: raise ToolErrorLog()
+
+    def run_num(self, hyper_params, num_args):
+        coefs = hyper_params[1:]
+        frac_const = hyper_params[0]
+        obj_sum = sum(num_arg.data*float(coef)
+                      for coef, num_arg in zip(coefs, num_args))
+        if not self.num_check(obj_sum, frac_const):
+            raise ToolErrorNum()
+        return ()
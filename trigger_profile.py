@@ -0,0 +1,162 @@
+import json, sys
+from functools import wraps
+from time import perf_counter
+from triggers import RelStrEnv, TriggerEnv
+from work_queue import WorkQueue
+from logical_core import LogicalCore
+
+"""
+Profiling of the triggers, it shows which rules are doing the work.
+  profile = TriggerProfile()
+  profile.enable()
+  ... (logical cores using TriggerEnv or RuleTriggerEnv)
+  profile.disable()
+  profile.print_stats()   or   profile.dump("stats.json")
+While enabled, the handlers of TriggerEnv and the rules of RuleTriggerEnv
+(both called by RelStrEnv._call_handler), and the search scripts
+of TriggerEnv are wrapped, recording
+  calls: number of invocations
+  candidates: relations (or incidence bits) walked by the searches for matches
+              (RelStrEnv.stats_candidates, counted only while
+              RelStrEnv.count_candidates is set by enable())
+  glues: glues scheduled by it which really merged two different objects
+  time: cumulative time in seconds
+under the name of the handler, search script or rule. The candidates and time
+include the nested calls (search scripts called from a TriggerEnv handler).
+A glue is credited to the call that pushed the action to the work queue,
+also if the action was a construction that turned out to be equal
+to an existing object.
+The original methods are restored by disable(), so the triggers have
+no overhead when the profiling is off. Only one profile can be enabled at a time.
+"""
+
+class TriggerProfile:
+    # search scripts of TriggerEnv with recorded statistics
+    trigger_env_methods = (
+        "ppll_search_ppl", "ppll_search_pll",
+        "intersection_uq_c_search_ppl", "intersection_uq_c_search_ppc",
+        "intersection_uq_c_search_pcl", "intersection_uq_c_search_pcc",
+        "circumcircle_uq_search",
+        "line_uq_pd_search_lld", "line_uq_pd_search_pld",
+    )
+
+    def __init__(self):
+        self.stats = dict() # name -> [calls, candidates, glues, time]
+        self.stack = [] # stats of the running calls
+        self.pushed_by = dict() # (action, args) pending in a work queue -> stats of the pushing call
+        self.source = None # stats of the call that pushed the running action
+        self.originals = None
+
+    def clear(self):
+        self.stats = dict()
+
+    def enable(self):
+        assert(self.originals is None)
+        self.originals = []
+        for name in self.trigger_env_methods:
+            self._patch(TriggerEnv, name, self._wrap(name, getattr(TriggerEnv, name)))
+        self._patch(RelStrEnv, "_call_handler", self._call_handler())
+        self._patch(RelStrEnv, "count_candidates", True)
+        self._patch(WorkQueue, "push", self._push(WorkQueue.push))
+        self._patch(WorkQueue, "pop", self._pop(WorkQueue.pop))
+        self._patch(LogicalCore, "glue", self._glue(LogicalCore.glue))
+
+    def disable(self):
+        for obj, name, value in reversed(self.originals): setattr(obj, name, value)
+        self.originals = None
+        self.stack = []
+        self.pushed_by = dict()
+        self.source = None
+
+    def _patch(self, obj, name, value):
+        self.originals.append((obj, name, getattr(obj, name)))
+        setattr(obj, name, value)
+
+    def _entry(self, name):
+        entry = self.stats.get(name)
+        if entry is None:
+            entry = [0, 0, 0, 0.]
+            self.stats[name] = entry
+        return entry
+
+    # calls f(*args) recording the statistics to the entry
+    def _run(self, entry, env, f, *args):
+        self.stack.append(entry)
+        candidates = env.stats_candidates
+        start = perf_counter()
+        try: return f(*args)
+        finally:
+            entry[0] += 1
+            entry[1] += env.stats_candidates - candidates
+            entry[3] += perf_counter() - start
+            self.stack.pop()
+
+    def _wrap(self, name, method):
+        entry = self._entry(name)
+        @wraps(method)
+        def wrapped(env, *args):
+            return self._run(entry, env, method, env, *args)
+        return wrapped
+
+    def _call_handler(self):
+        def call_handler(env, name, f, *args):
+            return self._run(self._entry(name), env, f, *args)
+        return call_handler
+
+    # remembers which call pushed an action, the first push of a pending action is executed
+    def _push(self, push):
+        stack = self.stack
+        pushed_by = self.pushed_by
+        def counted_push(queue, action, args):
+            if stack: pushed_by.setdefault((action, args), stack[-1])
+            return push(queue, action, args)
+        return counted_push
+
+    # the popped action is run with self.source set to the call that pushed it
+    def _pop(self, pop):
+        def counted_pop(queue):
+            res = pop(queue)
+            if res is None: return res
+            action, args = res
+            source = self.pushed_by.pop(res, None)
+            if source is None: return res
+            def run_action(args):
+                self.source = source
+                try: return action(args)
+                finally: self.source = None
+            return run_action, args
+        return counted_pop
+
+    def _glue(self, glue):
+        def counted_glue(logic, obj1, obj2):
+            if self.source is not None and not logic.check_equal(obj1, obj2):
+                self.source[2] += 1
+            return glue(logic, obj1, obj2)
+        return counted_glue
+
+    # list of (name, statistics) sorted by time
+    def items(self):
+        return sorted(
+            (
+                (name, {"calls" : calls, "candidates" : candidates,
+                        "glues" : glues, "time" : t})
+                for name, (calls, candidates, glues, t) in self.stats.items()
+                if calls or candidates
+            ),
+            key = lambda item: -item[1]["time"],
+        )
+
+    def print_stats(self, limit = None):
+        items = self.items()
+        if limit is not None: items = items[:limit]
+        if not items: return
+        print("Trigger statistics")
+        for name, s in items:
+            print("  {:40} calls {:7}   candidates {:7}   glues {:5}   time {:.4f} s".format(
+                name, s["calls"], s["candidates"], s["glues"], s["time"],
+            ))
+        sys.stdout.flush()
+
+    def dump(self, fname):
+        with open(fname, "w") as f:
+            json.dump(dict(self.items()), f, indent = 2)
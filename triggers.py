@@ -1,34 +1,59 @@
-from relstr import RelStr
+import os
+from functools import partial
+from itertools import product, permutations
+from relstr import RelStr, popcount
 from stop_watch import StopWatch
+from tools import EqualObjects, MemoizedTool, PrimitivePred, ToolError
+from work_queue import WorkQueue, GLUE_PRIORITY, CONSTRUCT_PRIORITY
 from geo_object import *
 
 # general class for triggers, can be also used as "dummy triggers" not doing anything
 class RelStrEnv:
+    # whether the searches count the walked relations to stats_candidates,
+    # set only while a TriggerProfile is enabled
+    count_candidates = False
+
     def __init__(self, logic):
         self.logic = logic
         self.num_model = logic.num_model
-        self.relstr = RelStr()
-        self.to_run = []
+        self.num_equal = logic.num_index.equal
+        self.trail = logic.trail
+        self.relstr = RelStr(self.trail)
+        self.incidence = self.relstr.incidence
+        self.to_run = WorkQueue(logic.ufd.obj_to_root)
         self.discarded = set()
         self.running = False
+        self.stats_candidates = 0 # relations walked by the searches for matches
 
     # when a new relation is added to the RelStr (lookup table)
     # t = label, data = input + output
     def add(self, t, data):
         pass
 
+    # every handler / rule applied to a new relation is called here,
+    # so that it can be wrapped by the profiling (see trigger_profile.py)
+    def _call_handler(self, name, f, *args):
+        return f(*args)
+
     # run all actions accumulated so far
     def run(self):
         if self.running: return
         self.running = True
-        while self.to_run:
-            action, x_to_y = self.to_run.pop()
+        to_run = self.to_run
+        while to_run:
+            action, x_to_y = to_run.pop()
             if any(y in self.discarded for y in x_to_y): continue
+            to_run.stats_executed += 1
             action(x_to_y)
         self.running = False
 
+    # forget pending actions, used after a rollback of the logical core
+    def clear_queue(self):
+        self.to_run.clear()
+        self.running = False
+
     def discard_node(self, n, store_disc_edges = None):
-        self.discarded.add(n)
+        self.trail.set_add(self.discarded, n)
         self.relstr.discard_node(n, store_disc_edges)
 
     def glue_nodes(self, glue_dict):
@@ -38,7 +63,9 @@ class RelStrEnv:
             self.add(t, tuple(glue_dict.get(x, x) for x in data))
 
 """
-Triggers automatically call the following "axioms" whenever possible:
+Triggers automatically call the following "axioms" whenever possible
+(TriggerEnv is the original handcoded search, the same rules are in triggers.gl,
+applied by RuleTriggerEnv):
 
 intersection_uq_ll a:L b:L X:P Y:P ->
   <- not_eq a b
@@ -131,11 +158,15 @@ class TriggerEnv(RelStrEnv):
             self.radius_of    : self.radius_of_added,
             self.center_of    : self.center_of_added,
         }
+        self.to_run.register(self.glue_trig, GLUE_PRIORITY, symmetric = True)
+        self.to_run.register(self.add_circ_trig, CONSTRUCT_PRIORITY)
+        self.incidence.labels.update((self.lies_on_l, self.lies_on_c))
 
     def add(self, t, data):
-        if t not in self.label_to_action: return
+        action = self.label_to_action.get(t)
+        if action is None: return
         if self.relstr.add_rel(t, data):
-            self.label_to_action[t](*data)
+            self._call_handler(action.__name__, action, *data)
 
     def glue_trig(self, pair):
         a,b = pair
@@ -151,10 +182,8 @@ class TriggerEnv(RelStrEnv):
             c2, = c2_tup
             if c2 != c: self.glue_trig(self.glue_trig, (c, c2))
 
-    def num_equal(self, a, b):
-        return self.num_model[a].identical_to(self.num_model[b])
-
     def lies_on_l_added(self, p, l):
+        count = self.count_candidates
 
         # line_uq_pp
         # intersection_uq_ll
@@ -162,21 +191,34 @@ class TriggerEnv(RelStrEnv):
         passing_l = self.relstr.tobj_to_nb[self.lies_on_l,p,0]
         passing_c = self.relstr.tobj_to_nb[self.lies_on_c,p,0]
 
+        # the candidates are filtered by the incidence bitsets,
+        # the searches are called only if they have a witness
+        incidence = self.incidence
+        lines_p = incidence.row(self.lies_on_l,p,0) & ~incidence.bit(l)
+        points_l = incidence.row(self.lies_on_l,l,1) & ~incidence.bit(p)
         if len(points) < len(passing_l):
+            if count: self.stats_candidates += len(points)
             for p2,_ in points:
-                if p2 != p: self.ppll_search_ppl(p, p2, l)
+                if p2 != p and lines_p & incidence.row(self.lies_on_l,p2,0):
+                    self.ppll_search_ppl(p, p2, l)
         else:
+            if count: self.stats_candidates += len(passing_l)
             for _,l2 in passing_l:
-                if l2 != l: self.ppll_search_pll(p, l, l2)
+                if l2 != l and points_l & incidence.row(self.lies_on_l,l2,1):
+                    self.ppll_search_pll(p, l, l2)
 
         # intersection_uq_lc
         if len(points) <= len(passing_c):
+            circles_p = incidence.row(self.lies_on_c,p,0)
+            if count: self.stats_candidates += len(points)
             for p2,_ in points:
-                if p2 != p:
+                if p2 != p and circles_p & incidence.row(self.lies_on_c,p2,0):
                     self.intersection_uq_c_search_ppl(p, p2, l)
         else:
+            if count: self.stats_candidates += len(passing_c)
             for _,c in passing_c:
-                self.intersection_uq_c_search_pcl(p, c, l)
+                if points_l & incidence.row(self.lies_on_c,c,1):
+                    self.intersection_uq_c_search_pcl(p, c, l)
 
         # line_uq_pd
         d_tup = self.logic.get_constr(self.direction_of, (l,))
@@ -185,6 +227,8 @@ class TriggerEnv(RelStrEnv):
             self.line_uq_pd_search_pld(p,l,d)
 
     def lies_on_c_added(self, p, c):
+        count = self.count_candidates
+        incidence = self.incidence
 
         points = self.relstr.tobj_to_nb[self.lies_on_c,c,1]
         passing_l = self.relstr.tobj_to_nb[self.lies_on_l,p,0]
@@ -193,33 +237,44 @@ class TriggerEnv(RelStrEnv):
         # intersection_uq_cc, not tangent
         # intersection_uq_lc, not tangent
         if len(points) <= len(passing_c) + len(passing_l):
+            if count: self.stats_candidates += len(points)
             for p2,_ in points:
                 if p2 != p:
                     self.intersection_uq_c_search_ppc(p, p2, c) # DONE
         else:
+            points_c = incidence.row(self.lies_on_c,c,1) & ~incidence.bit(p)
+            if count: self.stats_candidates += len(passing_l)
             for _,l in passing_l:
-                self.intersection_uq_c_search_pcl(p, c, l) # DONE
+                if points_c & incidence.row(self.lies_on_l,l,1):
+                    self.intersection_uq_c_search_pcl(p, c, l) # DONE
+            if count: self.stats_candidates += len(passing_c)
             for _,c2 in passing_c:
-                if c2 != c:
+                if c2 != c and points_c & incidence.row(self.lies_on_c,c2,1):
                     self.intersection_uq_c_search_pcc(p, c, c2) # DONE
 
-        # circumcircle_uq
+        # circumcircle_uq, needs three common points
         if len(points) >= 3:
+            points_c = incidence.row(self.lies_on_c,c,1)
+            if count: self.stats_candidates += len(passing_c)
             for _,c2 in passing_c:
-                if c != c2 and self.num_equal(c, c2):
+                if c != c2 and popcount(points_c & incidence.row(self.lies_on_c,c2,1)) >= 3 \
+                   and self.num_equal(c, c2):
                     self.circumcircle_uq_search(c,c2)
 
     def direction_of_added(self, l, d):  # search for line_uq_pd
+        count = self.count_candidates
 
         parallel = self.relstr.tobj_to_nb[self.direction_of,d,1]
         points = self.relstr.tobj_to_nb[self.lies_on_l,l,1]
 
         if (len(parallel) <= len(points)):
+            if count: self.stats_candidates += len(parallel)
             for l2,_ in parallel:
                 if l != l2 and self.num_equal(l, l2):
                     self.line_uq_pd_search_lld(l, l2, d)
 
         else:
+            if count: self.stats_candidates += len(points)
             for p,_ in points:
                 self.line_uq_pd_search_pld(p, l, d)
 
@@ -228,180 +283,721 @@ class TriggerEnv(RelStrEnv):
         O_tup = self.logic.get_constr(self.center_of, (c,))
         if O_tup is None: return
         O, = O_tup
-        self.to_run.append((self.add_circ_trig, (O, r, c)))
+        self.to_run.push(self.add_circ_trig, (O, r, c))
 
     def center_of_added(self, c, O):
         # circle_cr_uq
         r_tup = self.logic.get_constr(self.radius_of, (c,))
         if r_tup is None: return
         r, = r_tup
-        self.to_run.append((self.add_circ_trig, (O, r, c)))
+        self.to_run.push(self.add_circ_trig, (O, r, c))
 
     # -------------------------------------
-    # search scripts
+    # search scripts, the witnesses are the common neighbours
+    # in the incidence bitsets
 
     def ppll_search_ppl(self, p, p2, l):
-        passing = self.relstr.tobj_to_nb[self.lies_on_l,p,0]
-        passing2 = self.relstr.tobj_to_nb[self.lies_on_l,p2,0]
-        if len(passing2) < len(passing):
-            passing, passing2 = passing2, passing
-            p,p2 = p2,p
-        for _,l2 in passing:
-            if l != l2 and (p2,l2) in passing2:
-                if not self.num_equal(p, p2):
-                    assert(self.num_equal(l, l2))
-                    self.to_run.append((self.glue_trig, (l, l2)))
-                    # if there was other line l3 passing through p, p2
-                    # we would already know l2 == l3
-                    break
-                if not self.num_equal(l, l2):
-                    assert(self.num_equal(p, p2))
-                    self.to_run.append((self.glue_trig, (p, p2)))
-                    break # l2 is just a witness
+        count = self.count_candidates
+        incidence = self.incidence
+        common = incidence.row(self.lies_on_l,p,0) & incidence.row(self.lies_on_l,p2,0) \
+            & ~incidence.bit(l)
+        if count: self.stats_candidates += popcount(common)
+        for l2 in incidence.objs(common):
+            if not self.num_equal(p, p2):
+                assert(self.num_equal(l, l2))
+                self.to_run.push(self.glue_trig, (l, l2))
+                # if there was other line l3 passing through p, p2
+                # we would already know l2 == l3
+                break
+            if not self.num_equal(l, l2):
+                assert(self.num_equal(p, p2))
+                self.to_run.push(self.glue_trig, (p, p2))
+                break # l2 is just a witness
 
     def ppll_search_pll(self, p, l, l2):
-        points = self.relstr.tobj_to_nb[self.lies_on_l,l,1]
-        points2 = self.relstr.tobj_to_nb[self.lies_on_l,l2,1]
-        if len(points2) < len(points):
-            points, points2 = points2, points
-            l,l2 = l2,l
-        for p2,_ in points:
-            if p2 != p and (p2,l2) in points2:
-                if not self.num_equal(p, p2):
-                    assert(self.num_equal(l, l2))
-                    self.to_run.append((self.glue_trig, (l, l2)))
-                    break # p2 is lust a witness
-                if not self.num_equal(l, l2):
-                    assert(self.num_equal(p, p2))
-                    self.to_run.append((self.glue_trig, (p, p2)))
-                    # if there was other point p3 in the intersection of l and l2,
-                    # we would already know p2 == p3
-                    break
+        count = self.count_candidates
+        incidence = self.incidence
+        common = incidence.row(self.lies_on_l,l,1) & incidence.row(self.lies_on_l,l2,1) \
+            & ~incidence.bit(p)
+        if count: self.stats_candidates += popcount(common)
+        for p2 in incidence.objs(common):
+            if not self.num_equal(p, p2):
+                assert(self.num_equal(l, l2))
+                self.to_run.push(self.glue_trig, (l, l2))
+                break # p2 is lust a witness
+            if not self.num_equal(l, l2):
+                assert(self.num_equal(p, p2))
+                self.to_run.push(self.glue_trig, (p, p2))
+                # if there was other point p3 in the intersection of l and l2,
+                # we would already know p2 == p3
+                break
 
     def intersection_uq_c_search_ppl(self, p, p2, l):
+        count = self.count_candidates
         if not self.num_equal(p2, p): return
-        passing = self.relstr.tobj_to_nb[self.lies_on_c,p,0]
-        passing2 = self.relstr.tobj_to_nb[self.lies_on_c,p2,0]
-        if len(passing2) < len(passing):
-            passing,passing2 = passing2,passing
-            p,p2 = p2,p
-        for _,c in passing:
-            if (p2,c) in passing2 and intersecting_lc(self.num_model[l], self.num_model[c]):
-                self.to_run.append((self.glue_trig, (p, p2)))
+        incidence = self.incidence
+        common = incidence.row(self.lies_on_c,p,0) & incidence.row(self.lies_on_c,p2,0)
+        if count: self.stats_candidates += popcount(common)
+        for c in incidence.objs(common):
+            if intersecting_lc(self.num_model[l], self.num_model[c]):
+                self.to_run.push(self.glue_trig, (p, p2))
                 break # c is just a witness
 
     def intersection_uq_c_search_ppc(self, p, p2, c):
+        count = self.count_candidates
         
         if not self.num_equal(p2, p): return
+        incidence = self.incidence
 
         # lines
-        passing = self.relstr.tobj_to_nb[self.lies_on_l,p,0]
-        passing2 = self.relstr.tobj_to_nb[self.lies_on_l,p2,0]
-        if len(passing2) < len(passing):
-            passing,passing2 = passing2,passing
-            p,p2 = p2,p
-        for _,l in passing:
-            if (p2,l) in passing2 and intersecting_lc(self.num_model[l], self.num_model[c]):
-                self.to_run.append((self.glue_trig, (p, p2)))
+        common = incidence.row(self.lies_on_l,p,0) & incidence.row(self.lies_on_l,p2,0)
+        if count: self.stats_candidates += popcount(common)
+        for l in incidence.objs(common):
+            if intersecting_lc(self.num_model[l], self.num_model[c]):
+                self.to_run.push(self.glue_trig, (p, p2))
                 return # l is just a witness
 
         # circles
-        passing = self.relstr.tobj_to_nb[self.lies_on_c,p,0]
-        passing2 = self.relstr.tobj_to_nb[self.lies_on_c,p2,0]
-        if len(passing2) < len(passing):
-            passing,passing2 = passing2,passing
-            p,p2 = p2,p
-        for _,c2 in passing:
-            if (p2,c2) in passing2 and intersecting_cc(self.num_model[c], self.num_model[c2]):
+        common = incidence.row(self.lies_on_c,p,0) & incidence.row(self.lies_on_c,p2,0)
+        if count: self.stats_candidates += popcount(common)
+        for c2 in incidence.objs(common):
+            if intersecting_cc(self.num_model[c], self.num_model[c2]):
                 assert(self.num_equal(p, p2))
-                self.to_run.append((self.glue_trig, (p, p2)))
+                self.to_run.push(self.glue_trig, (p, p2))
                 return # c2 is just a witness
 
     def intersection_uq_c_search_pcl(self, p, c, l):
+        count = self.count_candidates
 
         if not intersecting_lc(self.num_model[l], self.num_model[c]): return
-        points_l = self.relstr.tobj_to_nb[self.lies_on_l,l,1]
-        points_c = self.relstr.tobj_to_nb[self.lies_on_c,c,1]
-        if len(points_l) < len(points_c):
-            points = points_l
-            points2 = points_c
-            lc2 = c
-        else:
-            points = points_c
-            points2 = points_l
-            lc2 = l
-        for p2,_ in points:
-            if p2 != p and (p2,lc2) in points2 and self.num_equal(p, p2):
-                self.to_run.append((self.glue_trig, (p, p2)))
+        incidence = self.incidence
+        common = incidence.row(self.lies_on_l,l,1) & incidence.row(self.lies_on_c,c,1) \
+            & ~incidence.bit(p)
+        if count: self.stats_candidates += popcount(common)
+        for p2 in incidence.objs(common):
+            if self.num_equal(p, p2):
+                self.to_run.push(self.glue_trig, (p, p2))
                 # if there was other point p3 in the intersection of l and c,
                 # we would already know p2 == p3
                 break
 
     def intersection_uq_c_search_pcc(self, p, c, c2):
+        count = self.count_candidates
 
         if not intersecting_cc(self.num_model[c], self.num_model[c2]): return
-        points = self.relstr.tobj_to_nb[self.lies_on_c,c,1]
-        points2 = self.relstr.tobj_to_nb[self.lies_on_c,c2,1]
-        if len(points2) < len(points):
-            points, points2 = points2, points
-            c,c2 = c2,c
-        for p2,_ in points:
-            if p2 != p and (p2,c2) in points2 and (self.num_equal(p, p2)):
-                self.to_run.append((self.glue_trig, (p, p2)))
+        incidence = self.incidence
+        common = incidence.row(self.lies_on_c,c,1) & incidence.row(self.lies_on_c,c2,1) \
+            & ~incidence.bit(p)
+        if count: self.stats_candidates += popcount(common)
+        for p2 in incidence.objs(common):
+            if self.num_equal(p, p2):
+                self.to_run.push(self.glue_trig, (p, p2))
                 # if there was other point p3 in the intersection of c and c2,
                 # we would already know p2 == p3
                 break
 
     def circumcircle_uq_search(self, c,c2):
+        count = self.count_candidates
 
-        points = self.relstr.tobj_to_nb[self.lies_on_c,c,1]
-        points2 = self.relstr.tobj_to_nb[self.lies_on_c,c2,1]
-        if len(points2) < len(points):
-            c,c2 = c2,c
-            points,points2 = points2,points
+        incidence = self.incidence
+        common = incidence.row(self.lies_on_c,c,1) & incidence.row(self.lies_on_c,c2,1)
+        if popcount(common) < 3: return
         witnesses = []
-        for p,_ in points:
-            if (p,c2) in points2 and not any(
+        if count: self.stats_candidates += popcount(common)
+        for p in incidence.objs(common):
+            if not any(
                 self.num_equal(w, p)
                 for w in witnesses
             ):
                 witnesses.append(p)
                 if len(witnesses) >= 3:
                     assert(self.num_equal(c, c2))
-                    self.to_run.append((self.glue_trig, (c, c2)))
+                    self.to_run.push(self.glue_trig, (c, c2))
                     break
 
     def line_uq_pd_search_lld(self, l, l2, d):
+        count = self.count_candidates
 
-        points = self.relstr.tobj_to_nb[self.lies_on_l,l,1]
-        points2 = self.relstr.tobj_to_nb[self.lies_on_l,l2,1]
-        if len(points2) < len(points):
-            l,l2 = l2,l
-            points,points2 = points2,points
-        for p,_ in points:
-            if (p,l2) in points2:
-                assert(self.num_equal(l, l2))
-                self.to_run.append((self.glue_trig, (l, l2)))
-                break # p is just a witness
+        incidence = self.incidence
+        common = incidence.row(self.lies_on_l,l,1) & incidence.row(self.lies_on_l,l2,1)
+        if count: self.stats_candidates += popcount(common)
+        if common: # any common point is a witness
+            assert(self.num_equal(l, l2))
+            self.to_run.push(self.glue_trig, (l, l2))
 
     def line_uq_pd_search_pld(self, p, l, d):
+        count = self.count_candidates
 
         parallel = self.relstr.tobj_to_nb[self.direction_of,d,1]
         passing = self.relstr.tobj_to_nb[self.lies_on_l,p,0]
         if len(parallel) < len(passing):
+            if count: self.stats_candidates += len(parallel)
             for l2,_ in parallel:
                 if l2 != l and (p,l2) in passing:
                     assert(self.num_equal(l, l2))
-                    self.to_run.append((self.glue_trig, (l, l2)))
+                    self.to_run.push(self.glue_trig, (l, l2))
                     # if other parallel passing line l3 was equal to l,
                     # we would already know l2 == l3
                     break
 
         else:
+            if count: self.stats_candidates += len(passing)
             for _,l2 in passing:
                 if l2 != l and (l2,d) in parallel:
                     assert(self.num_equal(l, l2))
-                    self.to_run.append((self.glue_trig, (l, l2)))
+                    self.to_run.push(self.glue_trig, (l, l2))
                     # if other parallel passing line l3 was equal to l,
                     # we would already know l2 == l3
                     break
+
+"""
+RuleTriggerEnv applies the rules given in a file (triggers.gl) in the syntax
+of GeoLogic tools, instead of the handcoded search of TriggerEnv.
+Every rule is compiled (TriggerRule) into a list of atoms = relations
+(label, variables) that are stored in the RelStr, numerical filters on
+the variables, and conclusions. Whenever a new relation is added,
+it is matched to every atom of the same label (up to the symmetries of the rule),
+and the remaining atoms are joined one by one, always taking the atom
+with the smallest set of candidates in RelStr.tobj_to_nb given the variables
+bound so far. Cheap checks (different objects, numerically equal objects
+for an equality conclusion) are done as soon as the variables are bound,
+other numerical filters only on complete matches, and every conclusion
+is derived only once (the first witness suffices).
+Rules with the same atoms (intersection_uq_ll and line_uq_pp) are merged
+into one rule with more cases, so that the join is done only once.
+The join steps for all the possible orders of the atoms are precompiled
+(JoinStep), and turned into python code (see TriggerRule.source).
+"""
+
+# numerical predicates symmetric in their arguments (for finding symmetries of rules)
+_symmetric_preds = ("not_eq", "intersecting")
+
+# exact facts (constructions, lies_on) are relations stored in the RelStr,
+# coexact predicates (not_eq, intersecting, ...) are only checked numerically
+def _is_relation(tool):
+    return isinstance(tool, MemoizedTool) and (
+        tool.out_types or getattr(tool, "willingness", 0) == 0
+    )
+
+class TriggerRule:
+    def __init__(self, tool):
+        self.name = tool.name
+
+        # local variables, identified by the equalities in assumptions
+        var_types = list(tool.arg_types)
+        for step in tool.assumptions + tool.implications:
+            var_types.extend(step.tool.out_types)
+        parent = list(range(len(var_types)))
+        def find(v):
+            while parent[v] != v: v = parent[v]
+            return v
+
+        atoms = []
+        filters = []
+        for step in tool.assumptions:
+            if isinstance(step.tool, EqualObjects):
+                a,b = map(find, step.local_args)
+                parent[b] = a
+            elif _is_relation(step.tool):
+                atoms.append((step.tool, step.local_args + step.local_outputs))
+            elif not step.tool.out_types:
+                filters.append((step.tool, step.hyper_params, step.local_args))
+            else: raise Exception("Trigger rule {}: unsupported assumption {}".format(
+                    self.name, step.debug_msg))
+
+        constructions = dict() # output variable -> step
+        conclusions = []
+        for step in tool.implications:
+            if isinstance(step.tool, EqualObjects):
+                a,b = step.local_args
+                if b in constructions: a,b = b,a
+                if a in constructions:
+                    constr = constructions.pop(a)
+                    conclusions.append((constr.tool, constr.local_args + (b,)))
+                else: conclusions.append((None, (a,b)))
+            elif isinstance(step.tool, MemoizedTool) and len(step.tool.out_types) == 1:
+                constructions[step.local_outputs[0]] = step
+            else: raise Exception("Trigger rule {}: unsupported implication {}".format(
+                    self.name, step.debug_msg))
+        if constructions: raise Exception("Trigger rule {}: unused construction".format(self.name))
+
+        # renumber the variables to 0,1,...
+        var_to_slot = dict()
+        self.slot_types = []
+        for v,t in enumerate(var_types):
+            root = find(v)
+            if root not in var_to_slot:
+                var_to_slot[root] = len(self.slot_types)
+                self.slot_types.append(t)
+            var_to_slot[v] = var_to_slot[root]
+        def slots(variables): return tuple(var_to_slot[v] for v in variables)
+        self.var_num = len(self.slot_types)
+        self.atoms = [(label, slots(variables)) for label, variables in atoms]
+        atom_vars = set(v for _, variables in self.atoms for v in variables)
+        # case = (filters, conclusions), several rules with the same atoms
+        # can be merged into one rule with several cases, see merge()
+        #   filters: (tool, hyper_params, variables)
+        #   conclusions: (construction tool or None for equality, variables)
+        filters = [(tool, hyper_params, slots(variables)) for tool, hyper_params, variables in filters]
+        conclusions = [(tool, slots(variables)) for tool, variables in conclusions]
+        self.cases = [(filters, conclusions)]
+        used_vars = [variables for _,_,variables in filters] + [variables for _,variables in conclusions]
+        for variables in used_vars:
+            if not atom_vars.issuperset(variables):
+                raise Exception("Trigger rule {}: variable not bound by a relation".format(self.name))
+        self._compile()
+
+    def _compile(self):
+        def pairs(variables_list): return set(tuple(sorted(variables)) for variables in variables_list)
+        # equalities must hold numerically, the ones common to all the cases
+        # are selective, and checked as soon as the pair is bound
+        self.num_equal = sorted(set.intersection(*(
+            pairs(variables for tool, variables in conclusions if tool is None)
+            for _, conclusions in self.cases
+        )))
+        # pairs of variables that cannot be the same object,
+        # cheap to check as soon as the pair is bound
+        self.distinct = sorted(set.intersection(*(
+            pairs(variables for tool, _, variables in filters if tool.name == "not_eq") |
+            pairs(variables for tool, variables in conclusions if tool is None)
+            for filters, conclusions in self.cases
+        )))
+        self.conclusion_mask = _vars_mask(
+            v for _, conclusions in self.cases
+            for _, variables in conclusions for v in variables
+        )
+        self.steps = dict() # (mask of bound variables, atom index) -> JoinStep
+
+        # atoms of the same orbit under the symmetries give the same conclusions,
+        # only one of them is matched with a new relation
+        self.trigger_atoms = self._orbit_representatives()
+        self._generate()
+
+    # merges another rule with the same atoms (up to renaming of variables)
+    # as a new case, returns whether it succeeded
+    def merge(self, other):
+        if sorted(other.slot_types, key = id) != sorted(self.slot_types, key = id): return False
+        atoms = self._atoms_description(range(self.var_num))
+        for perm in other._type_permutations(self.slot_types):
+            if other._atoms_description(perm) == atoms: break
+        else: return False
+        def rename(variables): return tuple(perm[v] for v in variables)
+        for filters, conclusions in other.cases:
+            self.cases.append((
+                [(tool, hyper_params, rename(variables)) for tool, hyper_params, variables in filters],
+                [(tool, rename(variables)) for tool, variables in conclusions],
+            ))
+        self.name = self.name+"+"+other.name
+        self._compile()
+        return True
+
+    # the join step binding the variables of the atom atom_i
+    # after the variables in mask are bound
+    def step(self, mask, atom_i):
+        key = mask, atom_i
+        res = self.steps.get(key)
+        if res is None:
+            res = JoinStep(self, mask, atom_i)
+            self.steps[key] = res
+        return res
+
+    # generates the python code of the search for matches,
+    # a function for every join step (see JoinStep), the first steps
+    # matching an atom with a new relation are in self.trigger_functions,
+    # self.counting_trigger_functions are the same functions counting
+    # the candidates to env.stats_candidates (see RelStrEnv.count_candidates)
+    # binary atoms binding the same new variable are joined by intersecting
+    # their bitsets in RelStr.incidence, their labels are in self.incidence_labels
+    def _generate(self):
+        self.incidence_labels = set()
+        self.source, self.trigger_functions = self._generate_functions(False)
+        _, self.counting_trigger_functions = self._generate_functions(True)
+
+    def _generate_functions(self, count_candidates):
+        namespace = dict()
+        for j, (label, _) in enumerate(self.atoms): namespace["label{}".format(j)] = label
+        namespace["popcount"] = popcount
+        lines = []
+        def emit(indent, line): lines.append("    "*indent + line)
+        def values(variables): return "({},)".format(", ".join("v{}".format(v) for v in variables))
+        # the position known_i is known to fit
+        def fit_conditions(step, known_i = None):
+            return [
+                "data[{}] == {}".format(i, value) for i, value in step.fit_equal
+                if i != known_i
+            ] + [
+                "data[{}] != {}".format(i, value) for i, value in step.fit_differ
+            ] + [
+                "num_equal(data[{}], {})".format(i, value)
+                for i, value in step.fit_num_equal
+            ]
+        def emit_num_equal(conditions):
+            if any("num_equal" in condition for condition in conditions):
+                emit(1, "num_equal = env.num_equal")
+
+        # leaf: the numerical checks and conclusions of every case
+        def emit_conclusions(indent):
+            emit(indent, "num_model = env.num_model")
+            emit(indent, "num_equal = env.num_equal")
+            emit(indent, "res = True")
+            for ci, (filters, conclusions) in enumerate(self.cases):
+                checks = []
+                for k, (tool, hyper_params, variables) in enumerate(filters):
+                    name = "check{}_{}".format(ci, k)
+                    namespace[name] = self._num_check(tool, hyper_params)
+                    checks.append("{}({})".format(name, ", ".join(
+                        "num_model[v{}]".format(v) for v in variables
+                    )))
+                checks.extend(
+                    "num_equal(v{}, v{})".format(*variables)
+                    for tool, variables in conclusions
+                    if tool is None and tuple(sorted(variables)) not in self.num_equal
+                )
+                key = "({}, {})".format(ci, values(self.case_vars(ci)))
+                emit(indent, "if {} not in derived:".format(key))
+                emit(indent+1, "if {}:".format(" and ".join(checks) or "True"))
+                emit(indent+2, "derived.add({})".format(key))
+                for k, (_, variables) in enumerate(conclusions):
+                    emit(indent+2, "env.to_run.push(actions[{}][{}], {})".format(
+                        ci, k, values(variables)
+                    ))
+                emit(indent+1, "else: res = False")
+            emit(indent, "return res")
+
+        def emit_step(step):
+            if step.parent_vars: # binding to the result of a lookup
+                emit(0, "def {}(env, actions, derived, data{}):".format(
+                    step.name, "".join(", v{}".format(v) for v in step.parent_vars)
+                ))
+            else: # binding to a new relation
+                emit(0, "def {}(env, actions, data):".format(step.name))
+                conditions = fit_conditions(step)
+                emit_num_equal(conditions)
+                if conditions: emit(1, "if not ({}): return False".format(" and ".join(conditions)))
+                emit(1, "derived = set()")
+            for i,v in step.assign: emit(1, "v{} = data[{}]".format(v, i))
+            if step.membership:
+                emit(1, "t_to_data = env.t_to_data")
+                for j, variables in step.membership:
+                    emit(1, "if {} not in t_to_data[label{}]: return False".format(values(variables), j))
+            if not step.open_atoms:
+                emit_conclusions(1)
+                return []
+
+            if step.key_bound:
+                emit(1, "if derived and {}: return True".format(" and ".join(
+                    "({}, {}) in derived".format(ci, values(self.case_vars(ci)))
+                    for ci in range(len(self.cases))
+                )))
+            lookups = [ # (atom index, position, variable, weight)
+                (j, i, v, weight)
+                for j, bound, weight in step.open_atoms
+                for i,v in bound
+            ]
+            assert(lookups) # rules are connected
+            conditions = [fit_conditions(step.next_steps[j], i) for j,i,_,_ in lookups]
+            call_args = "env, actions, derived, data{}".format(
+                "".join(", v{}".format(v) for v in range(self.var_num) if step.mask & (1 << v))
+            )
+            def emit_call(indent, next_step):
+                if step.key_bound:
+                    emit(indent, "if {}({}): return True".format(next_step.name, call_args))
+                else: emit(indent, "{}({})".format(next_step.name, call_args))
+
+            # binary atoms binding the same new variable -> intersection of the bitsets
+            var_to_lookups = dict()
+            for n, (j, i, _, _) in enumerate(lookups):
+                _, variables = self.atoms[j]
+                if len(variables) == 2:
+                    var_to_lookups.setdefault(variables[1-i], []).append(n)
+            common = next((ns for ns in var_to_lookups.values() if len(ns) >= 2), None)
+            if common is not None:
+                emit_num_equal(conditions[common[0]])
+                emit(1, "incidence = env.incidence")
+                emit(1, "rows = incidence.rows")
+                emit(1, "common = {}".format(" & ".join(
+                    "rows.get((label{}, v{}, {}), 0)".format(j, v, i)
+                    for j, i, v, _ in (lookups[n] for n in common)
+                )))
+                emit(1, "if not common: return False")
+                if count_candidates: emit(1, "env.stats_candidates += popcount(common)")
+                self.incidence_labels.update(self.atoms[lookups[n][0]][0] for n in common)
+                j, i, v, _ = lookups[common[0]]
+                emit(1, "for obj in incidence.objs(common):")
+                emit(2, "data = {}".format("(v{}, obj)".format(v) if i == 0 else "(obj, v{})".format(v)))
+                indent = 2
+                if conditions[common[0]]:
+                    emit(2, "if {}:".format(" and ".join(conditions[common[0]])))
+                    indent = 3
+                emit_call(indent, step.next_steps[j])
+                emit(1, "return False")
+                return [step.next_steps[j]]
+
+            # otherwise select the atom with the fewest candidates
+            emit(1, "tobj_to_nb = env.tobj_to_nb")
+            emit_num_equal(sum(conditions, []))
+            for n, (j, i, v, weight) in enumerate(lookups):
+                name = "c{}".format(n)
+                emit(1, "{} = tobj_to_nb.get((label{}, v{}, {}))".format(name, j, v, i))
+                emit(1, "if not {}: return False".format(name))
+                size = "len({})".format(name)
+                if weight != 1: size += "*{}".format(weight)
+                if n == 0: emit(1, "best, size, best_n = {}, {}, {}".format(name, size, n))
+                else: emit(1, "if {} < size: best, size, best_n = {}, {}, {}".format(size, name, size, n))
+            if count_candidates: emit(1, "env.stats_candidates += len(best)")
+
+            for n, ((j, i, _, _), step_conditions) in enumerate(zip(lookups, conditions)):
+                next_step = step.next_steps[j]
+                if len(lookups) > 1:
+                    emit(1, "{} best_n == {}:".format("if" if n == 0 else "elif", n))
+                    emit(2, "for data in best:")
+                else: emit(1, "for data in best:")
+                indent = 3
+                if step_conditions:
+                    emit(3, "if {}:".format(" and ".join(step_conditions)))
+                    indent = 4
+                emit_call(indent, next_step)
+            emit(1, "return False")
+            return [step.next_steps[j] for j,_,_,_ in lookups]
+
+        generated = set()
+        to_generate = [self.step(0, i) for i in self.trigger_atoms]
+        while to_generate:
+            step = to_generate.pop()
+            if step.name in generated: continue
+            generated.add(step.name)
+            to_generate.extend(emit_step(step)) # the called join steps
+
+        source = "\n".join(lines)
+        exec(source, namespace)
+        return source, dict(
+            (i, namespace[self.step(0, i).name])
+            for i in self.trigger_atoms
+        )
+
+    # sorted variables of the conclusions of a case
+    def case_vars(self, ci):
+        _, conclusions = self.cases[ci]
+        return sorted(set(v for _, variables in conclusions for v in variables))
+
+    def _num_check(self, tool, hyper_params):
+        if isinstance(tool, PrimitivePred): return tool.num_check
+        def num_check(*num_args):
+            try: tool.run_num(hyper_params, num_args)
+            except ToolError: return False
+            return True
+        return num_check
+
+    # the description of the rule after renaming the variables
+    @staticmethod
+    def _normalize(name, variables, perm):
+        variables = tuple(perm[v] for v in variables)
+        if name in _symmetric_preds or name is None: variables = tuple(sorted(variables))
+        return variables
+    def _atoms_description(self, perm):
+        return frozenset(
+            (label, self._normalize(label, variables, perm))
+            for label, variables in self.atoms
+        )
+    def _description(self, perm):
+        return self._atoms_description(perm), frozenset(
+            (
+                frozenset(
+                    (tool, hyper_params, self._normalize(tool.name, variables, perm))
+                    for tool, hyper_params, variables in filters
+                ),
+                frozenset(
+                    (tool, self._normalize(tool, variables, perm))
+                    for tool, variables in conclusions
+                ),
+            )
+            for filters, conclusions in self.cases
+        )
+
+    # all the mappings of the variables to the variables of the given types
+    # (by default the own ones) preserving the types
+    def _type_permutations(self, slot_types = None):
+        if slot_types is None: slot_types = self.slot_types
+        def type_to_slots(slot_types):
+            res = dict()
+            for v,t in enumerate(slot_types): res.setdefault(t, []).append(v)
+            return res
+        groups = type_to_slots(self.slot_types)
+        targets = type_to_slots(slot_types)
+        types = list(groups.keys())
+        for images in product(*(permutations(targets[t]) for t in types)):
+            perm = list(range(self.var_num))
+            for t, image in zip(types, images):
+                for v, w in zip(groups[t], image): perm[v] = w
+            yield perm
+
+    def _orbit_representatives(self):
+        original = self._description(range(self.var_num))
+        automorphisms = [
+            perm for perm in self._type_permutations()
+            if self._description(perm) == original
+        ]
+        representatives = []
+        covered = set()
+        for i, (label, variables) in enumerate(self.atoms):
+            if i in covered: continue
+            representatives.append(i)
+            for perm in automorphisms:
+                image = label, tuple(perm[v] for v in variables)
+                covered.update(j for j,atom in enumerate(self.atoms) if atom == image)
+        return representatives
+
+def _vars_mask(variables):
+    res = 0
+    for v in variables: res |= 1 << v
+    return res
+
+"""
+JoinStep is a precompiled step of the search for a match of a rule.
+Given the variables bound so far (mask), it binds the variables of an atom
+to a relation (data) taken from the RelStr, and prepares
+the checks to be done, and the atoms to be joined next.
+"""
+class JoinStep:
+    def __init__(self, rule, mask, atom_i):
+        self.name = "step_{}_{}".format(mask, atom_i)
+        self.parent_vars = [v for v in range(rule.var_num) if mask & (1 << v)]
+        label, variables = rule.atoms[atom_i]
+        self.assign = [] # (position in data, variable)
+        position = dict() # variable -> position in data
+        # conditions on data for fitting to the atom
+        # (data[i] == value of v / data[j], data[i] != value of v / data[j])
+        self.fit_equal = []
+        self.fit_differ = []
+        def value(v):
+            if v in position: return "data[{}]".format(position[v])
+            else: return "v{}".format(v)
+        new_mask = mask
+        for i,v in enumerate(variables):
+            if new_mask & (1 << v): self.fit_equal.append((i, value(v)))
+            else:
+                self.assign.append((i,v))
+                position[v] = i
+                new_mask |= 1 << v
+        self.mask = new_mask
+        def bound(variables, mask):
+            return _vars_mask(variables) & ~mask == 0
+
+        # pairs of variables bound just now, they must be different objects
+        for a,b in rule.distinct:
+            if a in position and bound((b,), new_mask): self.fit_differ.append((position[a], value(b)))
+            elif b in position and bound((a,), new_mask): self.fit_differ.append((position[b], value(a)))
+        # pairs of variables bound just now, they must be numerically equal
+        self.fit_num_equal = []
+        for a,b in rule.num_equal:
+            if a in position and bound((b,), new_mask): self.fit_num_equal.append((position[a], value(b)))
+            elif b in position and bound((a,), new_mask): self.fit_num_equal.append((position[b], value(a)))
+        # atoms bound just now, they must be present in the RelStr
+        self.membership = [
+            (j, variables2)
+            for j, (_, variables2) in enumerate(rule.atoms)
+            if j != atom_i and bound(variables2, new_mask) and not bound(variables2, mask)
+        ]
+        # atoms to be joined later: (atom index, label, bound positions, weight)
+        # the atoms allowing a numerical equality check are preferred,
+        # other atoms have their number of candidates doubled (weight 2)
+        def selective(variables):
+            mask2 = new_mask | _vars_mask(variables)
+            return any(
+                bound((a,b), mask2) and not bound((a,b), new_mask)
+                for a,b in rule.num_equal
+            )
+        self.open_atoms = [
+            (
+                j, [(i,v) for i,v in enumerate(variables2) if new_mask & (1 << v)],
+                1 if selective(variables2) else 2,
+            )
+            for j, (_, variables2) in enumerate(rule.atoms)
+            if not bound(variables2, new_mask)
+        ]
+        self.key_bound = rule.conclusion_mask & ~new_mask == 0
+
+        # atom index -> the next join step
+        self.next_steps = dict(
+            (j, rule.step(new_mask, j))
+            for j,_,_ in self.open_atoms
+        )
+
+# the rules are found next to this file, independently of the working directory
+default_rules_fname = os.path.join(os.path.dirname(os.path.abspath(__file__)), "triggers.gl")
+
+# compiled rules are shared by all the logical cores with the same tools
+_rules_cache = dict() # (fname, tool dictionary id) -> (tool dictionary, list of TriggerRule)
+def load_trigger_rules(tool_dict, fname = default_rules_fname):
+    key = fname, id(tool_dict)
+    cached = _rules_cache.get(key)
+    if cached is not None and cached[0] is tool_dict: return cached[1]
+    from parse import Parser # parse imports the logical core
+    parser = Parser(tool_dict)
+    parser.parse_file(fname, axioms = True)
+    rule_tools = [
+        tool for key, tool in parser.tool_dict.items()
+        if key not in tool_dict
+    ]
+    rules = []
+    for tool in rule_tools:
+        rule = TriggerRule(tool)
+        if not any(rule2.merge(rule) for rule2 in rules): rules.append(rule)
+    _rules_cache[key] = tool_dict, rules
+    return rules
+
+class RuleTriggerEnv(RelStrEnv):
+    def __init__(self, rel_names, logic, fname = default_rules_fname):
+        RelStrEnv.__init__(self, logic)
+        self.tobj_to_nb = self.relstr.tobj_to_nb
+        self.t_to_data = self.relstr.t_to_data
+        self.rules = load_trigger_rules(rel_names.tool_dict, fname)
+        for rule in self.rules: self.incidence.labels.update(rule.incidence_labels)
+        # label -> list of generated trigger functions applied to data
+        self.label_to_rules = dict()
+        self.label_to_counting_rules = dict() # the same with counting_trigger_functions
+        self.label_to_rule_names = dict() # label -> names of the rules in label_to_rules
+        self.to_run.register(self.glue_trig, GLUE_PRIORITY, symmetric = True)
+        tool_to_action = dict() # shared by the rules, so that they are deduplicated
+        def get_action(tool):
+            if tool is None: return self.glue_trig
+            action = tool_to_action.get(tool)
+            if action is None:
+                action = partial(self.construct_trig, tool)
+                tool_to_action[tool] = action
+                self.to_run.register(action, CONSTRUCT_PRIORITY)
+            return action
+        for rule in self.rules:
+            actions = [
+                [get_action(tool) for tool,_ in conclusions]
+                for _, conclusions in rule.cases
+            ]
+            for i, function in rule.trigger_functions.items():
+                label, _ = rule.atoms[i]
+                counting_function = rule.counting_trigger_functions[i]
+                self.label_to_rules.setdefault(label, []).append(partial(function, self, actions))
+                self.label_to_counting_rules.setdefault(label, []).append(
+                    partial(counting_function, self, actions)
+                )
+                self.label_to_rule_names.setdefault(label, []).append(rule.name)
+
+    def add(self, t, data):
+        if self.count_candidates: rules = self.label_to_counting_rules.get(t)
+        else: rules = self.label_to_rules.get(t)
+        if rules is None: return
+        if self.relstr.add_rel(t, data):
+            for name, function in zip(self.label_to_rule_names[t], rules):
+                self._call_handler(name, function, data)
+
+    def glue_trig(self, pair):
+        a,b = pair
+        self.logic.glue(a,b)
+
+    # the construction "tool" applied to args is equal to out
+    def construct_trig(self, tool, objs):
+        *args, out = objs
+        out_tup = self.logic.get_constr(tool, args)
+        if out_tup is None: self.logic.add_constr(tool, tuple(args), (out,))
+        else:
+            out2, = out_tup
+            if out2 != out: self.logic.glue(out, out2)
@@ -1,5 +1,9 @@
 from collections import defaultdict
+from array import array
+from struct import Struct
+from operator import itemgetter
 from stop_watch import StopWatch
+from undo_trail import DummyTrail
 
 """
 UnionFindDict is a dictionary-like structure for the lookup table of the logical core.
@@ -17,49 +21,147 @@ makes the two objects equal from the perspective of the UnionFindDict.
 The "glue" function returns the list of all pairs (a,b) that were glued,
 they include the initial (obj1, obj2) and other pairs glued
 due to extensionality.
+Internally, the labels are interned to small integers, and the keys
+(label, input) are packed into short bytes objects (see _pack_key),
+the stored entries can be listed by items().
+If a label has the attribute "symmetries" (permutations of the input,
+see MemoizedTool.add_symmetry), only the lexicographically smallest
+of the permuted inputs is stored, and queries are canonicalized the same way.
+All the modifications are recorded to an UndoTrail (if given),
+so the structure can be rolled back together with the logical core.
 """
 
+# packing of a label id and objects (non-negative integers) into bytes
+_key_structs = []
+def _key_struct(size):
+    while len(_key_structs) <= size:
+        _key_structs.append(Struct("{}I".format(len(_key_structs)+1)))
+    return _key_structs[size]
+
 class UnionFindDict:
-    def __init__(self):
-        self.data = dict() # the main dictionary
+    def __init__(self, trail = None):
+        if trail is None: trail = DummyTrail()
+        self.trail = trail
+        self.data = dict() # the main dictionary, packed key -> output
+        # obj -> list of packed (label, input) such that obj in input or output,
+        # removed keys are not deleted from the lists, see _obj_keys
+        self.obj_to_keys = defaultdict(list)
+        self.label_to_id = dict() # label -> small integer
+        self.id_to_label = []     # inverse of label_to_id
+        self.id_to_symmetries = [] # label id -> list of permutations of input (as itemgetters)
+        self._init_union_find()
+
+    ## union-find part, can be replaced by a descendant (see UnionFindArrayDict)
+
+    def _init_union_find(self):
         self.obj_to_root_d = dict()             # obj -> (representative) obj
         self.obj_to_children = defaultdict(set) # inverse of obj_to_root
-        self.obj_to_keys = defaultdict(set) # obj -> (label, input) such that obj in input or output
 
     def obj_to_root(self, obj):
         return self.obj_to_root_d.get(obj, obj)
     def tup_to_root(self, tup):
         return tuple(map(self.obj_to_root, tup))
 
+    # all objects equal to obj, the root first
+    def class_members(self, obj):
+        root = self.obj_to_root(obj)
+        return [root] + list(self.obj_to_children.get(root, ()))
+
+    # the root used for gluing, a descendant may compress paths there
+    def _glue_root(self, obj):
+        return self.obj_to_root(obj)
+
+    # connect two different roots, returns the pair (new root, glued root)
+    def _union(self, n1, n2):
+        c1, c2 = [
+            len(self.obj_to_children[n]) + len(self.obj_to_keys.get(n, ()))
+            for n in (n1, n2)
+        ]
+        if c1 < c2: n1, n2 = n2, n1
+
+        self.trail.set_item(self.obj_to_root_d, n2, n1)
+        children1 = self.obj_to_children[n1]
+        children2 = self.obj_to_children[n2]
+        for child in children2:
+            self.trail.set_item(self.obj_to_root_d, child, n1)
+            self.trail.set_add(children1, child)
+        self.trail.set_add(children1, n2)
+        self.trail.save_set(children2)
+        children2.clear()
+        return n1, n2
+
+    ## lookup table
+
+    # the labels are interned forever, also after a rollback, it does not harm
+    def _label_id(self, label):
+        label_id = self.label_to_id.get(label)
+        if label_id is None:
+            label_id = len(self.id_to_label)
+            self.label_to_id[label] = label_id
+            self.id_to_label.append(label)
+            self.id_to_symmetries.append(tuple(
+                itemgetter(*perm)
+                for perm in getattr(label, "symmetries", ())
+                if len(perm) > 1
+            ))
+        return label_id
+
+    def _canonical_args(self, label_id, args):
+        res = args
+        for perm in self.id_to_symmetries[label_id]:
+            perm_args = perm(args)
+            if perm_args < res: res = perm_args
+        return res
+
+    def _pack_key(self, label_id, args):
+        return _key_struct(len(args)).pack(label_id, *args)
+    def _unpack_key(self, key):
+        label_id, *args = _key_struct(len(key) // 4 - 1).unpack(key)
+        return self.id_to_label[label_id], tuple(args)
+
+    def items(self): # iterator of ((label, input), output)
+        for key, vals in self.data.items():
+            yield self._unpack_key(key), vals
+
+    # args are expected to be roots, returns the canonical args
     def _data_add(self, label, args, vals):
         #print("_data_add", label, args, vals)
-        key = label, args
+        label_id = self._label_id(label)
+        args = self._canonical_args(label_id, args)
+        key = self._pack_key(label_id, args)
         if key in self.data:
-            if self.data[key] == vals: return
-            raise KeyError("key {} is already in the uf_dictionary".format(key))
-        self.data[key] = vals
+            if self.data[key] == vals: return args
+            raise KeyError("key {} is already in the uf_dictionary".format((label, args)))
+        self.trail.set_item(self.data, key, vals)
         for obj in args + vals:
             #print("  obj_to_keys[{}] :".format(obj))
             #print("    {}".format(self.obj_to_keys[obj]))
-            self.obj_to_keys[obj].add(key)
+            self.trail.list_append(self.obj_to_keys[obj], key)
             #print("    {}".format(self.obj_to_keys[obj]))
+        return args
 
-    def _data_remove(self, label, args):
-        #print("_data_remove", label, args)
-        key = label, args
-        vals = self.data[key]
-        del self.data[key]
-        for obj in args + vals:
-            #print("  obj_to_keys[{}] :".format(obj))
-            #print("    {}".format(self.obj_to_keys[obj]))
-            self.obj_to_keys[obj].discard(key)
-            #print("    {}".format(self.obj_to_keys[obj]))
-        return vals
+    def _data_remove(self, key):
+        #print("_data_remove", self._unpack_key(key))
+        label, args = self._unpack_key(key)
+        vals = self.trail.pop_item(self.data, key)
+        return label, args, vals
+
+    # removes the list of keys of a root obj, and returns the keys
+    # currently in the table containing obj
+    def _obj_keys(self, obj):
+        keys = self.trail.pop_item(self.obj_to_keys, obj) if obj in self.obj_to_keys else ()
+        res = []
+        for key in dict.fromkeys(keys):
+            vals = self.data.get(key)
+            if vals is None: continue
+            _, args = self._unpack_key(key)
+            if obj in args or obj in vals: res.append(key)
+        return res
 
     def add(self, label, args, vals):
         #print('add', label, args, vals)
         args, vals = map(self.tup_to_root, (args, vals))
-        self._data_add(label, args, vals)
+        args = self._data_add(label, args, vals)
         return args, vals
 
     def is_equal(self, n1, n2):
@@ -77,28 +179,14 @@ class UnionFindDict:
         to_glue = list(pairs)
         while to_glue:
             n1, n2 = to_glue.pop()
-            n1, n2 = map(self.obj_to_root, (n1, n2))
+            n1, n2 = map(self._glue_root, (n1, n2))
             if n1 == n2: continue
 
-            c1, c2 = [
-                len(self.obj_to_children[n]) + len(self.obj_to_keys[n])
-                for n in (n1, n2)
-            ]
-            if c1 < c2: n1, n2 = n2, n1
-
+            n1, n2 = self._union(n1, n2)
             changed.append((n1, n2))
-            self.obj_to_root_d[n2] = n1
-            children1 = self.obj_to_children[n1]
-            children2 = self.obj_to_children[n2]
-            for child in children2:
-                self.obj_to_root_d[child] = n1
-            children1.update(children2)
-            children1.add(n2)
-            children2.clear()
             #print("{} : {}".format(n2, self.obj_to_keys[n2]))
-            for key in tuple(self.obj_to_keys[n2]):
-                label, args = key
-                vals = self._data_remove(label, args)
+            for key in self._obj_keys(n2):
+                label, args, vals = self._data_remove(key)
                 args, vals = map(self.tup_to_root, (args, vals))
                 ori_val = self.get(label, args)
                 if ori_val is not None:
@@ -109,11 +197,86 @@ class UnionFindDict:
         return changed
 
     def __contains__(self, key):
-        return self.tup_to_root(key) in self.data
+        label, args = key
+        return self.get(label, args) is not None
 
     def get(self, label, args): # default = None, otherwise tuple
-        args = self.tup_to_root(args)
-        return self.data.get((label, args), None)
+        label_id = self.label_to_id.get(label)
+        if label_id is None: return None
+        args = self._canonical_args(label_id, self.tup_to_root(args))
+        return self.data.get(self._pack_key(label_id, args), None)
+
+"""
+UnionFindArrayDict is an alternative to UnionFindDict with the same interface.
+The objects must be non-negative integers (as the geometrical references
+in the logical core). Instead of keeping the representative of every object
+in a dictionary, and rewriting it for all the objects of a class on gluing,
+it stores a standard union-find forest in compact arrays
+(union by size), and the classes as cyclic linked lists (next_member)
+spliced on gluing. The paths are compressed only when gluing, so the reading
+functions (obj_to_root, get, is_equal, class_members) do not write
+to the undo trail.
+"""
+class UnionFindArrayDict(UnionFindDict):
+
+    def _init_union_find(self):
+        self.parent = array('i')      # obj -> parent obj, root -> root
+        self.class_size = array('i')  # root -> number of objects in its class
+        self.next_member = array('i') # obj -> next object in its class (cyclic)
+
+    def _extend(self, obj): # objects out of the arrays are considered to be roots
+        n = len(self.parent)
+        if obj < n: return
+        new_objs = range(n, obj+1)
+        self.parent.extend(new_objs)
+        self.next_member.extend(new_objs)
+        self.class_size.extend(1 for _ in new_objs)
+
+    def _set(self, arr, index, value):
+        self.trail.push(arr.__setitem__, index, arr[index])
+        arr[index] = value
+
+    def obj_to_root(self, obj):
+        parent = self.parent
+        if obj is None or obj >= len(parent): return obj # None is accepted as by UnionFindDict
+        root = parent[obj]
+        while parent[root] != root: root = parent[root]
+        return root
+
+    def _glue_root(self, obj):
+        root = self.obj_to_root(obj)
+        if root is None: return root
+        # path compression
+        parent = self.parent
+        while obj != root and parent[obj] != root:
+            next_obj = parent[obj]
+            self._set(parent, obj, root)
+            obj = next_obj
+        return root
+
+    def class_members(self, obj):
+        root = self.obj_to_root(obj)
+        if root >= len(self.parent): return [root]
+        next_member = self.next_member
+        res = [root]
+        x = next_member[root]
+        while x != root:
+            res.append(x)
+            x = next_member[x]
+        return res
+
+    def _union(self, n1, n2):
+        self._extend(max(n1, n2))
+        size = self.class_size
+        if size[n1] < size[n2]: n1, n2 = n2, n1
+        self._set(self.parent, n2, n1)
+        self._set(size, n1, size[n1] + size[n2])
+        # splice the cyclic lists
+        next_member = self.next_member
+        next1, next2 = next_member[n1], next_member[n2]
+        self._set(next_member, n1, next2)
+        self._set(next_member, n2, next1)
+        return n1, n2
 
 if __name__ == "__main__":
     d = UnionFindDict()
@@ -127,4 +290,4 @@ if __name__ == "__main__":
     d.add("H", (3,), (5,))
     d.glue(1, 4)
     d.glue(2, 5)
-    print(d.data)
+    print(dict(d.items()))
@@ -0,0 +1,119 @@
+"""
+UndoTrail allows reverting a logical core to an earlier state without
+rebuilding it from scratch. Every structure of the logical core
+(UnionFindDict, ElimMatrix, AngleChasing, RelStr, ...) modifies its
+containers through the helper methods of a shared trail, such as
+  trail.set_item(d, key, value)  instead of  d[key] = value
+and the trail remembers how to revert every such modification.
+  checkpoint()
+returns the current position on the trail, and
+  rollback(position)
+reverts all the modifications done since then, in the reverse order.
+
+DummyTrail has the same interface but it only performs the modifications.
+It is used by the logical cores which are never rolled back (proof checks),
+so that they do not pay for the memory of the trail.
+"""
+
+_missing = object()
+
+class DummyTrail:
+    def checkpoint(self):
+        return None
+    def rollback(self, position):
+        raise Exception("DummyTrail does not support rollback")
+
+    # general undo action
+    def push(self, undo_f, *args):
+        pass
+
+    # dictionaries
+    def set_item(self, d, key, value):
+        d[key] = value
+    def del_item(self, d, key):
+        del d[key]
+    def pop_item(self, d, key):
+        return d.pop(key)
+
+    # sets
+    def set_add(self, s, x):
+        s.add(x)
+    def set_discard(self, s, x):
+        s.discard(x)
+
+    # lists
+    def list_append(self, l, x):
+        l.append(x)
+    def list_extend(self, l, xs):
+        l.extend(xs)
+
+    # called before an in-place modification of a whole dictionary (e.g. SparseRow)
+    def save_dict(self, d):
+        pass
+    # called before an in-place modification of a whole set
+    def save_set(self, s):
+        pass
+    # called before a modification of an attribute
+    def save_attr(self, obj, name):
+        pass
+
+def _restore_item(d, key, value):
+    if value is _missing: d.pop(key, None)
+    else: d[key] = value
+def _restore_dict(d, data):
+    dict.clear(d)
+    dict.update(d, data)
+def _restore_set(s, data):
+    s.clear()
+    s.update(data)
+def _truncate_list(l, size):
+    del l[size:]
+
+class UndoTrail(DummyTrail):
+    def __init__(self):
+        self.trail = [] # list of pairs (undo function, arguments)
+
+    def checkpoint(self):
+        return len(self.trail)
+    def rollback(self, position):
+        trail = self.trail
+        while len(trail) > position:
+            undo_f, args = trail.pop()
+            undo_f(*args)
+
+    def push(self, undo_f, *args):
+        self.trail.append((undo_f, args))
+
+    def set_item(self, d, key, value):
+        self.trail.append((_restore_item, (d, key, d.get(key, _missing))))
+        d[key] = value
+    def del_item(self, d, key):
+        value = d.pop(key)
+        self.trail.append((_restore_item, (d, key, value)))
+    def pop_item(self, d, key):
+        value = d.pop(key)
+        self.trail.append((_restore_item, (d, key, value)))
+        return value
+
+    def set_add(self, s, x):
+        if x in s: return
+        s.add(x)
+        self.trail.append((s.discard, (x,)))
+    def set_discard(self, s, x):
+        if x not in s: return
+        s.discard(x)
+        self.trail.append((s.add, (x,)))
+
+    def list_append(self, l, x):
+        self.trail.append((_truncate_list, (l, len(l))))
+        l.append(x)
+    def list_extend(self, l, xs):
+        self.trail.append((_truncate_list, (l, len(l))))
+        l.extend(xs)
+
+    def save_dict(self, d):
+        self.trail.append((_restore_dict, (d, dict(d))))
+    def save_set(self, s):
+        self.trail.append((_restore_set, (s, set(s))))
+    def save_attr(self, obj, name):
+        self.trail.append((setattr, (obj, name, getattr(obj, name))))
@@ -0,0 +1,73 @@
+"""
+WorkQueue is the queue of pending trigger actions (see triggers.py).
+An action is a function applied to a tuple of geometrical references,
+it is scheduled by
+  queue.push(action, args)
+and the next one is obtained by queue.pop() (None if the queue is empty).
+Every action can be registered with
+  queue.register(action, priority, symmetric)
+the actions of a lower priority are popped first (default 0),
+among the same priority, the last pushed action is popped first.
+If the action is symmetric, the order of args does not matter.
+A pushed action is ignored if the same action with the same args
+(mapped to the representatives by obj_to_root) is already pending.
+The queue counts the pushed, deduplicated and executed actions,
+see stats().
+"""
+
+GLUE_PRIORITY = 0
+CONSTRUCT_PRIORITY = 1
+
+class WorkQueue:
+    def __init__(self, obj_to_root):
+        self.obj_to_root = obj_to_root
+        self.action_info = dict() # action -> (priority, symmetric)
+        self.stacks = [] # priority -> list of (action, args)
+        self.pending = set() # keys of the actions in the stacks
+        self.size = 0
+        self.stats_pushed = 0
+        self.stats_dedup = 0
+        self.stats_executed = 0
+
+    def register(self, action, priority = 0, symmetric = False):
+        self.action_info[action] = priority, symmetric
+        while len(self.stacks) <= priority: self.stacks.append([])
+
+    def push(self, action, args):
+        self.stats_pushed += 1
+        priority, symmetric = self.action_info.get(action, (0, False))
+        roots = tuple(map(self.obj_to_root, args))
+        if symmetric: roots = tuple(sorted(roots))
+        key = action, roots
+        if key in self.pending:
+            self.stats_dedup += 1
+            return
+        self.pending.add(key)
+        if not self.stacks: self.stacks.append([])
+        self.stacks[priority].append((action, args, key))
+        self.size += 1
+
+    # returns (action, args), or None if there is no pending action
+    def pop(self):
+        if not self.size: return None
+        for stack in self.stacks:
+            if stack: break
+        action, args, key = stack.pop()
+        self.pending.discard(key)
+        self.size -= 1
+        return action, args
+
+    def clear(self):
+        for stack in self.stacks: stack.clear()
+        self.pending.clear()
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def stats(self):
+        return {
+            "pushed" : self.stats_pushed,
+            "deduplicated" : self.stats_dedup,
+            "executed" : self.stats_executed,
+        }